@@ -0,0 +1,90 @@
+'''Compare io.read_gpx with the element-by-element xmlmisc.iterparse path
+it replaced.
+
+Usage::
+
+    python benchmarks/bench_read_gpx.py [GPX file | number of points]
+
+With no argument, a GPX file of 100000 trackpoints is generated in a
+temporary folder.
+
+'''
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from pyxie import io
+from pyxie import xmlmisc
+
+
+def read_gpx_iterparse(fileobj):
+    '''The old read_gpx: a Python object and a timestamp conversion for
+    every trackpoint.'''
+    rows = []
+    for trkpt, elem in xmlmisc.iterparse(fileobj, cls=xmlmisc.GPXTrackpoint):
+        if trkpt:
+            elev = elem.elev
+            rows.append((elem.time, elem.lon, elem.lat,
+                         np.nan if elev is None else elev))
+    return np.array(rows, dtype=np.float64).reshape(-1, 4)
+
+
+def write_test_gpx(fn, n, t0=1375941964):
+    '''Write a GPX file of *n* trackpoints, one second apart, in segments
+    of 50000.'''
+    times = xmlmisc.epoch_to_iso8601(t0 + np.arange(n, dtype=np.float64))
+    with open(fn, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<gpx xmlns="http://www.topografix.com/GPX/1/1" '
+                'version="1.1" creator="bench"><trk><trkseg>')
+        for i in range(n):
+            if i and i % 50000 == 0:
+                f.write('</trkseg><trkseg>')
+            f.write('<trkpt lat="%.10f" lon="%.10f"><ele>%.2f</ele>'
+                    '<time>%s</time></trkpt>' % (
+                    -35.0 + i * 1e-5, 138.58 + i * 1e-5 * (i % 7 - 3),
+                    47.72 + i % 100 * 0.1, times[i]))
+        f.write('</trkseg></trk></gpx>\n')
+
+
+def best_time(func, fn, repeat=3):
+    best = None
+    for i in range(repeat):
+        t0 = time.time()
+        result = func(fn)
+        elapsed = time.time() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main(argv):
+    arg = argv[1] if len(argv) > 1 else '100000'
+    tmpdir = None
+    if os.path.isfile(arg):
+        fn = arg
+    else:
+        tmpdir = tempfile.mkdtemp()
+        fn = os.path.join(tmpdir, 'bench.gpx')
+        write_test_gpx(fn, int(arg))
+    try:
+        size_mb = os.path.getsize(fn) / 1e6
+        t_old, old = best_time(read_gpx_iterparse, fn)
+        t_new, new = best_time(io.read_gpx, fn)
+        print('%s: %d points, %.1f MB' % (fn, len(new), size_mb))
+        print('xmlmisc.iterparse  %7.3f s  %6.1f MB/s' % (t_old, size_mb / t_old))
+        print('io.read_gpx        %7.3f s  %6.1f MB/s' % (t_new, size_mb / t_new))
+        print('speedup            %7.1fx' % (t_old / t_new))
+        same = np.array_equal(np.isnan(old), np.isnan(new)) and \
+            np.array_equal(old[~np.isnan(old)], new[~np.isnan(new)])
+        print('same output        %s' % same)
+    finally:
+        if tmpdir:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
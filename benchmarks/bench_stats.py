@@ -0,0 +1,80 @@
+'''Compare stats.track_stats and stats.SelectionStats with the stats.Path
+class they replaced in the track editor.
+
+Usage::
+
+    python benchmarks/bench_stats.py [number of points]
+
+'''
+import sys
+import time
+
+import numpy as np
+
+from pyxie import core
+from pyxie import stats
+
+
+def random_track(n, seed=0):
+    rng = np.random.RandomState(seed)
+    times = 1e9 + np.cumsum(rng.choice([1., 1., 2., 5.], n))
+    lons = 138.6 + np.cumsum(rng.normal(0, 1e-5, n))
+    lats = -35. + np.cumsum(rng.normal(0, 1e-5, n))
+    elevs = 50 + np.cumsum(rng.normal(0, 0.5, n))
+    return times, lons, lats, elevs
+
+
+def best_time(func, repeat=3):
+    best = None
+    for i in range(repeat):
+        t0 = time.time()
+        func()
+        elapsed = time.time() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 1000000
+    times, lons, lats, elevs = random_track(n)
+    geodesic = core.geodesic(lons, lats, times)
+    xs, ys = core.convert_coordinate_system(lons, lats)
+    selection = stats.SelectionStats(times, lons, lats, elevs,
+                                     geodesic=geodesic)
+    rng = np.random.RandomState(1)
+    ranges = [sorted(rng.randint(0, n + 1, 2)) for k in range(20)]
+
+    def path_queries():
+        for i, j in ranges:
+            stats.Path.from_lonlat(lons[i:j], lats[i:j], times[i:j])
+
+    def selection_queries():
+        for i, j in ranges:
+            selection.query(i, j)
+
+    rows = [
+        ('Path on projected x/y',
+         lambda: stats.Path(xs, ys, times)),
+        ('Path.from_lonlat, given geodesic',
+         lambda: stats.Path.from_lonlat(lons, lats, times, geodesic=geodesic)),
+        ('track_stats, given geodesic',
+         lambda: stats.track_stats(times, lons, lats, elevs,
+                                   geodesic=geodesic)),
+        ('project + Path',
+         lambda: stats.Path(*(core.convert_coordinate_system(lons, lats) +
+                              (times, )))),
+        ('geodesic + track_stats',
+         lambda: stats.track_stats(times, lons, lats, elevs)),
+        ('SelectionStats build',
+         lambda: stats.SelectionStats(times, lons, lats, elevs,
+                                      geodesic=geodesic)),
+        ('20 random ranges, Path.from_lonlat', path_queries),
+        ('20 random ranges, SelectionStats', selection_queries),
+    ]
+    print('%d points' % n)
+    for name, func in rows:
+        print('%-40s %9.1f ms' % (name, best_time(func) * 1000))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,955 @@
+'''Store many tracks in a single time-sorted archive.
+
+An archive is a folder of NumPy ``.npy`` files and a small JSON header. Use
+:class:`ArchiveWriter` (or :func:`pyxie.io.import_files`) to create one and
+:class:`Archive` to read it.
+
+Format
+------
+
+``header.json``
+    A JSON object with keys ``format_version`` (currently 3), ``npoints``
+    (number of points stored), ``sources`` (list of source filenames; the
+    position of a filename in this list is its track id), ``errors`` (dict
+    of messages for sources which could not be imported),
+    ``duplicates`` (dict mapping sources whose points are identical to an
+    earlier source's to that source) and ``owners`` (list of the names of
+    the people or devices the points belong to; the first is ``''``, for
+    points whose owner is not known).
+
+``time.npy``, ``lon.npy``, ``lat.npy``, ``elev.npy``
+    float64 columns of length ``npoints`` holding every point from every
+    source, sorted by time (seconds since the epoch, UTC). The sort is
+    stable and points without a time go at the end. Missing values are NaN.
+
+``track.npy``
+    int32 column of length ``npoints`` with the track id of each point.
+    A point which is in several sources is stored once, under one of them.
+    :class:`ArchiveWriter` picks the source with the lowest track id, but
+    :func:`update_archive` leaves a point that is already stored under the
+    source storing it, so after an update this may be any of them.
+
+``owner.npy``
+    int16 column of length ``npoints`` with the position of the owner of
+    each point in ``owners``. Older archives may lack it, in which case no
+    owners are known.
+
+``refs.npy``
+    The shared points: one :data:`REFS_DTYPE` record, sorted by track id,
+    for each point of a source which is stored under another source. GPS
+    units often save the same stretch of track more than once (e.g. Garmin
+    "Auto" logs and tracks saved by hand), and these points are only stored
+    once. Older archives may lack it, in which case no points are shared.
+
+``tracks.npy``
+    The offsets table: one :data:`TRACKS_DTYPE` record per source. All the
+    points of track *i* lie in positions ``start:stop`` of the columns, and
+    there are ``npoints`` of them (including shared points), so when
+    ``npoints == stop - start`` the track is contiguous and can be sliced
+    out without copying. ``tmin`` and
+    ``tmax`` are the first and last times in the track. Sources with no
+    points have ``start == stop == 0``.
+
+``blocks.npy``
+    The block index: float64 array of shape (nblocks, 2) with the first and
+    last time in each run of :data:`BLOCK_SIZE` points (NaN for blocks of
+    points without times). Older archives may lack it, in which case it is
+    rebuilt in memory when the archive is opened.
+
+All the ``.npy`` files are opened as read-only memory maps, so opening an
+archive reads only the header and the offsets table, and memory use is
+proportional to the parts of the columns actually touched.
+
+This replaces the ``darr.npy`` and ``datasets.yaml`` pair built by hand in
+the notebooks.
+
+'''
+import collections
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+
+from pyxie import core
+from pyxie import spatial
+from pyxie import stats
+
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 3
+
+# Number of points summarised by each entry of the block index.
+BLOCK_SIZE = 4096
+
+COLUMNS = ('time', 'lon', 'lat', 'elev')
+
+# Views of the columns of an archive, as returned by Archive.slice etc.
+Columns = collections.namedtuple('Columns', COLUMNS + ('track', 'owner'))
+
+# One record per source file. Its points all lie in [start, stop) of the
+# sorted columns; npoints is less than stop - start where another source
+# overlaps it in time.
+TRACKS_DTYPE = np.dtype([('start', np.int64),
+                         ('stop', np.int64),
+                         ('npoints', np.int64),
+                         ('tmin', np.float64),
+                         ('tmax', np.float64)])
+
+# One record per point shared with another source: the position of the
+# point in the columns and the id of the track which shares it.
+REFS_DTYPE = np.dtype([('position', np.int64),
+                       ('track', np.int32)])
+
+
+class Archive(object):
+    '''Read-only access to a track archive.
+
+    Args:
+        - *path*: archive folder.
+
+    Attributes:
+        - *header*: dict read from ``header.json``
+        - *sources*: list of source filenames, indexed by track id
+        - *tracks*: the offsets table, a :data:`TRACKS_DTYPE` array
+        - *refs*: the shared points, a :data:`REFS_DTYPE` array
+        - *owners*: list of owner names, indexed by the owner column
+        - *time, lon, lat, elev, track, owner*: memory-mapped columns
+        - *blocks*: the block index
+        - *spatial_index*: :class:`pyxie.spatial.GridIndex` over lon/lat,
+          built the first time it is used
+
+    '''
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'header.json'), mode='r') as f:
+            self.header = json.load(f)
+        if self.header['format_version'] > FORMAT_VERSION:
+            raise IOError('%s has archive format version %s; this version of '
+                          'pyxie can only read up to %s' % (
+                          path, self.header['format_version'], FORMAT_VERSION))
+        self.sources = self.header['sources']
+        self.tracks = np.load(os.path.join(path, 'tracks.npy'))
+        for name in COLUMNS + ('track', ):
+            setattr(self, name, self._load_column(name))
+        self.owners = self.header.get('owners', [''])
+        if os.path.isfile(os.path.join(path, 'owner.npy')):
+            self.owner = self._load_column('owner')
+        else:
+            self.owner = np.broadcast_to(np.int16(0), (len(self), ))
+        blocks_fn = os.path.join(path, 'blocks.npy')
+        if os.path.isfile(blocks_fn):
+            self.blocks = np.load(blocks_fn)
+        else:
+            self.blocks = block_index(self.time)
+        refs_fn = os.path.join(path, 'refs.npy')
+        if os.path.isfile(refs_fn):
+            self.refs = np.load(refs_fn)
+        else:
+            self.refs = np.empty(0, dtype=REFS_DTYPE)
+        self._spatial_index = None
+
+    def __len__(self):
+        return self.header['npoints']
+
+    def __repr__(self):
+        return '<%s %s: %d points from %d sources>' % (
+                self.__class__.__name__, self.path, len(self), len(self.sources))
+
+    def slice(self, start, stop):
+        '''Return :data:`Columns` of views of positions *start* to *stop*.'''
+        return Columns(*[getattr(self, name)[start:stop]
+                         for name in Columns._fields])
+
+    def time_range(self, start, end):
+        '''Return the positions (i, j) of the points with times from
+        *start* up to but not including *end*.
+
+        The block index narrows the search down to one block at each end,
+        so only those two blocks of the time column are read.
+
+        '''
+        return (self._search_time(start), self._search_time(end))
+
+    def query_time(self, start, end):
+        '''Return the points with times from *start* up to but not including
+        *end* (seconds since the epoch, UTC).
+
+        Returns: tuple (columns, track_ids) where *columns* is a
+        :data:`Columns` of views into the archive and *track_ids* is an array
+        of the ids of the sources whose time span overlaps the query.
+
+        '''
+        i, j = self.time_range(start, end)
+        overlapping = np.flatnonzero((self.tracks['tmin'] < end)
+                                     & (self.tracks['tmax'] >= start))
+        return self.slice(i, j), overlapping
+
+    def _search_time(self, t):
+        # The first block whose last time is >= t holds the insertion point.
+        k = np.searchsorted(self.blocks[:, 1], t, side='left')
+        if k == len(self.blocks):
+            return len(self)
+        i = k * BLOCK_SIZE
+        block = self.time[i:i + BLOCK_SIZE]
+        return i + np.searchsorted(block, t, side='left')
+
+    @property
+    def spatial_index(self):
+        if self._spatial_index is None:
+            # Scale longitudes for the mean latitude, or not at all if
+            # no point has one.
+            lats = self.lat[np.isfinite(self.lat)]
+            lat0 = lats.mean() if len(lats) else 0.
+            self._spatial_index = spatial.GridIndex(
+                    self.lon, self.lat, x_scale=np.cos(np.radians(lat0)))
+        return self._spatial_index
+
+    def query_bbox(self, lon0, lat0, lon1, lat1):
+        '''Return the points inside a longitude/latitude bounding box.
+
+        Returns: tuple (positions, track_ids) of the sorted positions of the
+        points in the columns and the unique ids of their sources.
+
+        '''
+        positions = self.spatial_index.bbox(lon0, lat0, lon1, lat1)
+        return positions, self.tracks_at(positions)
+
+    def nearest_points(self, lon, lat, k=1):
+        '''Return the positions of the *k* points nearest to (*lon*, *lat*)
+        and their distances in metres.'''
+        positions, distances = self.spatial_index.nearest(lon, lat, k=k)
+        return positions, distances * spatial.METRES_PER_DEGREE
+
+    def tracks_through(self, lon, lat, radius=50.):
+        '''Return the ids of the sources with a point within *radius* metres
+        of (*lon*, *lat*).'''
+        return self.tracks_at(self.spatial_index.within(
+                lon, lat, radius / spatial.METRES_PER_DEGREE))
+
+    def tracks_at(self, positions):
+        '''Return the unique ids of the sources of the points at
+        *positions*, including sources which share them.'''
+        track_ids = self.track[positions]
+        if len(self.refs):
+            shared = np.in1d(self.refs['position'], positions)
+            track_ids = np.concatenate([track_ids, self.refs['track'][shared]])
+        return np.unique(track_ids)
+
+    def track_distances(self):
+        '''Return the great-circle length in metres of every source track.
+
+        All tracks are measured in one vectorised pass over the archive; see
+        :func:`pyxie.core.geodesic`.
+
+        '''
+        # Sorting by track and then position keeps each track's points in
+        # time order. Shared points are counted once for each source.
+        positions = np.concatenate([np.arange(len(self)),
+                                    self.refs['position']])
+        track = np.concatenate([self.track, self.refs['track']])
+        order = np.lexsort((positions, track))
+        track = track[order]
+        positions = positions[order]
+        distances = core.geodesic(self.lon[positions],
+                                  self.lat[positions]).distances
+        distances[1:][track[1:] != track[:-1]] = 0
+        distances[np.isnan(distances)] = 0
+        return np.bincount(track, weights=distances,
+                           minlength=len(self.sources))
+
+    def track_stats(self, track_id):
+        '''Return :class:`pyxie.stats.TrackStats` for one source track.'''
+        columns = self.get_track(track_id)
+        return stats.track_stats(columns.time, columns.lon, columns.lat,
+                                 columns.elev)
+
+    def track_id(self, source):
+        '''Return the track id of source filename *source*.'''
+        return self.sources.index(source)
+
+    def owner_id(self, owner):
+        '''Return the value in the owner column of owner name *owner*.'''
+        return self.owners.index(owner)
+
+    def owner_names(self, columns):
+        '''Return an array of the owner names of the points in
+        :data:`Columns` *columns*.'''
+        return np.asarray(self.owners, dtype=object)[columns.owner]
+
+    def get_track(self, track_id):
+        '''Return :data:`Columns` of the points from one source.
+
+        Args:
+            - *track_id*: int, or a source filename.
+
+        The columns are views into the archive if the track does not overlap
+        another one in time, and copies otherwise. The track column holds
+        the id each point is stored under, which is another source's for
+        shared points.
+
+        '''
+        if not isinstance(track_id, (int, np.integer)):
+            track_id = self.track_id(track_id)
+        record = self.tracks[track_id]
+        start = record['start']
+        columns = self.slice(start, record['stop'])
+        if not self.is_contiguous(track_id):
+            mask = columns.track == track_id
+            shared = self.shared_positions(track_id)
+            if len(shared):
+                mask[shared - start] = True
+            columns = Columns(*[column[mask] for column in columns])
+        return columns
+
+    def shared_positions(self, track_id):
+        '''Return the positions of the points of *track_id* which are
+        stored under another source.'''
+        i, j = np.searchsorted(self.refs['track'], [track_id, track_id + 1])
+        return self.refs['position'][i:j]
+
+    def is_contiguous(self, track_id):
+        '''Return True if :meth:`get_track` returns views for *track_id*.'''
+        record = self.tracks[track_id]
+        return record['npoints'] == record['stop'] - record['start']
+
+    def _load_column(self, name):
+        fn = os.path.join(self.path, name + '.npy')
+        if not len(self):
+            # Zero-length arrays cannot be memory mapped.
+            return np.load(fn)
+        return np.load(fn, mmap_mode='r')
+
+
+def block_index(times, block_size=BLOCK_SIZE):
+    '''Return an array of the first and last time in each block of a sorted
+    time column. See ``blocks.npy`` above.'''
+    n = len(times)
+    nblocks = (n + block_size - 1) // block_size
+    blocks = np.empty((nblocks, 2))
+    blocks[:, 0] = times[::block_size]
+    blocks[:n // block_size, 1] = times[block_size - 1::block_size]
+    if n % block_size:
+        blocks[-1, 1] = times[n - 1]
+    return blocks
+
+
+def columns_to_coords(columns):
+    '''Return an (N, 4) time/lon/lat/elev array, as returned by
+    :func:`pyxie.io.read_gpx`, from :data:`Columns`.'''
+    return np.vstack([getattr(columns, name) for name in COLUMNS]).T
+
+
+def update_archive(path, tracks, removed=(), errors=None, owners=None):
+    '''Add, replace and remove sources in an archive without re-reading
+    the sources which have not changed.
+
+    The points of the new and changed sources are sorted on their own and
+    merged into the existing archive's sorted columns with
+    :func:`merge_archive`, so the cost is one sequential copy of the
+    columns plus the work on the changed sources, rather than re-sorting
+    every point. The new archive is written next to the old one and then
+    swapped in.
+
+    Args:
+        - *path*: archive folder. If there is no archive there yet, a new
+          one is created.
+        - *tracks*: dict of (N, 4) time/lon/lat/elev arrays keyed by source
+          filename, for new sources and sources which have changed.
+        - *removed*: source filenames to remove.
+        - *errors*: dict of error messages keyed by source filename, for
+          sources which could not be imported. These replace any existing
+          points for the same sources.
+        - *owners*: dict of owners of the points in *tracks*, keyed by
+          source filename, as for :meth:`ArchiveWriter.add`.
+
+    Returns: the updated :class:`Archive`.
+
+    '''
+    if errors is None:
+        errors = {}
+    if owners is None:
+        owners = {}
+    tmp_path = path.rstrip(os.sep) + '.updating'
+    if os.path.isdir(tmp_path):
+        shutil.rmtree(tmp_path)
+    if os.path.isfile(os.path.join(path, 'header.json')):
+        old = Archive(path)
+        merge_archive(old, tmp_path, tracks, removed=removed, errors=errors,
+                      owners=owners)
+        del old
+    else:
+        sources = sorted(set(tracks) | set(errors))
+        track_ids = dict((source, i) for i, source in enumerate(sources))
+        writer = ArchiveWriter(tmp_path, sources)
+        for source, coords in tracks.items():
+            writer.add(track_ids[source], coords, owner=owners.get(source))
+        for source, message in errors.items():
+            writer.add_error(track_ids[source], message)
+        writer.close()
+
+    old_path = path.rstrip(os.sep) + '.old'
+    if os.path.isdir(path):
+        os.rename(path, old_path)
+    os.rename(tmp_path, path)
+    if os.path.isdir(old_path):
+        shutil.rmtree(old_path)
+    logger.debug('Updated %s: %d added or changed, %d removed' % (
+            path, len(tracks), len(removed)))
+    return Archive(path)
+
+
+def merge_archive(old, path, tracks, removed=(), errors=None, owners=None,
+                  chunk_size=1000000):
+    '''Write a new archive made of an existing one with some sources
+    added, replaced or removed.
+
+    The existing columns are already sorted, so only the points of
+    *tracks* are sorted, and the two are merged a chunk of the existing
+    columns at a time. Points of the existing archive stay in the same
+    order and keep their track ids' sources; track ids change only
+    because the source list stays sorted. Memory use depends on
+    *chunk_size* and the size of *tracks*, not on the size of the archive.
+
+    New points which are already stored (same time, position, elevation
+    and owner) are added to the shared points rather than stored again, as
+    by :class:`ArchiveWriter`, but always under the source already
+    storing them. A stored point whose source is removed but which is
+    shared by a source that is kept is moved to the lowest of those. New
+    sources identical to another source are not listed in ``duplicates``;
+    their points are all shared points instead.
+
+    Args:
+        - *old*: the existing :class:`Archive`.
+        - *path*: folder to write the new archive to.
+        - *chunk_size*: number of existing points to copy at a time.
+
+    Other arguments are as for :func:`update_archive`.
+
+    '''
+    if errors is None:
+        errors = {}
+    if owners is None:
+        owners = {}
+    replaced = set(tracks) | set(errors) | set(removed)
+    kept = [source for source in old.sources if not source in replaced]
+    sources = sorted(set(kept) | set(tracks) | set(errors))
+    track_ids = dict((source, i) for i, source in enumerate(sources))
+    # The new track id of each old track id, or -1 if it is not kept.
+    old_to_new = np.array([-1 if source in replaced else track_ids[source]
+                           for source in old.sources] + [-1], dtype=np.int32)
+    n_old = len(old)
+    owner_names = list(old.owners)
+    owner_ids = dict((name, i) for i, name in enumerate(owner_names))
+
+    # The points added, sorted by time.
+    added = sorted(tracks)
+    coords = [np.asarray(tracks[source], dtype=np.float64).reshape(-1, 4)
+              for source in added]
+    lengths = [len(c) for c in coords]
+    points = np.concatenate(coords) if coords else np.empty((0, 4))
+    new_tracks = np.repeat(np.array([track_ids[source] for source in added],
+                                    dtype=np.int32), lengths)
+    new_owners = np.concatenate(
+            [_owner_column(owners.get(source), n, owner_names, owner_ids)
+             for source, n in zip(added, lengths)] +
+            [np.empty(0, dtype=np.int16)])
+    order = np.argsort(points[:, 0], kind='mergesort')
+    points = points[order]
+    new_tracks = new_tracks[order]
+    new_owners = new_owners[order]
+
+    # Stored points whose source goes but which a kept source shares move
+    # to the lowest such source, and stop being shared points of it.
+    refs = old.refs
+    ref_tracks = old_to_new[refs['track']]
+    stored_tracks = old_to_new[old.track[refs['position']]]
+    orphans = np.flatnonzero((stored_tracks < 0) & (ref_tracks >= 0))
+    orphans = orphans[np.lexsort((ref_tracks[orphans],
+                                  refs['position'][orphans]))]
+    first = np.diff(np.r_[-1, refs['position'][orphans]]) != 0
+    moved = np.array(refs['position'][orphans[first]], dtype=np.int64)
+    moved_tracks = ref_tracks[orphans[first]]
+    keep_refs = ref_tracks >= 0
+    keep_refs[orphans[first]] = False
+
+    def old_track_ids(i, j):
+        '''New track ids of the old points in positions i to j.'''
+        ids = old_to_new[old.track[i:j]]
+        k, l = np.searchsorted(moved, [i, j])
+        ids[moved[k:l] - i] = moved_tracks[k:l]
+        return ids
+
+    def track_ids_at(positions):
+        '''New track ids of the old points at *positions*.'''
+        ids = old_to_new[old.track[positions]]
+        k = np.searchsorted(moved, positions)
+        hit = k < len(moved)
+        hit[hit] = moved[k[hit]] == positions[hit]
+        ids[hit] = moved_tracks[k[hit]]
+        return ids
+
+    # New points which are already stored, or are in two new sources.
+    copies, originals = _new_copies(old, points, new_tracks, new_owners,
+                                    track_ids_at, len(sources))
+    stored = np.ones(len(points), dtype=bool)
+    stored[copies] = False
+    stored_points = np.flatnonzero(stored)
+    # Each stored new point goes before the old point at this position.
+    inserts = np.searchsorted(old.time, points[stored_points, 0],
+                              side='right')
+
+    # The old positions whose new positions are needed.
+    record_ids = np.flatnonzero(old_to_new[:-1] >= 0)
+    records = old.tracks[record_ids]
+    records = records[records['stop'] > records['start']]
+    old_originals = originals[originals < 0] + n_old
+    wanted = np.unique(np.concatenate([
+            records['start'], records['stop'] - 1, refs['position'],
+            old_originals]).astype(np.int64))
+    wanted_positions = np.empty(len(wanted), dtype=np.int64)
+
+    # Number of old points kept, per chunk.
+    bounds = list(range(0, n_old, chunk_size)) + [n_old]
+    if len(bounds) == 1:
+        bounds = [0, 0]
+    kept_counts = [np.count_nonzero(old_track_ids(i, j) >= 0)
+                   for i, j in zip(bounds[:-1], bounds[1:])]
+    nstored = sum(kept_counts) + len(stored_points)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    columns = [(name, _open_column(path, name, np.float64, nstored))
+               for name in COLUMNS]
+    columns.append(('track', _open_column(path, 'track', np.int32, nstored)))
+    columns.append(('owner', _open_column(path, 'owner', np.int16, nstored)))
+    new_values = dict(zip(COLUMNS, points[stored_points].T))
+    new_values['track'] = new_tracks[stored_points]
+    new_values['owner'] = new_owners[stored_points]
+    new_positions = np.empty(len(stored_points), dtype=np.int64)
+    out = 0
+    for (i, j), nkept in zip(zip(bounds[:-1], bounds[1:]), kept_counts):
+        ids = old_track_ids(i, j)
+        keep = ids >= 0
+        # The stored new points which go in this chunk: the last chunk
+        # also takes those after every old point.
+        k0, k1 = np.searchsorted(inserts, [i, j if j < n_old else j + 1])
+        kept_before = np.r_[0, np.cumsum(keep)]
+        old_local = np.flatnonzero(keep)
+        old_out = out + kept_before[old_local] + np.searchsorted(
+                inserts[k0:k1], i + old_local, side='right')
+        new_out = out + kept_before[inserts[k0:k1] - i] + np.arange(k1 - k0)
+        new_positions[k0:k1] = new_out
+        w0, w1 = np.searchsorted(wanted, [i, j])
+        local = wanted[w0:w1] - i
+        wanted_positions[w0:w1] = out + kept_before[local] + np.searchsorted(
+                inserts[k0:k1], wanted[w0:w1], side='right')
+        for name, column in columns:
+            if name == 'track':
+                values = ids
+            else:
+                values = getattr(old, name)[i:j]
+            column[old_out] = values[keep]
+            column[new_out] = new_values[name][k0:k1]
+        out += nkept + k1 - k0
+    del columns, column, values, new_values
+
+    def positions_of(old_positions):
+        return wanted_positions[np.searchsorted(wanted, old_positions)]
+
+    # The position of every new point, which for a copy is the position of
+    # the point it is a copy of.
+    positions = np.empty(len(points), dtype=np.int64)
+    positions[stored_points] = new_positions
+    copy_positions = np.empty(len(copies), dtype=np.int64)
+    from_old = originals < 0
+    copy_positions[from_old] = positions_of(originals[from_old] + n_old)
+    copy_positions[~from_old] = positions[originals[~from_old]]
+    positions[copies] = copy_positions
+    # The same in the order of *tracks*.
+    track_positions = np.empty(len(points), dtype=np.int64)
+    track_positions[order] = positions
+
+    table = np.zeros(len(sources), dtype=TRACKS_DTYPE)
+    table['tmin'] = np.nan
+    table['tmax'] = np.nan
+    ids = old_to_new[record_ids]
+    table[ids] = old.tracks[record_ids]
+    nonempty = ids[table['stop'][ids] > table['start'][ids]]
+    table['start'][nonempty] = positions_of(table['start'][nonempty])
+    table['stop'][nonempty] = positions_of(table['stop'][nonempty] - 1) + 1
+    end = 0
+    for source, n, track in zip(added, lengths, coords):
+        end += n
+        if not n:
+            continue
+        times = track[:, 0]
+        times = times[~np.isnan(times)]
+        record = table[track_ids[source]]
+        record['start'] = track_positions[end - n:end].min()
+        record['stop'] = track_positions[end - n:end].max() + 1
+        record['npoints'] = n
+        if len(times):
+            record['tmin'] = times.min()
+            record['tmax'] = times.max()
+    np.save(os.path.join(path, 'tracks.npy'), table)
+
+    shared = np.empty(np.count_nonzero(keep_refs) + len(copies),
+                      dtype=REFS_DTYPE)
+    shared['position'] = np.r_[positions_of(refs['position'][keep_refs]),
+                               copy_positions]
+    shared['track'] = np.r_[ref_tracks[keep_refs], new_tracks[copies]]
+    shared = shared[np.lexsort((shared['position'], shared['track']))]
+    np.save(os.path.join(path, 'refs.npy'), shared)
+
+    if nstored:
+        times = np.load(os.path.join(path, 'time.npy'), mmap_mode='r')
+    else:
+        times = np.empty(0)
+    np.save(os.path.join(path, 'blocks.npy'), block_index(times))
+    del times
+
+    old_errors = old.header.get('errors', {})
+    new_errors = dict((source, old_errors[source]) for source in kept
+                      if source in old_errors)
+    new_errors.update(errors)
+    duplicates = dict(
+            (alias, original) for alias, original
+            in old.header.get('duplicates', {}).items()
+            if alias in track_ids and original in track_ids
+            and not alias in replaced and not original in replaced)
+    header = {'format_version': FORMAT_VERSION,
+              'npoints': nstored,
+              'sources': sources,
+              'errors': new_errors,
+              'duplicates': duplicates,
+              'owners': owner_names}
+    with open(os.path.join(path, 'header.json'), mode='w') as f:
+        json.dump(header, f, indent=1)
+    logger.debug('Merged %d points from %d sources into %s (%d kept)' % (
+            len(points), len(added), path, nstored - len(stored_points)))
+
+
+def _new_copies(old, points, new_tracks, new_owners, track_ids_at,
+                ntracks):
+    '''Find the new points which are copies of stored points.
+
+    Returns: tuple (copies, originals). *copies* are indices into *points*.
+    Each original is the index into *points* of the new point it is a copy
+    of, or, if negative, the old position it is a copy of minus the number
+    of old points.
+
+    '''
+    empty = np.empty(0, dtype=np.int64)
+    times = points[:, 0]
+    valid = ~np.isnan(times)
+    if not valid.any():
+        return empty, empty
+    # The old points with the same time as a new point.
+    lo = np.searchsorted(old.time, times[valid], side='left')
+    hi = np.searchsorted(old.time, times[valid], side='right')
+    counts = hi - lo
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                  counts)
+    candidates = np.unique(np.repeat(lo, counts) + offsets)
+    candidate_tracks = track_ids_at(candidates)
+    candidates = candidates[candidate_tracks >= 0]
+    candidate_tracks = candidate_tracks[candidate_tracks >= 0]
+    nold = len(candidates)
+    both = np.concatenate([
+            np.column_stack([getattr(old, name)[candidates]
+                             for name in COLUMNS]).reshape(-1, 4),
+            points])
+    # Old points come before new ones of any track id, so they are never
+    # the copies.
+    keys = np.r_[candidate_tracks.astype(np.int64) - ntracks, new_tracks]
+    owner_ids = np.r_[np.asarray(old.owner[candidates], dtype=np.int16),
+                      new_owners]
+    order = np.argsort(both[:, 0], kind='mergesort')
+    copies, originals = shared_points(both, order, keys, owner_ids)
+    copies = order[copies]
+    originals = order[originals]
+    new = copies >= nold
+    copies = copies[new] - nold
+    originals = originals[new]
+    from_old = originals < nold
+    originals[from_old] = candidates[originals[from_old]] - len(old)
+    originals[~from_old] -= nold
+    return copies, originals
+
+
+class ArchiveWriter(object):
+    '''Build an archive from (N, 4) coordinate arrays added in any order.
+
+    Points are appended to a scratch file as they arrive and are sorted once
+    when :meth:`close` is called. The points themselves stay on disk, but
+    sorting them needs several index arrays with an integer per point, so
+    :meth:`close` still uses O(N) memory.
+
+    With *dedup*, a source whose points are identical to those of a source
+    already added is not written at all, and points which are in several
+    sources (same time, position and elevation) are stored once, with the
+    other sources referring to them (see ``refs.npy`` above).
+
+    Args:
+        - *path*: archive folder; created if necessary.
+        - *sources*: list of source filenames. Tracks are identified by
+          their index in this list.
+        - *chunk_size*: number of points to reorder at a time when writing
+          the sorted columns.
+        - *dedup*: store duplicated points once.
+
+    Attributes:
+        - *errors*: dict of error messages keyed by source filename.
+        - *duplicates*: dict mapping each source identical to an earlier
+          one to that source.
+        - *owners*: list of the owner names seen, indexed by the values in
+          the owner column.
+
+    '''
+    def __init__(self, path, sources, chunk_size=1000000, dedup=True):
+        self.path = path
+        self.sources = list(sources)
+        self.chunk_size = chunk_size
+        self.dedup = dedup
+        self.errors = {}
+        self.duplicates = {}
+        self.owners = ['']
+        self._owner_ids = {'': 0}
+        self._offsets = {}
+        self._digests = {}
+        self._aliases = {}
+        self._npoints = 0
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._scratch_fn = os.path.join(path, 'points.tmp')
+        self._scratch = open(self._scratch_fn, mode='wb')
+        self._owner_scratch_fn = os.path.join(path, 'owner.tmp')
+        self._owner_scratch = open(self._owner_scratch_fn, mode='wb')
+
+    def add(self, track_id, coords, owner=None):
+        '''Add the (N, 4) time/lon/lat/elev array for source *track_id*.
+
+        *owner* is the name of the owner of all the points, or an array of
+        N owner names (e.g. the owner column of a CSV file, see
+        :func:`pyxie.io.iter_csv`), or None if the owner is not known.
+
+        '''
+        coords = np.ascontiguousarray(coords, dtype=np.float64)
+        owner_ids = self._owner_column(owner, len(coords))
+        if self.dedup and len(coords):
+            digest = hashlib.sha1(coords.tostring())
+            digest.update(owner_ids.tostring())
+            digest = digest.hexdigest()
+            if digest in self._digests:
+                self._add_alias(track_id, self._digests[digest], digest)
+                return
+            self._digests[digest] = track_id
+        coords.tofile(self._scratch)
+        owner_ids.tofile(self._owner_scratch)
+        self._offsets[track_id] = (self._npoints, self._npoints + len(coords))
+        self._npoints += len(coords)
+
+    def _add_alias(self, track_id, original, digest):
+        # The points are stored under the lower track id, so that which
+        # source owns them does not depend on the order they were added in.
+        if track_id < original:
+            self._offsets[track_id] = self._offsets.pop(original)
+            self._digests[digest] = track_id
+            for alias, owner in self._aliases.items():
+                if owner == original:
+                    self._aliases[alias] = track_id
+            track_id, original = original, track_id
+        self._aliases[track_id] = original
+        self.duplicates = dict(
+                (self.sources[alias], self.sources[owner])
+                for alias, owner in self._aliases.items())
+
+    def _owner_column(self, owner, n):
+        return _owner_column(owner, n, self.owners, self._owner_ids)
+
+    def add_error(self, track_id, message):
+        '''Record that source *track_id* could not be imported.'''
+        self.errors[self.sources[track_id]] = message
+
+    def close(self):
+        '''Sort the points by time and write the archive files.'''
+        self._scratch.close()
+        self._owner_scratch.close()
+        n = self._npoints
+        if n:
+            points = np.memmap(self._scratch_fn, dtype=np.float64, mode='r',
+                               shape=(n, 4))
+            owner_ids = np.memmap(self._owner_scratch_fn, dtype=np.int16,
+                                  mode='r', shape=(n, ))
+        else:
+            points = np.empty((0, 4))
+            owner_ids = np.empty(0, dtype=np.int16)
+        track_ids = np.empty(n, dtype=np.int32)
+        for track_id, (i, j) in self._offsets.items():
+            track_ids[i:j] = track_id
+
+        order = np.argsort(points[:, 0], kind='mergesort')
+        if self.dedup:
+            copies, owners = shared_points(points, order, track_ids,
+                                           owner_ids)
+        else:
+            copies = owners = np.empty(0, dtype=np.int64)
+        keep = np.ones(n, dtype=bool)
+        keep[copies] = False
+        stored = order[keep]
+        nstored = len(stored)
+        for k, name in enumerate(COLUMNS):
+            column = self._open_column(name, np.float64, nstored)
+            for i in range(0, nstored, self.chunk_size):
+                column[i:i + self.chunk_size] = points[stored[i:i + self.chunk_size], k]
+            del column
+        column = self._open_column('track', np.int32, nstored)
+        column[:] = track_ids[stored]
+        del column
+        column = self._open_column('owner', np.int16, nstored)
+        column[:] = owner_ids[stored]
+        del column, owner_ids
+        if nstored:
+            times = np.load(os.path.join(self.path, 'time.npy'), mmap_mode='r')
+        else:
+            times = np.empty(0)
+        np.save(os.path.join(self.path, 'blocks.npy'), block_index(times))
+        del times
+
+        # The position in the columns of each point added, which for a
+        # copy is the position of the point it is a copy of.
+        sorted_positions = np.cumsum(keep) - 1
+        sorted_positions[copies] = sorted_positions[owners]
+        positions = np.empty(n, dtype=np.int64)
+        positions[order] = sorted_positions
+        refs = [(sorted_positions[copies], track_ids[order[copies]])]
+        tracks = np.zeros(len(self.sources), dtype=TRACKS_DTYPE)
+        tracks['tmin'] = np.nan
+        tracks['tmax'] = np.nan
+        for track_id, (i, j) in self._offsets.items():
+            if j == i:
+                continue
+            times = points[i:j, 0]
+            times = times[~np.isnan(times)]
+            record = tracks[track_id]
+            record['start'] = positions[i:j].min()
+            record['stop'] = positions[i:j].max() + 1
+            record['npoints'] = j - i
+            if len(times):
+                record['tmin'] = times.min()
+                record['tmax'] = times.max()
+        for alias, owner in self._aliases.items():
+            tracks[alias] = tracks[owner]
+            i, j = self._offsets[owner]
+            refs.append((positions[i:j], np.full(j - i, alias, dtype=np.int32)))
+        np.save(os.path.join(self.path, 'tracks.npy'), tracks)
+        del points
+
+        shared = np.empty(sum(len(ps) for ps, ts in refs), dtype=REFS_DTYPE)
+        shared['position'] = np.concatenate([ps for ps, ts in refs])
+        shared['track'] = np.concatenate([ts for ps, ts in refs])
+        shared = shared[np.lexsort((shared['position'], shared['track']))]
+        np.save(os.path.join(self.path, 'refs.npy'), shared)
+
+        header = {'format_version': FORMAT_VERSION,
+                  'npoints': nstored,
+                  'sources': self.sources,
+                  'errors': self.errors,
+                  'duplicates': self.duplicates,
+                  'owners': self.owners}
+        with open(os.path.join(self.path, 'header.json'), mode='w') as f:
+            json.dump(header, f, indent=1)
+        os.remove(self._scratch_fn)
+        os.remove(self._owner_scratch_fn)
+        logger.debug('Wrote %d points from %d sources to %s (%d shared)' % (
+                nstored, len(self._offsets) + len(self._aliases), self.path,
+                len(shared)))
+
+    def _open_column(self, name, dtype, n):
+        return _open_column(self.path, name, dtype, n)
+
+
+def _open_column(path, name, dtype, n):
+    '''Create column *name* of *n* points in archive folder *path* and
+    return it memory mapped for writing.'''
+    fn = os.path.join(path, name + '.npy')
+    if not n:
+        # Zero-length files cannot be memory mapped.
+        np.save(fn, np.empty(0, dtype=dtype))
+        return np.empty(0, dtype=dtype)
+    return np.lib.format.open_memmap(fn, mode='w+', dtype=dtype, shape=(n, ))
+
+
+def _owner_column(owner, n, owners, owner_ids):
+    '''Return an int16 array of the owner ids of *n* points, adding new
+    owner names to the list *owners* and the dict *owner_ids* of their
+    positions in it.'''
+    if owner is None or isinstance(owner, basestring):
+        names, inverse = [owner or ''], np.zeros(n, dtype=np.int64)
+    else:
+        names, inverse = np.unique(np.asarray(owner), return_inverse=True)
+    ids = []
+    for name in names:
+        if not name in owner_ids:
+            owner_ids[name] = len(owners)
+            owners.append(name)
+        ids.append(owner_ids[name])
+    return np.array(ids, dtype=np.int16)[inverse]
+
+
+def shared_points(points, order, track_ids, owner_ids=None):
+    '''Find the points which are in more than one source.
+
+    Points are the same if their time, longitude, latitude, elevation and
+    owner are all equal. Only points whose time equals that of a neighbour
+    in time order can be shared, so those are all that is compared: a merge
+    join of the time-sorted points rather than a comparison of every pair
+    of overlapping tracks.
+
+    Args:
+        - *points*: (N, 4) time/lon/lat/elev array.
+        - *order*: indices which sort *points* by time.
+        - *track_ids*: track id of each point.
+        - *owner_ids*: owner id of each point, or None if not known.
+
+    Returns: tuple (copies, owners) of arrays of indices into the sorted
+    points. Each copy is the first occurrence in its source of a point which
+    is also in a source with a lower track id, and the owner is that
+    source's occurrence. Repeats within one source are not copies.
+
+    '''
+    empty = np.empty(0, dtype=np.int64)
+    times = points[order, 0]
+    new_time = times[1:] != times[:-1]
+    ties = np.flatnonzero(~new_time)
+    if not len(ties):
+        return empty, empty
+    candidates = np.union1d(ties, ties + 1)
+    groups = np.cumsum(np.r_[True, new_time])[candidates]
+    rows = points[order[candidates]]
+    tracks = track_ids[order[candidates]]
+    if owner_ids is None:
+        owner_ids = np.zeros(len(points), dtype=np.int16)
+    point_owners = owner_ids[order[candidates]]
+    # Sort each group of points with the same time by the point and then by
+    # track, so copies are adjacent and the lowest track id comes first.
+    s = np.lexsort((candidates, tracks, point_owners, rows[:, 3], rows[:, 2],
+                    rows[:, 1], groups))
+    candidates = candidates[s]
+    tracks = tracks[s]
+    point_owners = point_owners[s]
+    rows = rows[s]
+    groups = groups[s]
+    same = groups[1:] == groups[:-1]
+    same &= point_owners[1:] == point_owners[:-1]
+    for k in (1, 2, 3):
+        a = rows[1:, k]
+        b = rows[:-1, k]
+        same &= (a == b) | (np.isnan(a) & np.isnan(b))
+    same = np.r_[False, same]
+    copies = same & np.r_[True, tracks[1:] != tracks[:-1]]
+    owners = np.maximum.accumulate(np.where(same, 0, np.arange(len(same))))
+    return candidates[copies], candidates[owners[copies]]
@@ -0,0 +1,167 @@
+'''Persistent on-disk cache of parsed track files.
+
+Parsed coordinate arrays are saved as ``.npy`` files in a ``cache`` folder
+under :data:`pyxie.config.data_dir`, so that re-opening a file which has not
+changed since it was last parsed costs one memory map instead of a full
+parse.
+
+Entries are named ``<path hash>-<state hash>.npy``. The state hash covers the
+file's modification time and size and the version of the parser, so any of
+those changing makes the old entry stale. Each hit updates the entry's
+modification time, and when the folder grows past ``max_size_mb`` (see the
+``[cache]`` section of ``pyxie.cfg``) the least recently used entries are
+removed.
+
+Usage::
+
+    >>> from pyxie import cache, io
+    >>> coords = cache.default_cache().load('track.gpx', io.read_gpx,
+    ...                                     io.PARSER_VERSION)
+
+'''
+import glob
+import hashlib
+import logging
+import os
+
+import numpy as np
+
+from pyxie.config import config, data_dir
+
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.path.join(data_dir, 'cache')
+
+_default_cache = None
+
+
+class ParseCache(object):
+    '''Size-bounded LRU cache of parsed arrays, stored as ``.npy`` files.
+
+    Args:
+        - *cache_dir*: folder to keep entries in; created if necessary.
+        - *max_size*: maximum total size of the entries in bytes.
+
+    '''
+    def __init__(self, cache_dir=CACHE_DIR, max_size=None):
+        if max_size is None:
+            max_size = int(config.getfloat('cache', 'max_size_mb') * 1e6)
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self._size = None
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def entry_filename(self, path, version):
+        '''Return the cache filename for the current state of *path*.'''
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        state = '%r|%d|%s' % (st.st_mtime, st.st_size, version)
+        return os.path.join(self.cache_dir, '%s-%s.npy' % (
+                _hash(path), _hash(state)))
+
+    def get(self, path, version):
+        '''Return the cached array for *path*, or None.
+
+        The array is a read-only memory map of the cache entry.
+
+        '''
+        fn = self.entry_filename(path, version)
+        if not os.path.isfile(fn):
+            return None
+        try:
+            arr = np.load(fn, mmap_mode='r')
+        except (IOError, ValueError):
+            logger.warning('Removing unreadable cache entry %s' % fn)
+            self._remove(fn)
+            return None
+        os.utime(fn, None)
+        return arr
+
+    def put(self, path, version, arr):
+        '''Store *arr* as the cached array for *path* and return it as a
+        read-only memory map.
+
+        Stale entries for *path* are removed.
+
+        '''
+        fn = self.entry_filename(path, version)
+        prefix = os.path.basename(fn).split('-')[0]
+        for old_fn in glob.glob(os.path.join(self.cache_dir, prefix + '-*.npy')):
+            if old_fn != fn:
+                self._remove(old_fn)
+        tmp_fn = '%s.%d.tmp' % (fn, os.getpid())
+        with open(tmp_fn, mode='wb') as f:
+            np.save(f, np.ascontiguousarray(arr))
+        try:
+            if os.path.isfile(fn):
+                self._remove(fn)
+            os.rename(tmp_fn, fn)
+        except OSError:
+            # Another process stored the same entry first.
+            os.remove(tmp_fn)
+        else:
+            if self._size is not None:
+                self._size += os.path.getsize(fn)
+        self.evict()
+        return np.load(fn, mmap_mode='r')
+
+    def load(self, path, parser, version):
+        '''Return the array for *path* from the cache, or parse it with
+        *parser* (a function taking a filename) and cache the result.'''
+        arr = self.get(path, version)
+        if arr is None:
+            logger.debug('Cache miss for %s' % path)
+            arr = self.put(path, version, parser(path))
+        return arr
+
+    def size(self):
+        '''Return the total size of the cache entries in bytes.'''
+        if self._size is None:
+            self._size = sum(os.path.getsize(fn) for fn in self._entries())
+        return self._size
+
+    def evict(self, max_size=None):
+        '''Remove least recently used entries until the cache is no larger
+        than *max_size* bytes (by default the size it was created with).'''
+        if max_size is None:
+            max_size = self.max_size
+        if self.size() <= max_size:
+            return
+        entries = sorted((os.path.getmtime(fn), fn) for fn in self._entries())
+        for mtime, fn in entries:
+            if self._size <= max_size:
+                break
+            self._remove(fn)
+
+    def clear(self):
+        '''Remove all entries.'''
+        self.evict(max_size=0)
+
+    def _entries(self):
+        return glob.glob(os.path.join(self.cache_dir, '*.npy'))
+
+    def _remove(self, fn):
+        try:
+            size = os.path.getsize(fn)
+            os.remove(fn)
+        except OSError:
+            logger.warning('Could not remove cache entry %s' % fn)
+            return
+        if self._size is not None:
+            self._size -= size
+
+
+def default_cache():
+    '''Return the shared :class:`ParseCache` in :data:`CACHE_DIR`.'''
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ParseCache()
+    return _default_cache
+
+
+def _hash(s):
+    if not isinstance(s, bytes):
+        s = s.encode('utf-8')
+    return hashlib.sha1(s).hexdigest()[:16]
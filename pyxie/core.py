@@ -1,4 +1,7 @@
+import collections
 import logging
+import threading
+import weakref
 
 import numpy as np
 
@@ -7,12 +10,135 @@ import pyproj
 
 logger = logging.getLogger(__name__)
 
+# Mean radius of the Earth (IUGG) in metres.
+EARTH_RADIUS = 6371008.8
 
-def convert_coordinate_system(xs, ys, epsg1='4326', epsg2='28353'):
-    p1 = pyproj.Proj(init='epsg:%s' % epsg1)
-    p2 = pyproj.Proj(init='epsg:%s' % epsg2)
-    nxs, nys = pyproj.transform(p1, p2, xs, ys)
+# Result of geodesic(): arrays of metres, metres, metres per second and
+# degrees clockwise from north.
+Geodesic = collections.namedtuple(
+        'Geodesic', ('distances', 'cumulative', 'speeds', 'bearings'))
+
+
+# Per-thread dicts of transformation functions keyed by (epsg1, epsg2),
+# see get_transformer.
+_transformers = threading.local()
+
+# Projected columns keyed by id() of the coordinate array, see project_coords.
+_projected = {}
+# Guards _projected. Reentrant, because the weak reference callbacks which
+# remove entries can run during garbage collection while it is held.
+_projected_lock = threading.RLock()
+
+
+def get_transformer(epsg1, epsg2):
+    '''Return a function transforming (xs, ys) from *epsg1* to *epsg2*.
+    
+    The function is created once per pair of EPSG codes and thread, and
+    then reused. pyproj transformers are not thread-safe, so each thread
+    (e.g. the track loader's workers) gets its own and should not pass it
+    to another. It uses a ``pyproj.Transformer`` where available (pyproj
+    2.1 and later) and falls back to ``pyproj.transform`` for older
+    versions. Either way, longitude comes before latitude.
+    
+    '''
+    transformers = getattr(_transformers, 'functions', None)
+    if transformers is None:
+        transformers = _transformers.functions = {}
+    key = (str(epsg1), str(epsg2))
+    if not key in transformers:
+        if hasattr(pyproj, 'Transformer'):
+            transformer = pyproj.Transformer.from_crs(
+                    'epsg:%s' % epsg1, 'epsg:%s' % epsg2, always_xy=True)
+            transformers[key] = transformer.transform
+        else:
+            p1 = pyproj.Proj(init='epsg:%s' % epsg1)
+            p2 = pyproj.Proj(init='epsg:%s' % epsg2)
+            transformers[key] = lambda xs, ys: pyproj.transform(p1, p2, xs, ys)
+    return transformers[key]
+
+
+def utm_epsg(lons, lats):
+    '''Return the EPSG code of the WGS 84 UTM zone for the centre of the
+    bounding box of *lons*, *lats*.
+    
+    The Norway and Svalbard zone exceptions are ignored.
+    
+    '''
+    lons = np.asarray(lons)
+    lats = np.asarray(lats)
+    if not np.isfinite(lons).any():
+        return 32601
+    lon = (np.nanmin(lons) + np.nanmax(lons)) / 2.
+    lat = (np.nanmin(lats) + np.nanmax(lats)) / 2.
+    zone = int((lon + 180) // 6) % 60 + 1
+    if lat >= 0:
+        return 32600 + zone
+    else:
+        return 32700 + zone
+
+
+def convert_coordinate_system(xs, ys, epsg1='4326', epsg2=None, out=None,
+                              chunk_size=65536):
+    '''Transform coordinates between two coordinate systems.
+    
+    Args:
+        - *xs, ys*: arrays of coordinates, e.g. longitudes and latitudes.
+        - *epsg1, epsg2*: EPSG codes of the source and target coordinate
+          systems. If *epsg2* is None the UTM zone returned by
+          :func:`utm_epsg` is used.
+        - *out*: optional tuple of two float64 arrays to write the results
+          into. It can be (xs, ys) themselves, to transform in place.
+        - *chunk_size*: number of points to transform at a time, which
+          bounds the size of temporary arrays.
+        
+    Returns: tuple of arrays (xs, ys).
+    
+    '''
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    if epsg2 is None:
+        epsg2 = utm_epsg(xs, ys)
+    if out is None:
+        out = (np.empty_like(xs), np.empty_like(ys))
+    nxs, nys = out
+    transform = get_transformer(epsg1, epsg2)
+    for i in range(0, len(xs), chunk_size):
+        j = i + chunk_size
+        nxs[i:j], nys[i:j] = transform(xs[i:j], ys[i:j])
     return nxs, nys
+
+
+def project_coords(coords, epsg2=None):
+    '''Return projected (xs, ys) for the lon/lat columns of *coords*.
+    
+    Args:
+        - *coords*: (N, 4) time/lon/lat/elev array, see
+          :func:`pyxie.io.read_gpx`.
+        - *epsg2*: passed to :func:`convert_coordinate_system`.
+        
+    The result is remembered for as long as *coords* exists, so asking
+    again for the same array is free. Treat the arrays returned as
+    read-only, since they are shared. The cache is shared by all threads
+    and guarded by a lock; the projection itself runs outside it.
+    
+    '''
+    key = id(coords)
+    with _projected_lock:
+        if key in _projected:
+            ref, cached_epsg2, projected = _projected[key]
+            if ref() is coords and cached_epsg2 == epsg2:
+                return projected
+    projected = convert_coordinate_system(coords[:, 1], coords[:, 2],
+                                          epsg2=epsg2)
+    
+    def forget(ref):
+        with _projected_lock:
+            if key in _projected and _projected[key][0] is ref:
+                del _projected[key]
+            
+    with _projected_lock:
+        _projected[key] = (weakref.ref(coords, forget), epsg2, projected)
+    return projected
     
     
 def speed(times, xs, ys, 
@@ -29,4 +155,75 @@ def speed(times, xs, ys,
     distances = np.sqrt(dxs ** 2 + dys**2) * distance_factor_into_km
     speeds = distances / dtimes
     return speeds
-    
\ No newline at end of file
+
+
+def geodesic(lons, lats, times=None, dtype=np.float64):
+    '''Great-circle distances, speeds and bearings along a track.
+    
+    Uses the haversine formula on a sphere of radius :data:`EARTH_RADIUS`
+    directly on longitudes and latitudes, so no projection is needed. Each
+    step is measured between neighbouring points only.
+    
+    Args:
+        - *lons, lats*: arrays of degrees.
+        - *times*: optional array of seconds, for speeds.
+        - *dtype*: np.float64, or np.float32 to halve the memory used by the
+          results. Differences between neighbouring points are always taken
+          in float64 so that float32 does not lose short steps.
+        
+    Returns: :data:`Geodesic` of arrays the same length as *lons*, where
+    element i describes the step from point i - 1 to point i. Element 0 has
+    a distance of zero and a NaN speed and bearing, as do steps without a
+    positive time difference (speeds) or without any movement (bearings).
+    Steps to or from a point with NaN coordinates count as zero in the
+    cumulative distance.
+    
+    '''
+    lons = np.asarray(lons, dtype=np.float64)
+    lats = np.asarray(lats, dtype=np.float64)
+    n = len(lons)
+    distances = np.zeros(n, dtype=dtype)
+    speeds = np.empty(n, dtype=dtype)
+    bearings = np.empty(n, dtype=dtype)
+    speeds[:1] = np.nan
+    bearings[:1] = np.nan
+    if n > 1:
+        dlons = np.radians(np.diff(lons)).astype(dtype)
+        dlats = np.radians(np.diff(lats)).astype(dtype)
+        rlats = np.radians(lats).astype(dtype)
+        cos_lats = np.cos(rlats)
+        sin_lats = np.sin(rlats)
+        cos1, cos2 = cos_lats[:-1], cos_lats[1:]
+        
+        # Haversine: a = sin^2(dlat / 2) + cos(lat1) cos(lat2) sin^2(dlon / 2)
+        a = np.sin(dlats / 2)
+        a *= a
+        h = np.sin(dlons / 2)
+        h *= h
+        h *= cos1
+        h *= cos2
+        a += h
+        np.clip(a, 0, 1, out=a)
+        np.sqrt(a, out=a)
+        np.arcsin(a, out=a)
+        a *= 2 * EARTH_RADIUS
+        distances[1:] = a
+        
+        # Initial bearing of each step.
+        y = np.sin(dlons)
+        y *= cos2
+        x = cos1 * sin_lats[1:]
+        x -= sin_lats[:-1] * cos2 * np.cos(dlons)
+        b = np.degrees(np.arctan2(y, x))
+        b %= 360
+        b[(y == 0) & (x == 0)] = np.nan
+        bearings[1:] = b
+        
+        if times is None:
+            speeds[1:] = np.nan
+        else:
+            dtimes = np.diff(np.asarray(times, dtype=np.float64)).astype(dtype)
+            dtimes[~(dtimes > 0)] = np.nan
+            np.divide(distances[1:], dtimes, out=speeds[1:])
+    cumulative = np.where(np.isnan(distances), 0, distances).cumsum(dtype=dtype)
+    return Geodesic(distances, cumulative, speeds, bearings)
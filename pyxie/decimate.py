@@ -0,0 +1,250 @@
+'''Level-of-detail decimation of tracks for drawing.
+
+Drawing every point of a long track is slow and pointless when many points
+fall within one pixel. These classes precompute, once per track, how to
+thin it at any scale, so that choosing the vertices for the current view
+costs a few array operations and the number drawn depends on the screen
+resolution rather than on the length of the track.
+
+- :class:`PathDecimator` ranks the points of a 2-D path (e.g. a projected
+  track on a map) by their Douglas-Peucker importance: the tolerance at
+  which the simplification first needs them. The points with importance
+  above the size of a pixel are a Douglas-Peucker simplification of the
+  track at that tolerance.
+- :class:`SeriesDecimator` keeps a pyramid of the positions of the minimum
+  and maximum value in buckets of 2, 4, 8, ... consecutive points of a time
+  series. Drawing the extremes of about one bucket per pixel looks the same
+  as drawing every point.
+
+'''
+import logging
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+# Longest segment that may be split near one end (see
+# :func:`douglas_peucker_importance`).
+MAX_LOPSIDED = 32
+
+
+class PathDecimator(object):
+    '''Douglas-Peucker decimation of a 2-D path.
+
+    Args:
+        - *xs, ys*: coordinates of the path, in the same units. NaN
+          coordinates break the path, and are always kept so that the
+          breaks are drawn.
+
+    Attributes:
+        - *importance*: array with, for each point, the largest tolerance at
+          which the point is kept (inf for the ends of each unbroken run).
+
+    '''
+    def __init__(self, xs, ys):
+        self.xs = np.asarray(xs, dtype=np.float64)
+        self.ys = np.asarray(ys, dtype=np.float64)
+        self.importance = douglas_peucker_importance(self.xs, self.ys)
+
+    def __len__(self):
+        return len(self.xs)
+
+    def select(self, tolerance, bbox=None):
+        '''Return sorted indices of the points to draw.
+
+        Args:
+            - *tolerance*: maximum distance of the path drawn from the
+              actual path, e.g. the size of a pixel in data units.
+            - *bbox*: optional (x0, y0, x1, y1) view limits. Points outside
+              are dropped, except for those next to a point inside, so that
+              lines leaving the view are still drawn.
+
+        '''
+        keep = self.importance >= tolerance
+        if bbox is not None:
+            x0, y0, x1, y1 = bbox
+            xs = self.xs
+            ys = self.ys
+            inside = (xs >= x0) & (xs <= x1) & (ys >= y0) & (ys <= y1)
+            inside |= np.isnan(xs) | np.isnan(ys)
+            near = inside.copy()
+            near[1:] |= inside[:-1]
+            near[:-1] |= inside[1:]
+            keep &= near
+            # A simplified segment crossing the view may have both ends
+            # outside it. Keep the kept points either side of the view.
+            indices = np.flatnonzero(self.importance >= tolerance)
+            visible = np.flatnonzero(inside)
+            if len(visible) and len(indices):
+                first = np.searchsorted(indices, visible[0]) - 1
+                last = np.searchsorted(indices, visible[-1], side='right')
+                keep[indices[max(first, 0)]] = True
+                keep[indices[min(last, len(indices) - 1)]] = True
+        return np.flatnonzero(keep)
+
+    def splice(self, i, j, xs, ys):
+        '''Return a decimator for an edited copy of the path, in which
+        points *i* to *j* (as for a slice) have been replaced.
+
+        Args:
+            - *xs, ys*: coordinates of the whole edited path.
+
+        Only the new points and the point either side of them are ranked
+        again, with those two always kept, so the cost depends on the size
+        of the edit rather than the length of the path. Close to the edit,
+        the path drawn may stray a little further than the tolerance from
+        the actual path, until the decimator is built again from scratch.
+
+        '''
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        tail = len(self.xs) - j
+        a = max(i - 1, 0)
+        b = min(len(xs) - tail + 1, len(xs))
+        window = douglas_peucker_importance(xs[a:b], ys[a:b])
+        decimator = PathDecimator.__new__(PathDecimator)
+        decimator.xs = xs
+        decimator.ys = ys
+        decimator.importance = np.concatenate([
+                self.importance[:a], window,
+                self.importance[len(self.xs) - (len(xs) - b):]])
+        return decimator
+
+
+class SeriesDecimator(object):
+    '''Min/max bucket decimation of a time series.
+
+    Args:
+        - *xs*: increasing x values, e.g. matplotlib date numbers.
+        - *ys*: values. NaNs are ignored unless a whole bucket is NaN.
+
+    Attributes:
+        - *levels*: list of (mins, maxs) pairs. Level *L* holds, for each
+          bucket of ``2 ** (L + 1)`` consecutive points, the indices of its
+          minimum and maximum values.
+
+    '''
+    def __init__(self, xs, ys):
+        self.xs = np.asarray(xs, dtype=np.float64)
+        self.ys = np.asarray(ys, dtype=np.float64)
+        self.levels = []
+        low = np.where(np.isnan(self.ys), np.inf, self.ys)
+        high = np.where(np.isnan(self.ys), -np.inf, self.ys)
+        mins = maxs = np.arange(len(self.ys))
+        while len(mins) > 1:
+            mins = _pairwise_pick(mins, low, np.less_equal)
+            maxs = _pairwise_pick(maxs, high, np.greater_equal)
+            self.levels.append((mins, maxs))
+
+    def __len__(self):
+        return len(self.xs)
+
+    def select(self, x0, x1, npixels):
+        '''Return sorted indices of the points to draw between *x0* and *x1*
+        on an axis *npixels* wide.
+
+        The point either side of the range is included so that the line
+        runs to the edges of the view.
+
+        '''
+        i = max(np.searchsorted(self.xs, x0, side='left') - 1, 0)
+        j = min(np.searchsorted(self.xs, x1, side='right') + 1, len(self.xs))
+        count = j - i
+        npixels = max(int(npixels), 1)
+        if count <= 2 * npixels or not self.levels:
+            return np.arange(i, j)
+        level = min(int(np.ceil(np.log2(float(count) / npixels))),
+                    len(self.levels)) - 1
+        mins, maxs = self.levels[level]
+        size = 2 ** (level + 1)
+        b0 = i // size
+        b1 = (j - 1) // size + 1
+        indices = np.concatenate([[i, j - 1], mins[b0:b1], maxs[b0:b1]])
+        indices = np.unique(indices)
+        return indices[(indices >= i) & (indices < j)]
+
+
+def douglas_peucker_importance(xs, ys):
+    '''Return the Douglas-Peucker importance of each point of a path.
+
+    The importance of a point is the largest distance from the segment it
+    splits to the points between the segment's ends, capped at the
+    importance of those ends. So at any tolerance, every point dropped is
+    within the tolerance of the simplified path.
+
+    Segments are split at their furthest point, as in the Douglas-Peucker
+    algorithm, except that segments longer than :data:`MAX_LOPSIDED` points
+    whose furthest point is in the outer quarter at either end are split in
+    the middle. That keeps the same guarantee with a few more points, and
+    bounds the depth of the recursion. All segments at each depth are split
+    at once, so the number of Python-level iterations is that depth.
+
+    '''
+    n = len(xs)
+    importance = np.full(n, np.nan)
+    broken = np.isnan(xs) | np.isnan(ys)
+    # The ends of each unbroken run are always kept.
+    ends = broken.copy()
+    if n:
+        ends[[0, -1]] = True
+    ends[1:] |= broken[:-1]
+    ends[:-1] |= broken[1:]
+    importance[ends] = np.inf
+
+    positions = np.arange(n)
+    active = np.flatnonzero(~ends)
+    while len(active):
+        # The segment each point is in runs between the nearest assigned
+        # points either side of it.
+        assigned = ~np.isnan(importance)
+        prev = np.maximum.accumulate(np.where(assigned, positions, 0))[active]
+        next_ = np.minimum.accumulate(
+                np.where(assigned, positions, n)[::-1])[::-1][active]
+        distances = _segment_distances(
+                xs[active], ys[active], xs[prev], ys[prev], xs[next_], ys[next_])
+        # Find the first point with the largest distance in each segment.
+        starts = np.flatnonzero(np.r_[True, prev[1:] != prev[:-1]])
+        maxima = np.maximum.reduceat(distances, starts)
+        segment = np.cumsum(np.r_[False, prev[1:] != prev[:-1]])
+        candidates = np.flatnonzero(distances == maxima[segment])
+        first = np.r_[True, segment[candidates[1:]] != segment[candidates[:-1]]]
+        split = candidates[first]
+        lo = prev[split]
+        hi = next_[split]
+        # Splitting near the end of a long segment would make the recursion
+        # as deep as the segment is long (e.g. on a smooth curve), so those
+        # are split in the middle instead.
+        positions_split = active[split]
+        quarter = (hi - lo) // 4
+        lopsided = ((hi - lo > MAX_LOPSIDED)
+                    & ((positions_split - lo < quarter)
+                       | (hi - positions_split < quarter)))
+        positions_split[lopsided] = (lo[lopsided] + hi[lopsided]) // 2
+        split[lopsided] = np.searchsorted(active, positions_split[lopsided])
+        cap = np.minimum(importance[lo], importance[hi])
+        importance[positions_split] = np.minimum(maxima, cap)
+        active = np.delete(active, split)
+    return importance
+
+
+def _segment_distances(xs, ys, x0, y0, x1, y1):
+    '''Return distances from points to line segments.'''
+    dx = x1 - x0
+    dy = y1 - y0
+    lengths = dx * dx + dy * dy
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = ((xs - x0) * dx + (ys - y0) * dy) / lengths
+    t[~(lengths > 0)] = 0
+    np.clip(t, 0, 1, out=t)
+    return np.hypot(xs - (x0 + t * dx), ys - (y0 + t * dy))
+
+
+def _pairwise_pick(indices, values, compare):
+    '''Combine neighbouring pairs of *indices*, keeping the one whose value
+    wins *compare* (e.g. np.less_equal for the minimum).'''
+    if len(indices) % 2:
+        indices = np.append(indices, indices[-1])
+    a = indices[0::2]
+    b = indices[1::2]
+    return np.where(compare(values[a], values[b]), a, b)
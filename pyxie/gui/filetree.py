@@ -0,0 +1,174 @@
+'''File system model showing summaries of track files.
+
+:class:`TrackFileModel` adds columns for the number of points, duration
+and distance of each track file to a QFileSystemModel, and shows a
+thumbnail of the track as the file's icon. The summaries come from a
+:class:`pyxie.summary.SummaryStore`, read or computed on a worker thread
+the first time a file is shown; until then the columns are blank.
+
+'''
+import logging
+import os
+
+import numpy as np
+
+from .. import summary
+from . import qt
+
+
+logger = logging.getLogger(__name__)
+
+# Size of the thumbnail icons in pixels.
+ICON_SIZE = 32
+
+
+class SummarySignals(qt.QtCore.QObject):
+    summarised = qt.QtCore.pyqtSignal(str, object)
+
+
+class SummaryJob(qt.QtCore.QRunnable):
+    '''Load the summary of *path* from *store* and emit it, or None if the
+    file cannot be read.'''
+    def __init__(self, signals, store, path):
+        qt.QtCore.QRunnable.__init__(self)
+        self.signals = signals
+        self.store = store
+        self.path = path
+
+    def run(self):
+        try:
+            result = self.store.load(self.path)
+        except Exception:
+            logger.debug('Could not summarise %s' % self.path, exc_info=True)
+            result = None
+        self.signals.summarised.emit(self.path, result)
+
+
+class TrackFileModel(qt.QtGui.QFileSystemModel):
+    '''QFileSystemModel with summary columns and thumbnails for tracks.
+
+    Args:
+        - *store*: :class:`pyxie.summary.SummaryStore`, by default one in
+          the default location.
+        - *extensions*: extensions of the files to summarise.
+
+    '''
+    columns = [('Points', lambda s: '%d' % s.npoints),
+               ('Duration', lambda s: _format_duration(s.tmax - s.tmin)),
+               ('Distance', lambda s: '%.1f km' % (s.distance / 1000.))]
+
+    def __init__(self, parent=None, store=None,
+                 extensions=('gpx', 'kml', 'kmz', 'csv', 'nmea',
+                             'nma')):
+        qt.QtGui.QFileSystemModel.__init__(self, parent)
+        if store is None:
+            store = summary.SummaryStore()
+        self.store = store
+        self.extensions = extensions
+        self.summaries = {}
+        self.icons = {}
+        self.pool = qt.QtCore.QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self.signals = SummarySignals(self)
+        self.signals.summarised.connect(self._on_summarised)
+
+    def base_column_count(self):
+        return qt.QtGui.QFileSystemModel.columnCount(self)
+
+    def columnCount(self, parent=qt.QtCore.QModelIndex()):
+        return self.base_column_count() + len(self.columns)
+
+    def headerData(self, section, orientation, role=qt.Qt.DisplayRole):
+        extra = section - self.base_column_count()
+        if (extra >= 0 and orientation == qt.Qt.Horizontal
+                and role == qt.Qt.DisplayRole):
+            return self.columns[extra][0]
+        return qt.QtGui.QFileSystemModel.headerData(
+                self, section, orientation, role)
+
+    def data(self, index, role=qt.Qt.DisplayRole):
+        extra = index.column() - self.base_column_count()
+        wants_icon = index.column() == 0 and role == qt.Qt.DecorationRole
+        if extra >= 0 or wants_icon:
+            path = str(self.filePath(index))
+            if self.is_track(path):
+                result = self.summary(path)
+                if result is not None:
+                    if wants_icon:
+                        return self.icon(path, result)
+                    if role == qt.Qt.DisplayRole:
+                        return self.columns[extra][1](result)
+            if extra >= 0:
+                return None
+        return qt.QtGui.QFileSystemModel.data(self, index, role)
+
+    def is_track(self, path):
+        return path.lower().rsplit('.', 1)[-1] in self.extensions
+
+    def summary(self, path):
+        '''Return the summary of *path* if it has been loaded, and otherwise
+        start loading it and return None. A file is loaded again once it
+        changes, including one which could not be summarised.'''
+        stamp = _file_stamp(path)
+        if path in self.summaries:
+            loaded_stamp, result = self.summaries[path]
+            if loaded_stamp == stamp:
+                return result
+        self.summaries[path] = (stamp, None)
+        self.icons.pop(path, None)
+        self.pool.start(SummaryJob(self.signals, self.store, path))
+        return None
+
+    def icon(self, path, result):
+        if not path in self.icons:
+            self.icons[path] = qt.QtGui.QIcon(_thumbnail(result.polyline))
+        return self.icons[path]
+
+    def _on_summarised(self, path, result):
+        path = str(path)
+        stamp = self.summaries.get(path, (None, None))[0]
+        self.summaries[path] = (stamp, result)
+        self.icons.pop(path, None)
+        first = self.index(path, 0)
+        if first.isValid():
+            last = first.sibling(first.row(), self.columnCount() - 1)
+            self.dataChanged.emit(first, last)
+
+
+def _file_stamp(path):
+    '''Return (mtime, size) of *path*, or None if it cannot be read.'''
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime, st.st_size
+
+
+def _thumbnail(polyline, size=ICON_SIZE):
+    '''Draw a track outline on a transparent QPixmap.'''
+    pixmap = qt.QtGui.QPixmap(size, size)
+    pixmap.fill(qt.Qt.transparent)
+    if len(polyline) < 2:
+        return pixmap
+    lons, lats = polyline[:, 0], polyline[:, 1]
+    xs = lons * np.cos(np.radians(np.mean(lats)))
+    ys = lats
+    extent = max(xs.max() - xs.min(), ys.max() - ys.min()) or 1.
+    scale = (size - 4) / extent
+    # Centre the track, with north up.
+    px = 2 + (xs - xs.min()) * scale + (size - 4 - (xs.max() - xs.min()) * scale) / 2.
+    py = size - 2 - (ys - ys.min()) * scale - (size - 4 - (ys.max() - ys.min()) * scale) / 2.
+    polygon = qt.QtGui.QPolygonF([qt.QtCore.QPointF(x, y) for x, y in zip(px, py)])
+    painter = qt.QtGui.QPainter(pixmap)
+    painter.setRenderHint(qt.QtGui.QPainter.Antialiasing)
+    painter.setPen(qt.QtGui.QPen(qt.QtGui.QColor('darkblue'), 1.5))
+    painter.drawPolyline(polygon)
+    painter.end()
+    return pixmap
+
+
+def _format_duration(seconds):
+    if np.isnan(seconds):
+        return ''
+    minutes = int(round(seconds / 60.))
+    return '%d:%02d' % (minutes // 60, minutes % 60)
@@ -0,0 +1,680 @@
+'''Loading and preparing tracks for display off the GUI thread.
+
+:class:`TrackData` bundles everything the track editor shows for a track:
+the parsed coordinates and text, the projected coordinates and their
+spatial index, the decimators used for drawing, and the statistics. All of
+it is computed by :meth:`TrackData.prepare`, which has no GUI code in it,
+so :class:`TrackLoader` can run it on a worker thread and hand the bundle
+back to the GUI thread, where plotting it is quick.
+
+:class:`TrackLoader` can also prefetch files (e.g. the neighbours of the
+open one) at low priority into a :class:`TrackCache`, a memory-bounded
+LRU of bundles, so that opening them next is instant. The size of the
+cache is set by ``max_size_mb`` in the ``[prefetch]`` section of
+``pyxie.cfg``.
+
+Edits to the GPX text are applied with :meth:`TrackData.edited`, which
+parses only the trackpoints in the part of the text that changed and
+splices them into the previous bundle's arrays.
+
+'''
+import collections
+import contextlib
+import datetime
+import logging
+import mmap
+import os
+import re
+try:
+    import cStringIO as StringIO
+except ImportError:
+    import StringIO
+
+from matplotlib import dates
+import numpy as np
+from pytz import timezone
+
+from .. import cache
+from ..config import config
+from .. import core
+from .. import decimate
+from .. import io
+from .. import spatial
+from .. import stats
+from . import qt
+
+
+logger = logging.getLogger(__name__)
+
+# A trkpt element, with or without a namespace prefix.
+TRKPT_RE = re.compile(r'<(?:[\w.-]+:)?trkpt\b(?:[^>]*/>|.*?</(?:[\w.-]+:)?trkpt\s*>)',
+                      re.S)
+
+# The start tag of the gpx root element. Group 1 is the namespace prefix.
+GPX_ROOT_RE = re.compile(r'<((?:[\w.-]+:)?)gpx\b[^>]*>')
+
+# Size in bytes above which the text of track files is not kept in memory,
+# and they are shown in the read-only text view rather than the editor.
+LARGE_TEXT_SIZE = 1000000
+
+
+class Cancelled(Exception):
+    '''Raised inside a load which has been superseded by another.'''
+    pass
+
+
+class TrackData(object):
+    '''A track and the arrays derived from it for display.
+
+    Args:
+        - *file*: filename the track came from, or None.
+        - *text*: the GPX text of the track, or None if it is not kept in
+          memory (see :data:`LARGE_TEXT_SIZE`).
+        - *coords*: array from :func:`pyxie.io.read_gpx`.
+
+    The other attributes are set by :meth:`prepare`.
+
+    '''
+    def __init__(self, file, text, coords):
+        self.file = file
+        self.text = text
+        self.coords = coords
+        self._spans = None
+        self._positions = None
+        self._previous = None
+
+    @classmethod
+    def load(cls, file, progress=None, check=None):
+        '''Read and prepare the track in *file*.
+
+        Args:
+            - *progress*: optional function taking a percentage and a
+              message.
+            - *check*: optional function called between steps, which
+              raises :class:`Cancelled` to stop the load.
+
+        '''
+        progress, check = _callbacks(progress, check)
+        progress(0, 'Reading %s' % os.path.basename(file))
+        # The text of a KMZ file is the KML document inside it. Large files
+        # are parsed from the file and shown memory mapped instead.
+        size = os.path.getsize(file)
+        if io.track_format(file) == 'kmz':
+            f = io.open_kml(file)
+        elif size > LARGE_TEXT_SIZE:
+            f = None
+        else:
+            f = open(file, mode='rb')
+        text = None
+        if f is not None:
+            with contextlib.closing(f):
+                text = f.read()
+            size = len(text)
+        parse_cache = cache.default_cache()
+        version = io.parser_version(file)
+        coords = parse_cache.get(file, version)
+        if coords is None:
+            chunks = []
+            if text is None:
+                source = open(file, mode='rb')
+            else:
+                source = StringIO.StringIO(text)
+            with contextlib.closing(source):
+                for chunk in io.iter_track(source, _text_format(file)):
+                    chunks.append(chunk)
+                    check()
+                    progress(50 * source.tell() // max(size, 1), 'Parsing')
+            coords = parse_cache.put(file, version,
+                                     io.chunks_to_coords(chunks))
+        data = cls(file, text, coords)
+        # The offsets of the trackpoints in the text, for finding a point in
+        # the GPX text view.
+        data.trkpt_spans()
+        data.prepare(progress, check, start=50)
+        return data
+
+    @classmethod
+    def from_text(cls, text, file=None, progress=None, check=None):
+        '''Parse and prepare the *text* of a track file, in the format of
+        *file*'s extension (see :func:`pyxie.io.track_format`), or GPX if
+        *file* is None.'''
+        progress, check = _callbacks(progress, check)
+        progress(0, 'Parsing')
+        data = cls(file, text, io.read_track(StringIO.StringIO(text),
+                                             _text_format(file)))
+        data.prepare(progress, check, start=50)
+        return data
+
+    def edited(self, text, progress=None, check=None):
+        '''Parse and prepare *text*, an edited version of this track's
+        text.
+
+        Only the trackpoints in the part of the text which changed are
+        parsed, and they are spliced into copies of this bundle's arrays.
+        The projection and the map simplification are updated the same way;
+        the rest is cheap enough to recompute. Edits outside the trackpoints
+        (e.g. to the metadata), or which do not parse on their own, are
+        handled by parsing the whole text with :meth:`from_text`.
+
+        '''
+        progress, check = _callbacks(progress, check)
+        progress(0, 'Parsing changes')
+        splice = self._splice_text(text)
+        if splice is None:
+            return self.from_text(text, self.file, progress, check)
+        i, j, coords, spans = splice
+        data = TrackData(self.file, text, coords)
+        data._spans = spans
+        data.prepare(progress, check, start=50, previous=(self, i, j))
+        return data
+
+    def trkpt_spans(self):
+        '''Return an (N, 2) array of the start and end offsets of each
+        trkpt element in the text.'''
+        if self._spans is None and self.text is None:
+            self._spans = _file_trkpt_spans(self.file)
+        elif self._spans is None:
+            self._spans = trkpt_spans(self.text)
+        return self._spans
+
+    def trkpt_positions(self):
+        '''Return the positions in a text editor of the start of each trkpt
+        element, which count characters rather than bytes.'''
+        if self._positions is None and self.text is None:
+            self._positions = self.trkpt_spans()[:, 0]
+        elif self._positions is None:
+            self._positions = text_positions(self.text,
+                                             self.trkpt_spans()[:, 0])
+        return self._positions
+
+    def _splice_text(self, text):
+        '''Return (i, j, coords, spans) for *text*, where trackpoints *i* to
+        *j* of this track have been replaced by those in the changed part of
+        *text*, or None if they cannot be parsed on their own.'''
+        spans = self.trkpt_spans()
+        if not len(spans) or len(spans) != len(self.coords):
+            return None
+        old = self.text
+        prefix = _common_prefix(old, text)
+        n = min(len(old), len(text)) - prefix
+        suffix = min(_common_prefix(old[::-1], text[::-1]), n)
+        # The trackpoints touching the change, and one either side in case
+        # it moved the boundary between two of them.
+        i = max(np.searchsorted(spans[:, 1], prefix, side='left') - 1, 0)
+        j = min(np.searchsorted(spans[:, 0], len(old) - suffix, side='right') + 1,
+                len(spans))
+        start = spans[i, 0]
+        end = spans[j - 1, 1]
+        if start > prefix or end < len(old) - suffix:
+            return None
+        root = GPX_ROOT_RE.search(text, 0, start)
+        if root is None:
+            return None
+        shift = len(text) - len(old)
+        fragment = text[start:end + shift]
+        # The fragment starts and ends inside a trkseg, so wrapping it in one
+        # balances any trkseg or trk boundaries inside it.
+        ns = root.group(1)
+        wrapped = '%s<%strk><%strkseg>%s</%strkseg></%strk></%sgpx>' % (
+                root.group(0), ns, ns, fragment, ns, ns, ns)
+        try:
+            coords = io.read_gpx(StringIO.StringIO(wrapped))
+        except Exception:
+            logger.debug('Could not parse edited trackpoints', exc_info=True)
+            return None
+        new_spans = trkpt_spans(fragment, ns) + start
+        if len(new_spans) != len(coords):
+            return None
+        coords = np.concatenate([self.coords[:i], coords, self.coords[j:]])
+        spans = np.concatenate([spans[:i], new_spans, spans[j:] + shift])
+        return i, j, coords, spans
+
+    def nbytes(self):
+        '''Return the approximate memory used by the bundle in bytes.'''
+        return _nbytes(self, 4, set())
+
+    def prepare(self, progress=None, check=None, start=0, previous=None):
+        '''Compute everything needed to show the track.
+
+        *progress* and *check* are as for :meth:`load`, and *start* is the
+        percentage to report progress from. *previous* is used by
+        :meth:`edited`: a tuple (bundle, i, j) of the bundle this one is an
+        edit of, in which points *i* to *j* were replaced.
+
+        '''
+        progress, check = _callbacks(progress, check)
+        self._previous = previous
+        times, lons, lats, elevs = self.coords.T
+        steps = [('Projecting', self._project),
+                 ('Indexing', self._index),
+                 ('Simplifying map', self._decimate_path),
+                 ('Calculating speeds', self._geodesic),
+                 ('Simplifying graph', self._decimate_series),
+                 ('Calculating statistics', self._stats)]
+        for i, (message, step) in enumerate(steps):
+            check()
+            progress(start + (100 - start) * i // len(steps), message)
+            step(times, lons, lats, elevs)
+        self._previous = None
+        progress(100, 'Done')
+
+    def _project(self, times, lons, lats, elevs):
+        if self._previous is None:
+            self.epsg = core.utm_epsg(lons, lats)
+            # The projection is kept on this bundle rather than in the
+            # cache of core.project_coords, which other threads share.
+            self.xs, self.ys = core.convert_coordinate_system(
+                    lons, lats, epsg2=self.epsg)
+            return
+        # Keep the old projection, so that the map does not jump.
+        previous, i, j = self._previous
+        k = len(self.coords) - (len(previous.coords) - j)
+        self.epsg = previous.epsg
+        xs, ys = core.convert_coordinate_system(lons[i:k], lats[i:k],
+                                                epsg2=self.epsg)
+        self.xs = np.concatenate([previous.xs[:i], xs, previous.xs[j:]])
+        self.ys = np.concatenate([previous.ys[:i], ys, previous.ys[j:]])
+
+    def _index(self, times, lons, lats, elevs):
+        self.index = spatial.GridIndex(self.xs, self.ys)
+
+    def _decimate_path(self, times, lons, lats, elevs):
+        if self._previous is None:
+            self.path_decimator = decimate.PathDecimator(self.xs, self.ys)
+        else:
+            previous, i, j = self._previous
+            self.path_decimator = previous.path_decimator.splice(
+                    i, j, self.xs, self.ys)
+
+    def _geodesic(self, times, lons, lats, elevs):
+        self.geodesic = core.geodesic(lons, lats, times)
+        self.speeds = self.geodesic.speeds * 3.6
+        self.elevs = elevs
+        self.mpl_dts = epoch_to_mpl(times)
+        self.time_order = np.argsort(self.mpl_dts, kind='mergesort')
+        self.sorted_mpl_dts = self.mpl_dts[self.time_order]
+
+    def _decimate_series(self, times, lons, lats, elevs):
+        self.series_decimators = {
+                'line': decimate.SeriesDecimator(self.mpl_dts, self.speeds),
+                'line_elev': decimate.SeriesDecimator(self.mpl_dts, self.elevs)}
+
+    def _stats(self, times, lons, lats, elevs):
+        self.stats = stats.track_stats(times, lons, lats, elevs,
+                                       geodesic=self.geodesic)
+        self.selection_stats = stats.SelectionStats(
+                times, lons, lats, elevs, geodesic=self.geodesic)
+
+
+class TrackCache(object):
+    '''Least recently used cache of :class:`TrackData` bundles by file.
+
+    Args:
+        - *max_size*: maximum total size of the arrays held, in bytes.
+
+    Entries are dropped when their file's modification time or size
+    changes.
+
+    '''
+    def __init__(self, max_size=None):
+        if max_size is None:
+            max_size = int(config.getfloat('prefetch', 'max_size_mb') * 1e6)
+        self.max_size = max_size
+        self.size = 0
+        self.entries = collections.OrderedDict()
+
+    def __contains__(self, file):
+        return self.get(file, touch=False) is not None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, file, touch=True):
+        '''Return the bundle for *file*, or None.'''
+        file = os.path.abspath(file)
+        if not file in self.entries:
+            return None
+        state, data, size = self.entries[file]
+        try:
+            current_state = _file_state(file)
+        except OSError:
+            current_state = None
+        if state != current_state:
+            self.remove(file)
+            return None
+        if touch:
+            del self.entries[file]
+            self.entries[file] = (state, data, size)
+        return data
+
+    def put(self, data):
+        '''Add a bundle loaded from a file, dropping the least recently
+        used bundles to stay within the size limit.'''
+        file = os.path.abspath(data.file)
+        self.remove(file)
+        size = data.nbytes()
+        if size > self.max_size:
+            return
+        self.entries[file] = (_file_state(file), data, size)
+        self.size += size
+        while self.size > self.max_size:
+            self.remove(next(iter(self.entries)))
+
+    def remove(self, file):
+        if file in self.entries:
+            state, data, size = self.entries.pop(file)
+            self.size -= size
+
+
+class LoaderSignals(qt.QtCore.QObject):
+    progress = qt.QtCore.pyqtSignal(object, int, str)
+    loaded = qt.QtCore.pyqtSignal(object, object)
+    failed = qt.QtCore.pyqtSignal(object, str)
+
+
+class LoadJob(qt.QtCore.QRunnable):
+    '''Run *function* (e.g. :meth:`TrackData.load`) on a thread pool,
+    passing it *args* and the keyword arguments *progress* and *check*.'''
+    def __init__(self, signals, function, *args):
+        qt.QtCore.QRunnable.__init__(self)
+        self.signals = signals
+        self.function = function
+        self.args = args
+        self.cancelled = False
+        self.prefetch = False
+        self.file = None
+
+    def check(self):
+        if self.cancelled:
+            raise Cancelled()
+
+    def report(self, percent, message):
+        self.signals.progress.emit(self, percent, message)
+
+    def run(self):
+        try:
+            data = self.function(*self.args, progress=self.report,
+                                 check=self.check)
+        except Cancelled:
+            logger.debug('Load cancelled: %s' % (self.args, ))
+        except Exception as e:
+            logger.exception('Load failed: %s' % (self.args, ))
+            self.signals.failed.emit(self, str(e))
+        else:
+            self.signals.loaded.emit(self, data)
+
+
+class TrackLoader(qt.QtCore.QObject):
+    '''Loads tracks on worker threads.
+
+    Only one load is current: starting a load cancels the previous one,
+    whose results are never delivered. Files can also be prefetched into
+    :attr:`cache`, at a lower priority than the current load. Signals are
+    received on the GUI thread.
+
+    Signals:
+        - *progress(int, str)*: percentage done and a message.
+        - *loaded(TrackData)*
+        - *failed(str)*: error message.
+
+    '''
+    progress = qt.QtCore.pyqtSignal(int, str)
+    loaded = qt.QtCore.pyqtSignal(object)
+    failed = qt.QtCore.pyqtSignal(str)
+
+    def __init__(self, parent=None, cache=None):
+        qt.QtCore.QObject.__init__(self, parent)
+        if cache is None:
+            cache = TrackCache()
+        self.cache = cache
+        self.pool = qt.QtCore.QThreadPool(self)
+        # One thread for the current load and one for prefetching: more
+        # would mostly contend for the GIL with the GUI thread.
+        self.pool.setMaxThreadCount(2)
+        self.job = None
+        self.prefetch_jobs = {}
+        self.signals = LoaderSignals(self)
+        self.signals.progress.connect(self._on_progress)
+        self.signals.loaded.connect(self._on_loaded)
+        self.signals.failed.connect(self._on_failed)
+
+    def load_file(self, file):
+        '''Load *file*, from the cache or a prefetch in progress if
+        possible.'''
+        file = os.path.abspath(file)
+        self.cancel()
+        data = self.cache.get(file)
+        if data is not None:
+            logger.debug('Prefetched: %s' % file)
+            self.loaded.emit(data)
+        elif file in self.prefetch_jobs:
+            logger.debug('Waiting for prefetch: %s' % file)
+            self.job = self.prefetch_jobs[file]
+        else:
+            job = LoadJob(self.signals, TrackData.load, file)
+            job.file = file
+            self._start(job)
+
+    def load_text(self, text, file=None, previous=None):
+        '''Load the GPX *text*. If it is an edit of the text of the bundle
+        *previous*, only the changes are parsed (see
+        :meth:`TrackData.edited`).'''
+        self.cancel()
+        if previous is None:
+            job = LoadJob(self.signals, TrackData.from_text, text, file)
+        else:
+            job = LoadJob(self.signals, previous.edited, text)
+        self._start(job)
+
+    def prefetch(self, files):
+        '''Prefetch *files* into the cache in the background, cancelling
+        prefetches of any other files.'''
+        files = [os.path.abspath(file) for file in files]
+        for file, job in list(self.prefetch_jobs.items()):
+            if not file in files and job is not self.job:
+                job.cancelled = True
+                del self.prefetch_jobs[file]
+        for file in files:
+            if file in self.prefetch_jobs or file in self.cache:
+                continue
+            job = LoadJob(self.signals, TrackData.load, file)
+            job.prefetch = True
+            job.file = file
+            self.prefetch_jobs[file] = job
+            self.pool.start(job, -1)
+
+    def cancel(self):
+        if self.job is not None:
+            # A prefetch being waited for carries on as a prefetch.
+            if not self.job.prefetch:
+                self.job.cancelled = True
+            self.job = None
+
+    def busy(self):
+        return self.job is not None
+
+    def _start(self, job):
+        self.job = job
+        self.pool.start(job)
+
+    def _finish_prefetch(self, job):
+        if job.prefetch and self.prefetch_jobs.get(job.file) is job:
+            del self.prefetch_jobs[job.file]
+
+    def _on_progress(self, job, percent, message):
+        if job is self.job:
+            self.progress.emit(percent, message)
+
+    def _on_loaded(self, job, data):
+        self._finish_prefetch(job)
+        # Keep every file loaded, so that going back to it is instant too.
+        if job.file is not None:
+            self.cache.put(data)
+        if job is self.job:
+            self.job = None
+            self.loaded.emit(data)
+
+    def _on_failed(self, job, message):
+        self._finish_prefetch(job)
+        if job is self.job:
+            self.job = None
+            self.failed.emit(message)
+
+
+def epoch_to_mpl(times):
+    '''Convert an array of seconds since 1970-01-01 UTC to matplotlib date
+    numbers (days since matplotlib's epoch, in UTC).'''
+    epoch = dates.date2num(datetime.datetime(1970, 1, 1, tzinfo=timezone('UTC')))
+    return np.asarray(times, dtype=np.float64) / 86400. + epoch
+
+
+def trkpt_spans(text, ns=None):
+    '''Return an (N, 2) array of the start and end offsets of each trkpt
+    element in a GPX document.
+
+    Args:
+        - *text*: the document, as a byte string or another buffer such as
+          an mmap.
+        - *ns*: namespace prefix of the tags (e.g. ``'gpx:'``). By default
+          it is taken from the root element.
+
+    The tags are found with array operations on the bytes of the text, so
+    this is quick enough to run on every file loaded. Text which is not a
+    buffer (e.g. unicode) is searched with :data:`TRKPT_RE` instead.
+
+    '''
+    if ns is None:
+        root = GPX_ROOT_RE.search(text)
+        ns = root.group(1) if root else ''
+    try:
+        chars = np.frombuffer(text, dtype=np.uint8)
+    except (TypeError, ValueError):
+        chars = None
+    if chars is None or chars.itemsize * len(chars) != len(text):
+        return np.array([match.span() for match in TRKPT_RE.finditer(text)],
+                        dtype=np.int64).reshape(-1, 2)
+    starts = _find_tags(chars, '<%strkpt' % ns)
+    closes = _find_tags(chars, '</%strkpt' % ns)
+    gts = np.flatnonzero(chars == ord('>'))
+    spans = np.empty((len(starts), 2), dtype=np.int64)
+    spans[:, 0] = starts
+    if not len(starts):
+        return spans
+    # A start tag ending in "/>" is the whole element; otherwise the element
+    # ends at the ">" of the next end tag.
+    tag_ends = gts[np.searchsorted(gts, starts)] + 1
+    self_closing = chars[tag_ends - 2] == ord('/')
+    k = np.searchsorted(closes, starts[~self_closing])
+    if len(k) and k.max() >= len(closes):
+        raise ValueError('Unclosed trkpt element')
+    spans[~self_closing, 1] = gts[np.searchsorted(gts, closes[k])] + 1
+    spans[self_closing, 1] = tag_ends[self_closing]
+    return spans
+
+
+def _file_trkpt_spans(file):
+    '''Return :func:`trkpt_spans` of a file, read memory mapped.'''
+    if not os.path.getsize(file):
+        # Empty files cannot be memory mapped.
+        return trkpt_spans(b'')
+    with open(file, mode='rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        return trkpt_spans(data)
+    finally:
+        data.close()
+
+
+def text_positions(text, offsets):
+    '''Return the positions in a Qt text editor of byte *offsets* into
+    UTF-8 *text*.
+
+    Qt counts UTF-16 code units, so each character counts once, or twice if
+    it is outside the Basic Multilingual Plane. Offsets into ASCII text, or
+    into text which is not a byte string, are returned as they are.
+
+    '''
+    try:
+        chars = np.frombuffer(text, dtype=np.uint8)
+    except (TypeError, ValueError):
+        return offsets
+    if chars.itemsize * len(chars) != len(text) or not (chars >= 0x80).any():
+        return offsets
+    # Count the first byte of each character, and again for four byte ones.
+    units = ((chars & 0xc0) != 0x80).astype(np.int64)
+    units += chars >= 0xf0
+    return np.r_[0, np.cumsum(units)][offsets]
+
+
+def _find_tags(chars, prefix):
+    '''Return the offsets in a uint8 array of the tags starting with
+    *prefix* followed by the end of the tag name.'''
+    codes = [ord(c) for c in prefix]
+    n = len(chars) - len(codes)
+    offsets = np.flatnonzero(chars[:max(n, 0)] == codes[0])
+    for k, code in enumerate(codes[1:]):
+        offsets = offsets[chars[offsets + k + 1] == code]
+    after = chars[offsets + len(codes)]
+    name_ends = np.array([ord(c) for c in ' \t\r\n/>'], dtype=np.uint8)
+    return offsets[np.in1d(after, name_ends)]
+
+
+def _text_format(file):
+    '''Return the format of the text of a track file, for
+    :func:`pyxie.io.iter_track`.'''
+    if file is None:
+        return 'gpx'
+    return {'kmz': 'kml'}.get(io.track_format(file), io.track_format(file))
+
+
+def _common_prefix(a, b, block_size=65536):
+    '''Return the length of the longest common prefix of two strings.'''
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i:i + block_size] == b[i:i + block_size]:
+        i += block_size
+    lo, hi = min(i, n), min(i + block_size, n)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[i:mid] == b[i:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def _file_state(file):
+    st = os.stat(file)
+    return (st.st_mtime, st.st_size)
+
+
+def _nbytes(obj, depth, seen):
+    '''Return the total size of the numpy arrays and strings in *obj*, its
+    containers and its attributes, to *depth* levels, counting each object
+    (by id) in *seen* only once.'''
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, (str, bytes)):
+        return len(obj)
+    if depth <= 0:
+        return 0
+    if isinstance(obj, dict):
+        items = obj.values()
+    elif isinstance(obj, (list, tuple)):
+        items = obj
+    elif hasattr(obj, '__dict__'):
+        items = vars(obj).values()
+    else:
+        return 0
+    return sum(_nbytes(item, depth - 1, seen) for item in items)
+
+
+def _callbacks(progress, check):
+    if progress is None:
+        progress = lambda percent, message: None
+    if check is None:
+        check = lambda: None
+    return progress, check
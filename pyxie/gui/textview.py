@@ -0,0 +1,234 @@
+'''Read-only view of large text files.
+
+A QTextEdit lays out the whole document it is given, which for a GPX
+file of a few megabytes takes seconds and hundreds of megabytes.
+:class:`TextView` instead draws only the lines in view, read from a
+:class:`MappedText`: the file memory-mapped, with an index of the offsets
+of its lines. Neither holds the text in memory, so the cost of showing a
+file does not depend on its size.
+
+:func:`reformat_gpx` puts each tag of a GPX file on its own line, copying
+it a chunk at a time, e.g. into a temporary file to show in the view.
+
+'''
+import logging
+import mmap
+import os
+import re
+
+import numpy as np
+
+from . import loader
+from . import qt
+
+
+logger = logging.getLogger(__name__)
+
+# Space around the text in the view, in pixels.
+MARGIN = 4
+
+
+class MappedText(object):
+    '''Lines of a memory-mapped text file.
+
+    Args:
+        - *filename*: the file.
+        - *trkpt_spans*: for GPX files, the (N, 2) array of the offsets of
+          the trkpt elements if it is already known (see
+          :func:`pyxie.gui.loader.trkpt_spans`), or None to find them when
+          they are first needed.
+
+    '''
+    def __init__(self, filename, trkpt_spans=None):
+        self.filename = filename
+        self.size = os.path.getsize(filename)
+        if self.size:
+            with open(filename, mode='rb') as f:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            chars = np.frombuffer(self.data, dtype=np.uint8)
+            newlines = np.flatnonzero(chars == ord('\n'))
+            del chars
+        else:
+            # Empty files cannot be memory mapped.
+            self.data = b''
+            newlines = np.empty(0, dtype=np.int64)
+        self.starts = np.concatenate([[0], newlines + 1])
+        self.longest = int(np.diff(np.r_[self.starts, self.size + 1]).max()) - 1
+        self._trkpt_spans = trkpt_spans
+
+    def __len__(self):
+        return len(self.starts)
+
+    def close(self):
+        if self.size:
+            self.data.close()
+
+    def line_end(self, i):
+        '''Return the offset of the end of line *i*, excluding the line
+        break.'''
+        if i + 1 < len(self.starts):
+            return self.starts[i + 1] - 1
+        return self.size
+
+    def text(self, i, col0=0, col1=None):
+        '''Return columns *col0* to *col1* of line *i* as unicode.'''
+        start = self.starts[i]
+        end = self.line_end(i)
+        if col1 is not None:
+            end = min(start + col1, end)
+        start = min(start + col0, end)
+        return self.data[start:end].decode('utf-8', 'replace').rstrip('\r')
+
+    def line_of(self, offset):
+        '''Return (line, column) of byte *offset*.'''
+        i = int(np.searchsorted(self.starts, offset, side='right')) - 1
+        return i, int(offset - self.starts[i])
+
+    def trkpt_offset(self, index):
+        '''Return the offset of the start of trackpoint *index*, or None if
+        there is no such trkpt element (e.g. in a KML file).'''
+        if self._trkpt_spans is None:
+            self._trkpt_spans = loader.trkpt_spans(self.data)
+        if index >= len(self._trkpt_spans):
+            return None
+        return self._trkpt_spans[index, 0]
+
+
+class TextView(qt.QtGui.QAbstractScrollArea):
+    '''Read-only, monospaced view of a :class:`MappedText`.
+
+    Only the lines and columns in view are read and drawn, so scrolling
+    through a file of any size and any line length is quick.
+
+    '''
+    def __init__(self, parent=None):
+        qt.QtGui.QAbstractScrollArea.__init__(self, parent)
+        self.document = None
+        self.highlighted = None
+        font = qt.QtGui.QFont('monospace')
+        font.setStyleHint(qt.QtGui.QFont.TypeWriter)
+        self.setFont(font)
+        self.viewport().setBackgroundRole(qt.QtGui.QPalette.Base)
+        self.viewport().setAutoFillBackground(True)
+
+    def set_document(self, document):
+        '''Show a :class:`MappedText`, or nothing if *document* is None.'''
+        if self.document is not None and self.document is not document:
+            self.document.close()
+        self.document = document
+        self.highlighted = None
+        self.verticalScrollBar().setValue(0)
+        self.horizontalScrollBar().setValue(0)
+        self.update_scrollbars()
+        self.viewport().update()
+
+    def line_height(self):
+        return self.fontMetrics().lineSpacing()
+
+    def char_width(self):
+        return self.fontMetrics().width('M')
+
+    def page_lines(self):
+        return max(self.viewport().height() // self.line_height(), 1)
+
+    def update_scrollbars(self):
+        nlines = 0 if self.document is None else len(self.document)
+        longest = 0 if self.document is None else self.document.longest
+        page = self.page_lines()
+        bar = self.verticalScrollBar()
+        bar.setRange(0, max(nlines - page, 0))
+        bar.setPageStep(page)
+        width = self.viewport().width()
+        bar = self.horizontalScrollBar()
+        bar.setRange(0, max(longest * self.char_width() + 2 * MARGIN - width, 0))
+        bar.setPageStep(width)
+        bar.setSingleStep(self.char_width())
+
+    def scroll_to_offset(self, offset):
+        '''Scroll to and highlight the line containing byte *offset*.'''
+        if self.document is None:
+            return
+        line, column = self.document.line_of(offset)
+        self.highlighted = line
+        self.verticalScrollBar().setValue(line - self.page_lines() // 3)
+        x = column * self.char_width()
+        bar = self.horizontalScrollBar()
+        if not bar.value() <= x < bar.value() + self.viewport().width() - MARGIN:
+            bar.setValue(x - MARGIN)
+        self.viewport().update()
+
+    def resizeEvent(self, event):
+        qt.QtGui.QAbstractScrollArea.resizeEvent(self, event)
+        self.update_scrollbars()
+
+    def scrollContentsBy(self, dx, dy):
+        self.viewport().update()
+
+    def paintEvent(self, event):
+        if self.document is None:
+            return
+        painter = qt.QtGui.QPainter(self.viewport())
+        painter.setFont(self.font())
+        metrics = self.fontMetrics()
+        height = metrics.lineSpacing()
+        char_width = self.char_width()
+        width = self.viewport().width()
+        first = self.verticalScrollBar().value()
+        last = min(first + self.page_lines() + 1, len(self.document))
+        x = self.horizontalScrollBar().value() - MARGIN
+        col0 = max(x // char_width, 0)
+        col1 = col0 + width // char_width + 2
+        palette = self.palette()
+        for i in range(first, last):
+            y = (i - first) * height
+            if i == self.highlighted:
+                painter.fillRect(0, y, width, height, palette.highlight())
+                painter.setPen(palette.highlightedText().color())
+            else:
+                painter.setPen(palette.text().color())
+            painter.drawText(col0 * char_width - x, y + metrics.ascent(),
+                             self.document.text(i, col0, col1))
+        painter.end()
+
+
+def reformat_gpx(source, dest, chunk_size=1 << 20):
+    '''Copy GPX text with each tag on its own line and the ``ele`` and
+    ``time`` elements indented.
+
+    Args:
+        - *source, dest*: file-like objects to read and write.
+        - *chunk_size*: number of bytes to read at a time.
+
+    The text is reformatted a chunk at a time. Each chunk is cut before a
+    ``<`` which follows neither ``>`` nor a line break, where no tag
+    boundary that needs changing can straddle the cut.
+
+    '''
+    carry = ''
+    while True:
+        chunk = source.read(chunk_size)
+        text = carry + chunk
+        if not chunk:
+            cut = len(text)
+        else:
+            cut = _safe_cut(text)
+        dest.write(_reformat(text[:cut]))
+        carry = text[cut:]
+        if not chunk:
+            break
+
+
+def _safe_cut(text):
+    i = len(text)
+    while True:
+        i = text.rfind('<', 0, i)
+        if i <= 0:
+            return 0
+        if not text[i - 1] in '>\n':
+            return i
+
+
+def _reformat(text):
+    text = re.sub(r'><', r'>\n<', text)
+    text = re.sub(r'\n<ele>', r'\n  <ele>', text)
+    return re.sub(r'\n<time>', r'\n  <time>', text)
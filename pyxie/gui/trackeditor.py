@@ -9,15 +9,15 @@ software with a GUI.
 Another thing is splitting and cleaning GPX tracks. I want to be able to do it 
 visually but I always seem to end up manually editing the XML file (!)'''
 import argparse
-import datetime
 import logging
 import os
-import re
+import shutil
+import sys
+import tempfile
 try:
     import cStringIO as StringIO
 except ImportError:
     import StringIO
-import sys
 
 from matplotlib import dates
 from matplotlib.gridspec import GridSpec
@@ -28,17 +28,25 @@ from pytz import timezone, common_timezones
 
 from ..config import config
 from .. import io
-from .. import core
 from .. import stats
 from .. import utils
+from . import filetree
+from . import loader
 from . import qt
+from . import textview
 
 
 APP_NAME = 'Pyxie Track Editor'
 TRACKS_DIR = config.get('paths', 'default_tracks')
-EXTENSIONS = ['gpx', 'kml', 'kmz']
+EXTENSIONS = ['gpx', 'kml', 'kmz', 'csv', 'nmea', 'nma']
 
 logger = logging.getLogger(__name__)
+
+# Shortest time between redraws of the hover markers (60 fps).
+HOVER_INTERVAL_MS = 1000 // 60
+
+# Pause in typing in the GPX editor after which the track is updated.
+EDIT_DELAY_MS = 500
                 
         
 class TrackEditor(qt.MainWindow):
@@ -70,6 +78,18 @@ class TrackEditor(qt.MainWindow):
         
         self.map = None
         self.graph = None
+        self.data = None
+        self.file = None
+        self.track_txt = ''
+        self.text_file = None
+        self.reformatted_file = None
+        self.hovered_index = None
+        self.selection_stats = None
+        
+        self.loader = loader.TrackLoader(self)
+        self.loader.progress.connect(self.slot_load_progress)
+        self.loader.loaded.connect(self.show_track)
+        self.loader.failed.connect(self.slot_load_failed)
 
         self.cwds = [ks['cwd']]
 
@@ -119,6 +139,18 @@ class TrackEditor(qt.MainWindow):
         self.actions.open_track.triggered.connect(self.slot_open_track)
         self.actions.save_track = self.create_action('Save track', shortcut='Ctrl+S')
         self.actions.save_track.triggered.connect(self.slot_save_track)
+        self.actions.export_track = self.create_action(
+                'Export points...',
+                tip='Write the points of the track to a new GPX file')
+        self.actions.export_track.triggered.connect(self.slot_export_track)
+        self.actions.next_track = self.create_action(
+                'Next track', shortcut='Alt+Down',
+                tip='Open the next track file in the same folder')
+        self.actions.next_track.triggered.connect(self.slot_next_track)
+        self.actions.previous_track = self.create_action(
+                'Previous track', shortcut='Alt+Up',
+                tip='Open the previous track file in the same folder')
+        self.actions.previous_track.triggered.connect(self.slot_previous_track)
         self.actions.flip_split_direction = self.create_action('Flip graph orientation')
         self.actions.flip_split_direction.triggered.connect(self.slot_flip_split_direction)
         self.actions.exit = self.create_action('E&xit', shortcut='Alt+F4')
@@ -132,7 +164,10 @@ class TrackEditor(qt.MainWindow):
         self.menu.file = self.menu.bar.addMenu('&File')
         self.menu.view = self.menu.bar.addMenu('&View')
         self.menu.help = self.menu.bar.addMenu('&Help')
-        self.add_actions(self.menu.file, [self.actions.open_track, self.actions.save_track, self.actions.exit])
+        self.add_actions(self.menu.file, [self.actions.open_track, self.actions.save_track,
+                                          self.actions.export_track,
+                                          None, self.actions.previous_track, self.actions.next_track,
+                                          None, self.actions.exit])
         self.add_actions(self.menu.view, [self.actions.flip_split_direction])
         self.add_actions(self.menu.help, [self.actions.about])
 
@@ -155,7 +190,8 @@ class TrackEditor(qt.MainWindow):
 
         self.widgets.centre_tab = qt.QtGui.QTabWidget(self.widgets.mainwindow_central)
         self.widgets.centre = qt.QtGui.QWidget()
-        # self.widgets.file_load_progress = qt.QtGui.QProgressBar()
+        self.widgets.file_load_progress = qt.QtGui.QProgressBar()
+        self.widgets.file_load_progress.setRange(0, 100)
         
         self.widgets.map = TrackMap(5, 5)
         self.widgets.graph = TrackGraph(5, 5, **ks['graph_kws'])
@@ -163,9 +199,17 @@ class TrackEditor(qt.MainWindow):
         self.widgets.gpx_edit_box = qt.QtGui.QTextEdit(self.widgets.gpx_editor)
         self.widgets.gpx_edit_box.acceptRichText = False
         self.widgets.gpx_edit_box.setFontFamily('monospace')
+        self.gpx_edit_timer = qt.QtCore.QTimer(self)
+        self.gpx_edit_timer.setSingleShot(True)
+        self.gpx_edit_timer.setInterval(EDIT_DELAY_MS)
+        self.gpx_edit_timer.timeout.connect(self.slot_gpx_text_edited)
         self.widgets.gpx_reformat_button = qt.QtGui.QPushButton('Reformat GPX with helpful linebreaks',
                                                                 self.widgets.gpx_editor)
         self.widgets.gpx_reformat_button.clicked.connect(self.slot_reformat_gpx)
+        self.widgets.gpx_text_view = textview.TextView(self.widgets.gpx_editor)
+        self.widgets.gpx_text_stack = qt.QtGui.QStackedWidget(self.widgets.gpx_editor)
+        self.widgets.gpx_text_stack.addWidget(self.widgets.gpx_edit_box)
+        self.widgets.gpx_text_stack.addWidget(self.widgets.gpx_text_view)
         self.widgets.stats = qt.QtGui.QWidget()
         self.widgets.stats_box = qt.QtGui.QTextEdit(self)
         self.widgets.stats_box.setReadOnly(True)
@@ -182,13 +226,14 @@ class TrackEditor(qt.MainWindow):
 
         self.layouts.gpx_editor = qt.QtGui.QVBoxLayout(self.widgets.gpx_editor)
         self.layouts.gpx_editor.addWidget(self.widgets.gpx_reformat_button)
-        self.layouts.gpx_editor.addWidget(self.widgets.gpx_edit_box)
+        self.layouts.gpx_editor.addWidget(self.widgets.gpx_text_stack)
 
         self.widgets.map_graph_splitter.addWidget(self.widgets.map)
         self.widgets.map_graph_splitter.addWidget(self.widgets.graph)
 
         self.widgets.centre_tab.addTab(self.widgets.map_graph_splitter, 'Map and graph')
         self.widgets.centre_tab.addTab(self.widgets.gpx_editor, 'GPX editor')
+        self.widgets.centre_tab.currentChanged.connect(self.slot_centre_tab_changed)
 
         self.layouts.gpx_files = qt.QtGui.QVBoxLayout(self.widgets.gpx_files)
         self.layouts.gpx_files.addWidget(self.widgets.gpx_files_path_select_button)
@@ -200,9 +245,9 @@ class TrackEditor(qt.MainWindow):
         self.layouts.gpx_files_query.addWidget(self.widgets.gpx_files_query_box)
 
         self.layouts.centre = qt.QtGui.QVBoxLayout(self.widgets.centre)
-        # self.layouts.centre.addWidget(self.widgets.file_load_progress)
+        self.layouts.centre.addWidget(self.widgets.file_load_progress)
         self.layouts.centre.addWidget(self.widgets.centre_tab)
-        # self.widgets.file_load_progress.hide()
+        self.widgets.file_load_progress.hide()
 
         self.widgets.main_window_splitter.addWidget(self.widgets.gpx_files)
         self.widgets.main_window_splitter.addWidget(self.widgets.centre)
@@ -222,7 +267,7 @@ class TrackEditor(qt.MainWindow):
         self.graph.clear(axis='off')
 
     def init_gpx_files_tree(self, **kws):
-        self.gpx_files_model = qt.QtGui.QFileSystemModel()
+        self.gpx_files_model = filetree.TrackFileModel(self)
         self.gpx_files_model_expanded_indices = []
         self.widgets.gpx_files_tree.setModel(self.gpx_files_model)
         self.widgets.gpx_files_tree.expanded.connect(self.slot_gpx_files_tree_item_expanded)
@@ -293,33 +338,142 @@ class TrackEditor(qt.MainWindow):
         dialog.setFileMode(qt.QtGui.QFileDialog.ExistingFile)
         fn = dialog.getOpenFileName(self,
                 'Import track file', self.cwds[-1],
-                'GPS Exchange Format (*.gpx)'
+                'Track files (*.gpx *.kml *.kmz *.csv *.nmea *.nma);;'
+                'GPS Exchange Format (*.gpx);;'
+                'Keyhole Markup Language (*.kml *.kmz);;'
+                'CSV logs (*.csv);;'
+                'NMEA logs (*.nmea *.nma)'
                 )
         self.open_track(fn)
         
+    def slot_next_track(self):
+        self.open_sibling_track(1)
+        
+    def slot_previous_track(self):
+        self.open_sibling_track(-1)
+        
     def slot_save_track(self):
+        if self.file is not None and io.track_format(self.file) == 'kmz':
+            self.statusbar.showMessage(
+                    'Saving KMZ files is not supported; use Export points')
+            return
+        if self.showing_text_view():
+            if self.text_file != self.file:
+                shutil.copyfile(self.text_file, self.file)
+            return
+        self.flush_gpx_edits()
         with open(self.file, mode='w') as f:
             f.write(self.track_txt)
         
+    def slot_export_track(self):
+        self.flush_gpx_edits()
+        if self.data is None:
+            return
+        fn = qt.QtGui.QFileDialog.getSaveFileName(self,
+                'Export track points', self.cwds[-1],
+                'GPS Exchange Format (*.gpx)')
+        if not fn:
+            return
+        fn = str(fn)
+        name = None
+        if self.file is not None:
+            name = os.path.splitext(os.path.basename(self.file))[0]
+        n = io.write_gpx(fn, self.data.coords, name=name)
+        self.statusbar.showMessage('Wrote %d points to %s' % (n, fn))
+        
     def slot_reformat_gpx(self):
-        self.track_txt = re.sub(r'><', r'>\n<', self.track_txt)
-        self.track_txt = re.sub(r'\n<ele>', r'\n  <ele>', self.track_txt)
-        self.track_txt = re.sub(r'\n<time>', r'\n  <time>', self.track_txt)
+        if self.showing_text_view():
+            # Reformat into a temporary file a chunk at a time, rather than
+            # holding the whole document in memory.
+            fd, fn = tempfile.mkstemp(prefix='pyxie-', suffix='.gpx')
+            with os.fdopen(fd, 'w') as dest:
+                with open(self.text_file, mode='r') as source:
+                    textview.reformat_gpx(source, dest)
+            self.remove_reformatted_file()
+            self.reformatted_file = fn
+            self.show_text_file(fn)
+            return
+        self.flush_gpx_edits()
+        dest = StringIO.StringIO()
+        textview.reformat_gpx(StringIO.StringIO(self.track_txt), dest)
+        self.track_txt = dest.getvalue()
         self.slot_show_gpx_in_tab()
 
     def slot_gpx_text_changed(self):
-        self.open_gpx_txt(str(self.widgets.gpx_edit_box.document().toPlainText()))
+        # Wait for a pause in typing rather than re-reading on every key.
+        self.gpx_edit_timer.start()
+        
+    def slot_gpx_text_edited(self):
+        self.track_txt = str(self.widgets.gpx_edit_box.document().toPlainText())
+        self.open_gpx_txt(self.track_txt)
+        
+    def flush_gpx_edits(self):
+        '''Apply edits to the GPX text still waiting for a pause in
+        typing.'''
+        if self.gpx_edit_timer.isActive():
+            self.gpx_edit_timer.stop()
+            self.slot_gpx_text_edited()
         
     def slot_show_gpx_in_tab(self):
+        self.gpx_edit_timer.stop()
         try:
             self.widgets.gpx_edit_box.textChanged.disconnect(self.slot_gpx_text_changed)
         except:
             pass
         self.widgets.gpx_edit_box.clear()
+        self.remove_reformatted_file()
+        if (self.file is not None and self.data is not None
+                and self.data.text is None):
+            self.show_text_file(self.file, self.data.trkpt_spans())
+            self.statusbar.showMessage(
+                    '%s is too large to edit, and is shown read-only' % self.file)
+            return
+        self.text_file = None
+        self.widgets.gpx_text_view.set_document(None)
+        self.widgets.gpx_text_stack.setCurrentWidget(self.widgets.gpx_edit_box)
         self.widgets.gpx_edit_box.insertPlainText(self.track_txt)
         self.widgets.gpx_edit_box.textChanged.connect(self.slot_gpx_text_changed)
+        
+    def show_text_file(self, file, trkpt_spans=None):
+        '''Show *file* in the read-only text view.'''
+        self.text_file = file
+        self.widgets.gpx_text_view.set_document(
+                textview.MappedText(file, trkpt_spans))
+        self.widgets.gpx_text_stack.setCurrentWidget(self.widgets.gpx_text_view)
+        
+    def showing_text_view(self):
+        return (self.widgets.gpx_text_stack.currentWidget()
+                is self.widgets.gpx_text_view)
+        
+    def remove_reformatted_file(self):
+        if self.reformatted_file is not None:
+            self.widgets.gpx_text_view.set_document(None)
+            os.remove(self.reformatted_file)
+            self.reformatted_file = None
+        
+    def slot_centre_tab_changed(self, index):
+        if (self.widgets.centre_tab.widget(index) is self.widgets.gpx_editor
+                and self.hovered_index is not None):
+            self.show_point_in_text(self.hovered_index)
+        
+    def show_point_in_text(self, i):
+        '''Scroll the GPX text to trackpoint *i*.'''
+        if self.showing_text_view():
+            view = self.widgets.gpx_text_view
+            offset = view.document.trkpt_offset(i)
+            if offset is not None:
+                view.scroll_to_offset(offset)
+        elif self.data is not None and self.data.text is self.track_txt:
+            positions = self.data.trkpt_positions()
+            if i >= len(positions):
+                return
+            cursor = self.widgets.gpx_edit_box.textCursor()
+            cursor.setPosition(int(positions[i]))
+            self.widgets.gpx_edit_box.setTextCursor(cursor)
+            self.widgets.gpx_edit_box.ensureCursorVisible()
 
     def slot_exit(self):
+        self.remove_reformatted_file()
         self.close()
     
     def slot_about(self):
@@ -327,12 +481,8 @@ class TrackEditor(qt.MainWindow):
                 self, 'About ' + APP_NAME, __doc__)
         
     def open_track(self, file):
-        # progress = qt.QtGui.QProgressDialog(self)
-        # progress.setRange(0, 1000)
-        # progress.setValue(0)
-        # progress.setMinimumDuration(0)
-        # progress.setWindowModality(Qt.WindowModal)
-        # progress.forceShow()
+        '''Start loading *file* in the background. Any load in progress is
+        cancelled.'''
         file = str(file)
         if not os.path.isfile(file):
             print('Cannot open %s : is not a file.' % file)
@@ -340,23 +490,82 @@ class TrackEditor(qt.MainWindow):
         fndir = os.path.split(file)[0]
         if os.path.isdir(fndir):
             self.cwds.append(fndir)
-        with open(file, mode='r') as f:
-            s = f.read()
         self.file = file
-        self.open_gpx_txt(s)
-        # progress.reset()
+        self.loader.load_file(file)
         
+    def sibling_tracks(self, file):
+        '''Return the sorted list of track files in the folder of *file*.'''
+        fndir = os.path.dirname(os.path.abspath(file))
+        return sorted(os.path.join(fndir, fn) for fn in os.listdir(fndir)
+                      if fn.lower().rsplit('.', 1)[-1] in EXTENSIONS)
+        
+    def open_sibling_track(self, step):
+        '''Open the track file *step* places after the open one in its
+        folder.'''
+        if self.file is None:
+            return
+        siblings = self.sibling_tracks(self.file)
+        if not os.path.abspath(self.file) in siblings:
+            return
+        i = siblings.index(os.path.abspath(self.file)) + step
+        if 0 <= i < len(siblings):
+            self.open_track(siblings[i])
+            index = self.gpx_files_model.index(siblings[i])
+            if index.isValid():
+                self.widgets.gpx_files_tree.setCurrentIndex(index)
+        
+    def prefetch_siblings(self, file):
+        '''Prefetch the tracks either side of *file* in its folder (how many
+        is set by ``siblings`` in the ``[prefetch]`` section of
+        ``pyxie.cfg``).'''
+        siblings = self.sibling_tracks(file)
+        if not os.path.abspath(file) in siblings:
+            return
+        i = siblings.index(os.path.abspath(file))
+        n = config.getint('prefetch', 'siblings')
+        nearest = sorted(siblings[max(i - n, 0):i] + siblings[i + 1:i + n + 1],
+                         key=lambda sibling: abs(siblings.index(sibling) - i))
+        self.loader.prefetch(nearest)
         
     def open_gpx_txt(self, text):
-        self.track_txt = text
-        self.coords = io.read_gpx(StringIO.StringIO(text))
+        self.loader.load_text(text, self.file, previous=self.data)
+        
+    def slot_load_progress(self, percent, message):
+        self.widgets.file_load_progress.setValue(percent)
+        self.widgets.file_load_progress.setFormat('%s %%p%%' % message)
+        self.widgets.file_load_progress.show()
+        
+    def slot_load_failed(self, message):
+        self.widgets.file_load_progress.hide()
+        self.statusbar.showMessage('Could not load track: %s' % message)
+
+    def show_track(self, data):
+        '''Show a :class:`loader.TrackData` bundle.'''
+        self.widgets.file_load_progress.hide()
+        # Text from the editor is already shown there.
+        from_editor = data.text is not None and data.text is self.track_txt
+        if from_editor and self.data is not None:
+            # Keep the view and the callbacks, and just show the new points.
+            self.data = data
+            self.coords = data.coords
+            self.map.update_data(data)
+            self.graph.update_data(data)
+            if 'link_location' in self.callbacks:
+                # The point under the mouse may have been deleted.
+                self.callbacks['link_location'].pending_index = None
+            self.write_stats()
+            return
+        self.data = data
+        self.coords = data.coords
         if self.graph:
             self.graph.xlim = (None, None)
             self.graph.ylim = (None, None)
-        self.slot_show_gpx_in_tab()
+        if not from_editor:
+            self.track_txt = data.text
+            self.slot_show_gpx_in_tab()
         self.refresh_figures()
-        # self.widgets.file_load_progress.hide()
-        # self.widgets.file_load_progress.setMaximum(10000)
+        if data.file is not None and not from_editor:
+            self.prefetch_siblings(data.file)
 
     def refresh_figures(self):
         for callback in self.callbacks.values():
@@ -367,11 +576,11 @@ class TrackEditor(qt.MainWindow):
             del self.dialogs['callbacks']
         
         self.map.clear()
-        self.map.coords = self.coords
+        self.map.data = self.data
         self.map.plot()
         
         self.graph.clear(axis='on')
-        self.graph.coords = self.coords
+        self.graph.data = self.data
         self.graph.plot()
         
         callbacks = [('link_location', LinkLocationCallback, [self], True),
@@ -386,9 +595,27 @@ class TrackEditor(qt.MainWindow):
         self.setWindowTitle('%s : %s' % (APP_NAME, self.file))
    
     def write_stats(self):
-        self.stats = stats.Path(self.map.xs, self.map.ys, self.coords[:, 0])
+        self.stats = self.data.stats
+        self.selection_stats = self.data.selection_stats
         self.widgets.stats_box.clear()
         self.widgets.stats_box.insertPlainText(str(self.stats))
+        
+    def show_selection_stats(self, indices):
+        '''Show statistics for the whole track and for the points with the
+        sorted *indices*. Where the indices skip points, the steps to and
+        from those points are left out.'''
+        if self.selection_stats is None:
+            return
+        text = str(self.stats)
+        if 0 < len(indices) < len(self.coords):
+            starts, stops = stats.index_runs(indices)
+            if len(starts) == 1:
+                portion = 'points %d to %d' % (starts[0], stops[0] - 1)
+            else:
+                portion = '%d points in %d runs' % (len(indices), len(starts))
+            text += '\n\nSelected portion (%s)\n%s' % (
+                    portion, self.selection_stats.query_runs(starts, stops))
+        self.widgets.stats_box.setPlainText(text)
     
     
 class CallbacksDialog(qt.QtGui.QDialog):
@@ -428,12 +655,27 @@ class CallbackHandler(object):
     
     
 class LinkLocationCallback(CallbackHandler):
+    '''Show the point nearest the mouse on both the map and the graph.
+    
+    The markers are animated artists drawn over a cached copy of each
+    canvas (taken after every full draw), so moving them only blits the
+    axes. Mouse events just record the point to show; the markers are
+    redrawn at most once per :data:`HOVER_INTERVAL_MS`.
+    
+    '''
     def __init__(self, parent):
         CallbackHandler.__init__(self)
         self.parent = parent
         self.connected = False
         self.cid_map = None
         self.cid_graph = None
+        self.draw_cids = []
+        self.backgrounds = {}
+        self.pending_index = None
+        self.timer = qt.QtCore.QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(HOVER_INTERVAL_MS)
+        self.timer.timeout.connect(self.render_markers)
         self.name = 'Link mouse between map and graph'
         self.status = True
         logger.debug('__init__ LinkLocationCallback')
@@ -441,62 +683,97 @@ class LinkLocationCallback(CallbackHandler):
     def connect(self):
         self.cid_map = self.parent.map.canvas.mpl_connect('motion_notify_event', self.on_map_motion)
         self.cid_graph = self.parent.graph.canvas.mpl_connect('motion_notify_event', self.on_graph_motion)
+        self.draw_cids = [
+            (obj.canvas, obj.canvas.mpl_connect(
+                    'draw_event', lambda event, obj=obj: self.on_draw(obj)))
+            for obj in (self.parent.map, self.parent.graph)]
         self.connected = True
         logger.debug('(%s) connected (connected=%s)' % (self.name, self.connected))
         
     def disconnect(self):
         self.parent.map.canvas.mpl_disconnect(self.cid_map)
         self.parent.graph.canvas.mpl_disconnect(self.cid_graph)
+        for canvas, cid in self.draw_cids:
+            canvas.mpl_disconnect(cid)
+        del self.draw_cids[:]
+        self.timer.stop()
+        self.remove_location_markers()
         self.connected = False
         logger.debug('(%s) disconnected (connected=%s)' % (self.name, self.connected))
             
     def remove_location_markers(self):
         for obj in (self.parent.map, self.parent.graph):
-            if 'link_location_marker' in obj.artists:
-                obj.artists['link_location_marker'].remove()
-                del obj.artists['link_location_marker']
+            for label in ('link_location_marker', 'link_location_marker_elev'):
+                if label in obj.artists:
+                    obj.artists[label].remove()
+                    del obj.artists[label]
+        self.backgrounds.clear()
             
     def on_map_motion(self, event):
         map = self.parent.map
         if event.inaxes is self.parent.map.ax:
-            index = ((map.xs - event.xdata) ** 2 + (map.ys - event.ydata) ** 2).argmin()
-            self.update_markers(index)
+            indices, distances = map.index.nearest(event.xdata, event.ydata)
+            if len(indices):
+                self.update_markers(indices[0])
             # logger.debug('map motion at %s %s!' % (event.xdata, event.ydata))
     
     def on_graph_motion(self, event):
         graph = self.parent.graph
         if event.inaxes is graph.ax or event.inaxes is graph.ax2:
-            index = (np.abs(np.array(graph.mpl_dts) - event.xdata)).argmin()
-            self.update_markers(index)
+            index = graph.nearest_index(event.xdata)
+            if index is not None:
+                self.update_markers(index)
             # logger.debug('graph motion i=%s at time %s' % (index, num2date(event.xdata)))
             
+    def on_draw(self, obj):
+        '''Cache the background of a canvas after a full draw, and draw the
+        markers (which full draws leave out) over it.'''
+        canvas = obj.canvas
+        self.backgrounds[canvas] = canvas.copy_from_bbox(canvas.fig.bbox)
+        for label in ('link_location_marker', 'link_location_marker_elev'):
+            if label in obj.artists:
+                artist = obj.artists[label]
+                artist.axes.draw_artist(artist)
+            
     def update_markers(self, i):
+        self.pending_index = i
+        if not self.timer.isActive():
+            self.timer.start()
+            
+    def render_markers(self):
+        i = self.pending_index
+        if i is None:
+            return
         map = self.parent.map
         graph = self.parent.graph
+        markers = [
+            (graph, 'link_location_marker', graph.ax,
+             graph.mpl_dts[i], graph.speeds[i], 'gray'),
+            (graph, 'link_location_marker_elev', graph.ax2,
+             graph.mpl_dts[i], graph.elevs[i], 'red'),
+            (map, 'link_location_marker', map.ax, map.xs[i], map.ys[i], 'k')]
+        created = False
+        for obj, label, ax, x, y, colour in markers:
+            if not label in obj.artists:
+                obj.artists[label] = ax.plot(
+                        [x], [y], marker='o', mfc=colour, mec='k',
+                        animated=True)[0]
+                created = True
+            else:
+                obj.artists[label].set_data([x], [y])
         
-        if not 'link_location_marker' in graph.artists:
-            graph.artists['link_location_marker'] = graph.ax.plot(
-                    [graph.mpl_dts[i]], [graph.speeds[i]], marker='o', mfc='gray', mec='k')[0]
-        else:
-            graph.artists['link_location_marker'].set_xdata([graph.mpl_dts[i]])
-            graph.artists['link_location_marker'].set_ydata([graph.speeds[i]])
-            
-        if not 'link_location_marker_elev' in graph.artists:
-            graph.artists['link_location_marker_elev'] = graph.ax2.plot(
-                    [graph.mpl_dts[i]], [graph.elevs[i]], marker='o', mfc='red', mec='k')[0]
-        else:
-            graph.artists['link_location_marker_elev'].set_xdata([graph.mpl_dts[i]])
-            graph.artists['link_location_marker_elev'].set_ydata([graph.elevs[i]])
-        
-        if not 'link_location_marker' in map.artists:
-            map.artists['link_location_marker'] = map.ax.plot(
-                    [map.xs[i]], [map.ys[i]], marker='o', mfc='k', mec='k')[0]
-        else:
-            map.artists['link_location_marker'].set_xdata([map.xs[i]])
-            map.artists['link_location_marker'].set_ydata([map.ys[i]])
-            
-        graph.draw()
-        map.draw()
+        for obj in (graph, map):
+            canvas = obj.canvas
+            if created or not canvas in self.backgrounds:
+                # The next full draw caches the background and draws the
+                # markers.
+                canvas.draw_idle()
+                continue
+            canvas.restore_region(self.backgrounds[canvas])
+            for obj_, label, ax, x, y, colour in markers:
+                if obj_ is obj:
+                    ax.draw_artist(obj.artists[label])
+            canvas.blit(canvas.fig.bbox)
         
         def formatter(index):
             x = map.xs[index]
@@ -508,6 +785,7 @@ class LinkLocationCallback(CallbackHandler):
                     dt.strftime(dt_fmt), x, y, speed)
                     
         self.parent.statusbar.showMessage(formatter(i))
+        self.parent.hovered_index = i
         
         
 
@@ -590,6 +868,10 @@ class ChangeLimitsCallback(CallbackHandler):
         self.map_changed = True
         self.parent.map.xlim = self.parent.map.ax.get_xlim()
         self.parent.map.ylim = self.parent.map.ax.get_ylim()        
+        (x0, x1), (y0, y1) = self.parent.map.xlim, self.parent.map.ylim
+        indices = self.parent.map.index.bbox(
+                min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+        self.parent.show_selection_stats(np.sort(indices))
         # The below causes some kind of weird recursive problem. The only need
         # for me to track this is AFAICT with the NavigationToolbar prev/next view
         # buttons.
@@ -601,6 +883,14 @@ class ChangeLimitsCallback(CallbackHandler):
         self.graph_changed = True
         self.parent.graph.xlim = self.parent.graph.ax.get_xlim()
         self.parent.graph.ylim = self.parent.graph.ax.get_ylim()
+        # The visible points, found from the times in sorted order, where
+        # the points without a time are last.
+        dts = self.parent.graph.sorted_mpl_dts
+        x0, x1 = sorted(self.parent.graph.xlim)
+        i = np.searchsorted(dts, x0, side='left')
+        j = np.searchsorted(dts, x1, side='right')
+        indices = np.sort(self.parent.graph.time_order[i:j])
+        self.parent.show_selection_stats(indices)
         # The below causes some kind of weird recursive problem. The only need
         # for me to track this is AFAICT with the NavigationToolbar prev/next view
         # buttons.
@@ -657,7 +947,7 @@ class ChangeLimitsCallback(CallbackHandler):
 class TrackMap(qt.QtGui.QWidget):
     def __init__(self, width, height, dpi=72):
         qt.QtGui.QWidget.__init__(self)
-        self.coords = np.empty(shape=(0, 2))
+        self.data = None
         self.artists = {}
         self.canvas = qt.MplCanvas(self, width=width / float(dpi),
                                    height=height / float(dpi), dpi=dpi)
@@ -666,16 +956,48 @@ class TrackMap(qt.QtGui.QWidget):
         box.addWidget(self.mpl_toolbar)
         box.addWidget(self.canvas)
         self.setLayout(box)
+        self.canvas.mpl_connect('resize_event', self.on_resize)
         
     def plot(self):
         if 'track' in self.artists:
             self.artists['track'].remove()
             del self.artists['track']
-        xs, ys = core.convert_coordinate_system(
-                self.coords[:, 1], self.coords[:, 2], epsg2='28353')
-        self.artists['track'] = self.ax.plot(xs, ys)[0]
-        self.xs = xs
-        self.ys = ys
+        xs = self.xs = self.data.xs
+        ys = self.ys = self.data.ys
+        self.index = self.data.index
+        self.decimator = self.data.path_decimator
+        x0, y0, x1, y1 = self.index.bounds
+        tolerance = max(x1 - x0, y1 - y0) / self.ax.bbox.width
+        indices = self.decimator.select(tolerance)
+        self.artists['track'] = self.ax.plot(xs[indices], ys[indices])[0]
+        self.ax.callbacks.connect('xlim_changed', self.update_detail)
+        self.ax.callbacks.connect('ylim_changed', self.update_detail)
+        self.draw()
+        
+    def update_detail(self, ax=None):
+        '''Re-select the vertices of the track drawn for the current view,
+        with about one per pixel.'''
+        if 'track' not in self.artists:
+            return
+        x0, x1 = sorted(self.ax.get_xlim())
+        y0, y1 = sorted(self.ax.get_ylim())
+        tolerance = max((x1 - x0) / self.ax.bbox.width,
+                        (y1 - y0) / self.ax.bbox.height)
+        indices = self.decimator.select(tolerance, (x0, y0, x1, y1))
+        self.artists['track'].set_data(self.xs[indices], self.ys[indices])
+        
+    def update_data(self, data):
+        '''Show an edited version of the track, keeping the view.'''
+        self.data = data
+        self.xs = data.xs
+        self.ys = data.ys
+        self.index = data.index
+        self.decimator = data.path_decimator
+        self.update_detail()
+        self.draw()
+        
+    def on_resize(self, event):
+        self.update_detail()
         self.draw()
     
     def clear(self):
@@ -697,7 +1019,7 @@ class TrackGraph(qt.QtGui.QWidget):
     def __init__(self, width, height, dpi=72, xlim=(None, None), ylim=(None, None)):
         logger.debug('TrackGraph __init__ xlim=%s ylim=%s' % (xlim, ylim))
         qt.QtGui.QWidget.__init__(self)
-        self.coords = np.empty(shape=(0, 2))
+        self.data = None
         self.tz = timezone(config.get('datetime', 'default_timezone'))
         self.xlim = xlim
         self.ylim = ylim
@@ -709,6 +1031,7 @@ class TrackGraph(qt.QtGui.QWidget):
         box.addWidget(self.mpl_toolbar)
         box.addWidget(self.canvas)
         self.setLayout(box)
+        self.canvas.mpl_connect('resize_event', self.on_resize)
         
         tz_combo = qt.ExtendedCombo(self.canvas.toolbar)
         tz_model = qt.QtGui.QStandardItemModel()
@@ -723,30 +1046,39 @@ class TrackGraph(qt.QtGui.QWidget):
         self.canvas.toolbar.addWidget(tz_combo)
         
     def set_tz(self, index):
+        # Matplotlib date numbers are UTC instants, so only the tick labels
+        # depend on the timezone and nothing needs to be replotted.
         self.tz = timezone(common_timezones[index])
         logger.debug('set_tz index=%d tz=%s' % (index, self.tz))
-        self.clear(axis='on')
-        self.plot()
+        if 'line' in self.artists:
+            self.set_date_axis()
+            self.draw()
+            
+    def set_date_axis(self):
+        for ax in (self.ax, self.ax2):
+            locator = dates.AutoDateLocator(tz=self.tz)
+            ax.xaxis.set_major_locator(locator)
+            ax.xaxis.set_major_formatter(
+                    dates.AutoDateFormatter(locator, tz=self.tz))
+        self.ax.fmt_xdata = dates.DateFormatter('%Y-%m-%d %H:%M:%S', tz=self.tz)
         
     def plot(self):
         if 'line' in self.artists:
             self.artists['line'].remove()
             del self.artists['line']
-        xs, ys = core.convert_coordinate_system(
-                self.coords[:, 1], self.coords[:, 2], epsg2='28353')
-        speeds = core.speed(self.coords[:, 0], xs, ys)
-        epoch_times = self.coords[:, 0]
-        utc = timezone('UTC')
-        dts = [datetime.datetime.fromtimestamp(et) for et in epoch_times]
-        utc_dts = [utc.localize(dt) for dt in dts]
-        dts_localised = [dt.astimezone(self.tz) for dt in utc_dts]
-        logger.debug('localised dt[0] = %s (self.tz=%s)' % (dts_localised[0], self.tz))
-        
-        mpl_dts = np.array(dates.date2num(dts_localised))
+        data = self.data
+        self.geodesic = data.geodesic
+        mpl_dts = self.mpl_dts = data.mpl_dts
+        self.time_order = data.time_order
+        self.sorted_mpl_dts = data.sorted_mpl_dts
+        speeds = self.speeds = data.speeds
+        self.elevs = data.elevs
+        self.decimators = data.series_decimators
+        indices = self.decimators['line'].select(
+                -np.inf, np.inf, self.ax.bbox.width)
         self.artists['line'] = self.ax.plot_date(
-                mpl_dts, speeds, ls='-', color='k', marker='None', tz=self.tz)[0]
-        dt_fmt = '%Y-%m-%d %H:%M:%S'
-        self.ax.fmt_xdata = dates.DateFormatter(dt_fmt, tz=self.tz)
+                mpl_dts[indices], speeds[indices], ls='-', color='k',
+                marker='None', tz=self.tz)[0]
         
         min_mpl_dts = np.nanmin(mpl_dts)
         max_mpl_dts = np.nanmax(mpl_dts)
@@ -767,19 +1099,63 @@ class TrackGraph(qt.QtGui.QWidget):
         if y1 is None:
             y1 = max_speed + range_speed * 0.05
             
+        indices = self.decimators['line_elev'].select(
+                -np.inf, np.inf, self.ax.bbox.width)
+        self.artists['line_elev'] = self.ax2.plot_date(
+                mpl_dts[indices], self.elevs[indices], ls='-', color='r', 
+                marker='None', tz=self.tz)[0]
+        self.ax.callbacks.connect('xlim_changed', self.update_detail)
+        
         self.ax.set_xlim(x0, x1)
         self.ax.set_ylim(y0, y1)
         
         self.xlim = (x0, x1)
         self.ylim = (y0, y1)
         
-        self.mpl_dts = mpl_dts
-        self.speeds = speeds
-        self.elevs = self.coords[:, 3]
-        self.artists['line_elev'] = self.ax2.plot_date(
-                mpl_dts, self.elevs, ls='-', color='r', 
-                marker='None', tz=self.tz)[0]
+        self.set_date_axis()
         self.draw()
+        
+    def nearest_index(self, mpl_dt):
+        '''Return the index of the point nearest in time to *mpl_dt* (a
+        matplotlib date number), or None.'''
+        dts = self.sorted_mpl_dts
+        k = np.searchsorted(dts, mpl_dt)
+        candidates = [c for c in (k - 1, k) if 0 <= c < len(dts)
+                      and not np.isnan(dts[c])]
+        if not candidates:
+            return None
+        nearest = min(candidates, key=lambda c: abs(dts[c] - mpl_dt))
+        return self.time_order[nearest]
+                
+    def update_detail(self, ax=None):
+        '''Re-select the points drawn for the current time range, keeping
+        the minimum and maximum of each pixel-wide bucket of points.'''
+        x0, x1 = sorted(self.ax.get_xlim())
+        ys = {'line': self.speeds, 'line_elev': self.elevs}
+        for label, decimator in self.decimators.items():
+            if label in self.artists:
+                indices = decimator.select(x0, x1, self.ax.bbox.width)
+                self.artists[label].set_data(self.mpl_dts[indices],
+                                             ys[label][indices])
+                
+    def update_data(self, data):
+        '''Show an edited version of the track, keeping the view.'''
+        self.data = data
+        self.geodesic = data.geodesic
+        self.mpl_dts = data.mpl_dts
+        self.time_order = data.time_order
+        self.sorted_mpl_dts = data.sorted_mpl_dts
+        self.speeds = data.speeds
+        self.elevs = data.elevs
+        self.decimators = data.series_decimators
+        if 'line' in self.artists:
+            self.update_detail()
+            self.draw()
+        
+    def on_resize(self, event):
+        if 'line' in self.artists:
+            self.update_detail()
+            self.draw()
     
     def clear(self, axis='off'):
         for artist in self.artists.values():
@@ -1,39 +1,1149 @@
+import argparse
 import glob
+import hashlib
+import itertools
+import logging
+import multiprocessing
 import os
+import sys
+import zipfile
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+from xml.sax.saxutils import escape
 import xmlmisc
 
 import numpy as np
+from numpy.lib.stride_tricks import as_strided
 
+from pyxie import archive
+from pyxie import cache
+from pyxie.config import config
 from pyxie import core
 
 
-def read_gpx(fileobj):
+logger = logging.getLogger(__name__)
+
+
+# Bump this whenever a change to the readers alters their output, so that
+# entries in the parse cache are not reused.
+PARSER_VERSION = 2
+
+# Record layout of the chunks yielded by iter_gpx: epoch seconds (UTC),
+# degrees, metres, and a running count of the trkseg each point belongs to.
+TRACKPOINT_DTYPE = np.dtype([('time', np.float64),
+                             ('lon', np.float64),
+                             ('lat', np.float64),
+                             ('elev', np.float64),
+                             ('segment', np.int32)])
+
+
+def iter_gpx(source, chunk_size=65536):
+    '''Iterate over the trackpoints in a GPX file in fixed-size chunks.
+    
+    Only the end events of ``trkpt`` elements are handled. Their attributes
+    and children are written into reusable float64 column buffers,
+    timestamps are converted a chunk at a time with
+    :func:`xmlmisc.iso8601_to_epoch`, and elements are cleared as soon as
+    they have been read, so memory use depends on *chunk_size* and not on
+    the size of the file.
+    
+    Args:
+        - *source*: filename or file-like object containing GPX XML data.
+        - *chunk_size*: maximum number of trackpoints per chunk.
+        
+    Yields: numpy record arrays of :data:`TRACKPOINT_DTYPE`. Every chunk
+    except the last has *chunk_size* records. Missing values are NaN.
+    
+    '''
+    lons = np.empty(chunk_size)
+    lats = np.empty(chunk_size)
+    elevs = np.empty(chunk_size)
+    segments = np.empty(chunk_size, dtype=np.int32)
+    time_texts = []
+    segment = 0
+    n = 0
+    for event, elem in ElementTree.iterparse(source):
+        tag = elem.tag
+        if tag.endswith('trkpt'):
+            lons[n] = float(elem.get('lon'))
+            lats[n] = float(elem.get('lat'))
+            elevs[n] = np.nan
+            segments[n] = segment
+            time_text = ''
+            for child in elem:
+                child_tag = child.tag
+                if child_tag.endswith('ele'):
+                    elevs[n] = float(child.text)
+                elif child_tag.endswith('time'):
+                    time_text = child.text
+            time_texts.append(time_text)
+            elem.clear()
+            n += 1
+            if n == chunk_size:
+                yield _trackpoint_chunk(time_texts, lons, lats, elevs, segments)
+                time_texts = []
+                n = 0
+        elif tag.endswith('trkseg'):
+            segment += 1
+            elem.clear()
+    if n:
+        yield _trackpoint_chunk(time_texts, lons, lats, elevs, segments)
+
+
+def _trackpoint_chunk(time_texts, lons, lats, elevs, segments):
+    n = len(time_texts)
+    chunk = np.empty(n, dtype=TRACKPOINT_DTYPE)
+    chunk['time'] = xmlmisc.iso8601_to_epoch(time_texts)
+    chunk['lon'] = lons[:n]
+    chunk['lat'] = lats[:n]
+    chunk['elev'] = elevs[:n]
+    chunk['segment'] = segments[:n]
+    return chunk
+
+
+def read_gpx(fileobj, chunk_size=65536):
     '''Get array of times, lons, lats, and elevations.
     
     Args:
-        - *fileobj*: file-like object containing GPX XML data.
+        - *fileobj*: filename or file-like object containing GPX XML data.
+        - *chunk_size*: passed to :func:`iter_gpx`.
         
+    Returns: array of shape (N, 4) with columns time (seconds since the 
+    epoch, UTC), longitude, latitude and elevation. Missing values are NaN.
     
     '''
-    times = []
-    lons = []
-    lats = []
-    elevs = []
-    line = None
-    for trkpt, elem in xmlmisc.iterparse(fileobj, cls=xmlmisc.GPXTrackpoint):
-        if trkpt:
-            times.append(elem.time)
-            lons.append(elem.lon)
-            lats.append(elem.lat)
-            elevs.append(elem.elev)
-    return np.vstack((times, lons, lats, elevs)).T
+    return chunks_to_coords(list(iter_gpx(fileobj, chunk_size=chunk_size)))
+
 
+def read_gpx_cached(fn, parse_cache=None):
+    '''Get array of times, lons, lats, and elevations via the parse cache.
     
+    Args:
+        - *fn*: filename of GPX file.
+        - *parse_cache*: :class:`pyxie.cache.ParseCache` object, by default
+          the one returned by :func:`pyxie.cache.default_cache`.
+        
+    Returns: read-only memory-mapped array, as for :func:`read_gpx`.
+    
+    '''
+    if parse_cache is None:
+        parse_cache = cache.default_cache()
+    return parse_cache.load(fn, read_gpx, PARSER_VERSION)
+
+
+def chunks_to_coords(chunks):
+    '''Concatenate :data:`TRACKPOINT_DTYPE` chunks into an (N, 4) array.'''
+    columns = np.empty((4, sum(len(chunk) for chunk in chunks)))
+    i = 0
+    for chunk in chunks:
+        j = i + len(chunk)
+        for k, name in enumerate(('time', 'lon', 'lat', 'elev')):
+            columns[k, i:j] = chunk[name]
+        i = j
+    return columns.T
+
+
+def open_kml(source):
+    '''Open the KML document in a KML or KMZ file.
+
+    Args:
+        - *source*: filename or file-like object of a KML document or of a
+          KMZ (zipped KML) file.
+
+    Returns: file-like object of the KML. For a KMZ file this is the zip
+    member (``doc.kml``, or else the first ``.kml`` file), which is
+    decompressed as it is read rather than extracted.
+
+    '''
+    if isinstance(source, basestring):
+        if not zipfile.is_zipfile(source):
+            return open(source, mode='rb')
+    elif zipfile.is_zipfile(source):
+        source.seek(0)
+    else:
+        source.seek(0)
+        return source
+    kmz = zipfile.ZipFile(source)
+    names = [name for name in kmz.namelist() if name.lower().endswith('.kml')]
+    if not names:
+        raise ValueError('No KML document in the KMZ file')
+    f = kmz.open('doc.kml' if 'doc.kml' in names else names[0])
+    if isinstance(source, basestring):
+        # The member has its own handle on the file.
+        kmz.close()
+    return f
+
+
+def iter_kml(source, chunk_size=65536):
+    '''Iterate over the points of the tracks in a KML or KMZ file in
+    chunks.
+
+    The points are those of ``LineString`` elements, which have no times,
+    and of ``gx:Track`` elements, whose ``when`` timestamps go with their
+    ``gx:coord`` elements in order. Each is a segment. The text of each
+    ``coordinates`` element is converted in bulk by
+    :func:`xmlmisc.kml_coordinates`, and the ``when`` and ``gx:coord``
+    texts of each track by :func:`xmlmisc.iso8601_to_epoch` and
+    :func:`xmlmisc.kml_track_coords`. Elements are cleared once read.
+
+    Args:
+        - *source*: as for :func:`open_kml`.
+        - *chunk_size*: maximum number of points per chunk.
+
+    Yields: numpy record arrays of :data:`TRACKPOINT_DTYPE`, as for
+    :func:`iter_gpx`. Missing values are NaN.
+
+    '''
+    f = open_kml(source)
+    segment = 0
+    in_track = False
+    when_texts = []
+    coord_texts = []
+    try:
+        for event, elem in ElementTree.iterparse(f, events=('start', 'end')):
+            tag = elem.tag.rsplit('}', 1)[-1]
+            if event == 'start':
+                if tag == 'Track':
+                    in_track = True
+                continue
+            if in_track and tag == 'when':
+                when_texts.append((elem.text or '').strip())
+                elem.clear()
+            elif in_track and tag == 'coord':
+                coord_texts.append(elem.text)
+                elem.clear()
+            elif tag == 'Track':
+                values = xmlmisc.kml_track_coords(coord_texts)
+                if when_texts and len(when_texts) != len(values):
+                    raise ValueError('gx:Track has %d when and %d gx:coord '
+                                     'elements' % (len(when_texts), len(values)))
+                times = xmlmisc.iso8601_to_epoch(when_texts)
+                if not len(times):
+                    times = np.full(len(values), np.nan)
+                for chunk in _kml_chunks(times, values, segment, chunk_size):
+                    yield chunk
+                segment += 1
+                in_track = False
+                when_texts = []
+                coord_texts = []
+                elem.clear()
+            elif tag == 'LineString':
+                for child in elem:
+                    if child.tag.endswith('coordinates'):
+                        values = xmlmisc.kml_coordinates(child.text)
+                        times = np.full(len(values), np.nan)
+                        for chunk in _kml_chunks(times, values, segment,
+                                                 chunk_size):
+                            yield chunk
+                        segment += 1
+                elem.clear()
+            elif tag == 'Placemark':
+                elem.clear()
+    finally:
+        if f is not source:
+            f.close()
+
+
+def _kml_chunks(times, values, segment, chunk_size):
+    for i in range(0, len(values), chunk_size):
+        n = len(values[i:i + chunk_size])
+        chunk = np.empty(n, dtype=TRACKPOINT_DTYPE)
+        chunk['time'] = times[i:i + n]
+        chunk['lon'] = values[i:i + n, 0]
+        chunk['lat'] = values[i:i + n, 1]
+        chunk['elev'] = values[i:i + n, 2]
+        chunk['segment'] = segment
+        yield chunk
+
+
+def read_kml(fileobj, chunk_size=65536):
+    '''Get array of times, lons, lats, and elevations from a KML or KMZ
+    file, as for :func:`read_gpx` (see :func:`iter_kml`).'''
+    return chunks_to_coords(list(iter_kml(fileobj, chunk_size=chunk_size)))
+
+
+# Header names recognised for the columns of a CSV file, see iter_csv.
+CSV_COLUMN_NAMES = {
+        'time': ('time', 'timestamp', 'datetime', 'date_time', 'utc', 'epoch'),
+        'lon': ('lon', 'lng', 'long', 'longitude', 'x'),
+        'lat': ('lat', 'latitude', 'y'),
+        'elev': ('elev', 'ele', 'elevation', 'alt', 'altitude', 'z'),
+        'owner': ('owner', 'user', 'device')}
+
+# Longest CSV or NMEA field read, in bytes. Longer fields are taken to be
+# missing.
+MAX_FIELD_WIDTH = 64
+
+# The bytes of decimal numbers, and spaces, as read by np.fromstring.
+_NUMBER_BYTES = np.zeros(256, dtype=bool)
+_NUMBER_BYTES[np.frombuffer(b'0123456789+-.eE ', dtype=np.uint8)] = True
+
+
+def iter_csv(source, columns=None, delimiter=None, epsg=None,
+             chunk_size=1 << 22):
+    '''Iterate over the points in a CSV file in chunks.
+
+    Args:
+        - *source*: filename or file-like object.
+        - *columns*: dict mapping ``'time'``, ``'lon'``, ``'lat'`` and
+          optionally ``'elev'`` and ``'owner'`` to column names in the
+          header line, or to column numbers from 0. By default the
+          ``columns`` setting in the ``[csv]`` section of ``pyxie.cfg`` is
+          used, and if that is empty the columns are found from the header
+          by the names in :data:`CSV_COLUMN_NAMES`. The first line is taken
+          to be a header unless every column is given by number.
+        - *delimiter*: field delimiter; by default the ``[csv]`` setting.
+        - *epsg*: EPSG code of the coordinate system of the lon and lat
+          columns (e.g. UTM eastings and northings), which are converted to
+          longitudes and latitudes. By default the ``[csv]`` setting.
+        - *chunk_size*: number of bytes to read at a time.
+
+    Times may be ISO 8601 timestamps or seconds since the epoch; times
+    which are neither are NaN. Fields cannot be quoted, and lines without
+    all the columns, or without a longitude and latitude, are skipped.
+
+    Each chunk of lines is parsed as a byte array: the line breaks and
+    delimiters are found with numpy, the fields are gathered into a byte
+    matrix, and numbers are converted with one ``np.fromstring`` call per
+    column, so there is no Python code per line.
+
+    Yields: numpy record arrays of :data:`TRACKPOINT_DTYPE` with, if there
+    is an owner column, an extra ``owner`` field of byte strings. Missing
+    values are NaN.
+
+    '''
+    if delimiter is None:
+        delimiter = config.get('csv', 'delimiter').decode('string_escape')
+    if columns is None:
+        columns = _config_csv_columns()
+    if epsg is None:
+        epsg = config.get('csv', 'epsg')
+    f = open(source, mode='rb') if isinstance(source, basestring) else source
+    try:
+        blocks = _iter_blocks(f, chunk_size)
+        if columns and all(isinstance(c, int) for c in columns.values()):
+            indices = columns
+        else:
+            block = next(blocks, '')
+            i = block.find('\n') + 1
+            indices = _csv_indices(block[:i], columns, delimiter)
+            blocks = itertools.chain([block[i:]], blocks)
+        for block in blocks:
+            chunk = _csv_chunk(block, indices, delimiter, epsg)
+            if len(chunk):
+                yield chunk
+    finally:
+        if f is not source:
+            f.close()
+
+
+def _config_csv_columns():
+    '''Return the columns set in the [csv] section of pyxie.cfg, as for
+    :func:`iter_csv`, e.g. from ``columns = time=utc, lon=x, lat=y``.'''
+    columns = {}
+    for item in config.get('csv', 'columns').split(','):
+        if item.strip():
+            key, column = [s.strip() for s in item.split('=', 1)]
+            columns[key] = int(column) if column.isdigit() else column
+    return columns
+
+
+def _csv_indices(header, columns, delimiter):
+    '''Return a dict of column numbers keyed by 'time', 'lon' etc.'''
+    names = [name.strip().strip('"').lower()
+             for name in header.rstrip('\r\n').split(delimiter)]
+    indices = {}
+    if columns:
+        for key, column in columns.items():
+            if isinstance(column, int):
+                indices[key] = column
+            elif column.lower() in names:
+                indices[key] = names.index(column.lower())
+            else:
+                raise ValueError('No column %r in the CSV header' % column)
+    else:
+        for key, aliases in CSV_COLUMN_NAMES.items():
+            for alias in aliases:
+                if alias in names:
+                    indices[key] = names.index(alias)
+                    break
+    if not ('lon' in indices and 'lat' in indices):
+        raise ValueError('Cannot find the lon and lat columns of the CSV '
+                         'header %r' % header.strip())
+    return indices
+
+
+def _csv_chunk(block, indices, delimiter, epsg):
+    chars = np.frombuffer(block, dtype=np.uint8)
+    starts, ends = _line_spans(chars)
+    keys = sorted(indices)
+    lines, fstarts, fends = _split_fields(chars, starts, ends, ord(delimiter),
+                                          [indices[key] for key in keys])
+    if len(lines) < len(starts):
+        logger.debug('Skipped %d CSV lines without all the columns' % (
+                len(starts) - len(lines)))
+    fields = dict((key, (fstarts[:, k], fends[:, k]))
+                  for k, key in enumerate(keys))
+    n = len(lines)
+    if not n:
+        return np.empty(0, dtype=TRACKPOINT_DTYPE)
+    dtype = TRACKPOINT_DTYPE
+    if 'owner' in fields:
+        owners = _field_strings(chars, *fields['owner'])
+        dtype = np.dtype(TRACKPOINT_DTYPE.descr + [('owner', owners.dtype)])
+    chunk = np.empty(n, dtype=dtype)
+    chunk['time'] = np.nan
+    if 'time' in fields:
+        times = _field_strings(chars, *fields['time'])
+        matrix = times.view(np.uint8).reshape(n, -1)
+        if (matrix[:, 1:] == ord('-')).any() or (matrix == ord(':')).any():
+            chunk['time'] = _iso8601_times(times)
+        else:
+            chunk['time'] = _field_floats(chars, *fields['time'])
+    lons = _field_floats(chars, *fields['lon'])
+    lats = _field_floats(chars, *fields['lat'])
+    positioned = ~(np.isnan(lons) | np.isnan(lats))
+    if str(epsg) != '4326':
+        lons, lats = core.convert_coordinate_system(lons, lats, epsg1=epsg,
+                                                    epsg2='4326')
+    chunk['lon'] = lons
+    chunk['lat'] = lats
+    chunk['elev'] = np.nan
+    if 'elev' in fields:
+        chunk['elev'] = _field_floats(chars, *fields['elev'])
+    chunk['segment'] = 0
+    if 'owner' in fields:
+        chunk['owner'] = owners
+    if not positioned.all():
+        logger.debug('Skipped %d CSV lines without a position' % (
+                n - positioned.sum()))
+        chunk = chunk[positioned]
+    return chunk
+
+
+def _iso8601_times(strings):
+    '''Convert an array of ISO 8601 timestamps as
+    :func:`pyxie.xmlmisc.iso8601_to_epoch` does, with NaN for those which
+    cannot be parsed.'''
+    try:
+        return xmlmisc.iso8601_to_epoch(strings)
+    except ValueError:
+        if len(strings) == 1:
+            return np.array([np.nan])
+    # Halve the array until the bad timestamps are on their own.
+    half = len(strings) // 2
+    return np.r_[_iso8601_times(strings[:half]),
+                 _iso8601_times(strings[half:])]
+
+
+def read_csv(fileobj, **kws):
+    '''Get array of times, lons, lats, and elevations from a CSV file, as
+    for :func:`read_gpx`. Keyword arguments are passed to
+    :func:`iter_csv`.'''
+    return chunks_to_coords(list(iter_csv(fileobj, **kws)))
+
+
+def iter_nmea(source, date=None, chunk_size=1 << 22):
+    '''Iterate over the fixes in a file of NMEA 0183 sentences in chunks.
+
+    Args:
+        - *source*: filename or file-like object.
+        - *date*: date (``'YYYY-MM-DD'``) of the fixes before the first RMC
+          sentence, for logs which have none.
+        - *chunk_size*: number of bytes to read at a time.
+
+    GGA sentences give the positions and elevations of the fixes, and RMC
+    sentences the dates. An RMC sentence with the same time as the GGA
+    sentence before or after it is the same fix; others (e.g. in logs
+    without GGA) are points too. Sentences with a wrong checksum, fixes
+    flagged invalid, and all other sentences are skipped. Each fix takes
+    its date from the nearest RMC sentence before it, allowing for midnight
+    in between. Fixes before the first RMC sentence are held until it is
+    read, so the dates do not depend on *chunk_size*; without any RMC
+    sentence or *date* their times are NaN.
+
+    Sentences are parsed a chunk at a time as a byte array, as for
+    :func:`iter_csv`; checksums are computed with
+    ``np.bitwise_xor.reduceat``.
+
+    Yields: numpy record arrays of :data:`TRACKPOINT_DTYPE`.
+
+    '''
+    f = open(source, mode='rb') if isinstance(source, basestring) else source
+    default_day = None
+    if date is not None:
+        default_day = np.datetime64(date, 'D').astype(np.int64)
+    # The day number and time of day of the last dated fix, the time of day
+    # of the last GGA sentence, and the fixes read before anything gave
+    # their date, with the time of day in place of the time.
+    state = {'day': None, 'gga': np.nan,
+             'undated': np.empty(0, dtype=TRACKPOINT_DTYPE)}
+    held = ''
+    try:
+        for block in _iter_blocks(f, chunk_size):
+            # An RMC sentence at the end of a block is held back for the
+            # next, where the GGA sentence of the same fix may be.
+            block = held + block
+            cut = block.rfind('\n', 0, len(block) - 1) + 1
+            held = block[cut:] if block[cut + 3:cut + 6] == 'RMC' else ''
+            chunk = _nmea_chunk(block[:len(block) - len(held)], state,
+                                default_day)
+            if len(chunk):
+                yield chunk
+        if held:
+            chunk = _nmea_chunk(held, state, default_day)
+            if len(chunk):
+                yield chunk
+        if len(state['undated']):
+            chunk = state['undated']
+            chunk['time'] = np.nan
+            yield chunk
+    finally:
+        if f is not source:
+            f.close()
+
+
+def _nmea_chunk(block, state, default_day):
+    chars = np.frombuffer(block, dtype=np.uint8)
+    starts, ends = _line_spans(chars)
+    starts, ends = starts[ends - starts >= 6], ends[ends - starts >= 6]
+    is_gga = _nmea_sentences(chars, starts, 'GGA')
+    is_rmc = _nmea_sentences(chars, starts, 'RMC')
+    keep = is_gga | is_rmc
+    starts, ends, is_gga = starts[keep], ends[keep], is_gga[keep]
+
+    # The checksum is the XOR of the bytes between the '$' and the '*'.
+    stars = np.r_[np.flatnonzero(chars == ord('*')), len(chars)]
+    star = stars[np.searchsorted(stars, starts)]
+    has_checksum = star < ends
+    body_ends = np.where(has_checksum, star, ends)
+    bounds = np.empty(2 * len(starts), dtype=np.int64)
+    bounds[0::2] = starts + 1
+    bounds[1::2] = body_ends
+    sums = np.bitwise_xor.reduceat(chars, bounds)[0::2] if len(bounds) else bounds
+    digits = np.take(chars, np.column_stack([star + 1, star + 2]), mode='clip')
+    digits = _hex_values(digits)
+    expected = digits[:, 0] * 16 + digits[:, 1]
+    good = ~has_checksum | ((ends - star >= 3) & (sums == expected))
+    if not good.all():
+        logger.info('Skipped %d NMEA sentences with bad checksums' % (
+                (~good).sum()))
+    starts, body_ends, is_gga = starts[good], body_ends[good], is_gga[good]
+
+    lines, fstarts, fends = _split_fields(chars, starts, body_ends, ord(','),
+                                          range(1, 10))
+    is_gga = is_gga[lines]
+    # GGA: time, lat, N/S, lon, E/W, quality, satellites, HDOP, altitude.
+    # RMC: time, status, lat, N/S, lon, E/W, speed, course, date.
+    rows = np.arange(len(lines))
+
+    def field(gga_k, rmc_k):
+        cols = np.where(is_gga, gga_k, rmc_k) - 1
+        return fstarts[rows, cols], fends[rows, cols]
+
+    letter = lambda gga_k, rmc_k: _field_letters(chars, *field(gga_k, rmc_k))
+    clock = _field_floats(chars, *field(1, 1))
+    tods = (clock // 10000) * 3600 + (clock // 100 % 100) * 60 + clock % 100
+    south = letter(3, 4) == ord('S')
+    west = letter(5, 6) == ord('W')
+    lats = _nmea_degrees(_field_floats(chars, *field(2, 3)))
+    lons = _nmea_degrees(_field_floats(chars, *field(4, 5)))
+    lats *= np.where(south, -1, 1)
+    lons *= np.where(west, -1, 1)
+    last = _field_floats(chars, *field(9, 9))
+    # The fix quality of GGA and the status of RMC sentences.
+    status = letter(6, 2)
+    valid = np.where(is_gga, ~np.in1d(status, [0, ord('0')]),
+                     status == ord('A'))
+    valid &= ~(np.isnan(lats) | np.isnan(lons) | np.isnan(tods))
+
+    gga = np.flatnonzero(is_gga & valid)
+    rmc = np.flatnonzero(~is_gga & valid & ~np.isnan(last))
+    # An RMC sentence next to a GGA sentence with the same time is the same
+    # fix.
+    k = np.searchsorted(gga, rmc)
+    gga_tods = np.r_[state['gga'], tods[gga], np.nan]
+    same = (gga_tods[k] == tods[rmc]) | (gga_tods[k + 1] == tods[rmc])
+    points = np.sort(np.concatenate([gga, rmc[~same]]))
+
+    days = _nmea_days(last[rmc])
+    k = np.searchsorted(rmc, points, side='right') - 1
+    ref_days = np.full(len(points), np.nan)
+    ref_tods = np.full(len(points), np.nan)
+    ref_days[k >= 0] = days[k[k >= 0]]
+    ref_tods[k >= 0] = tods[rmc[k[k >= 0]]]
+    chunk = np.empty(len(points), dtype=TRACKPOINT_DTYPE)
+    chunk['lon'] = lons[points]
+    chunk['lat'] = lats[points]
+    chunk['elev'] = np.where(is_gga[points], last[points], np.nan)
+    chunk['segment'] = 0
+    if len(gga):
+        state['gga'] = tods[gga[-1]]
+
+    # Fixes before the first RMC sentence, including those held from
+    # earlier blocks, follow on from the last fix of the previous block,
+    # or else from the first RMC sentence or the given date, a day later
+    # wherever the time of day goes back more than 12 hours.
+    before = np.flatnonzero(k < 0)
+    undated = state['undated']
+    ref = state['day']
+    if ref is None and len(rmc):
+        ref = (days[0], tods[rmc[0]])
+    elif ref is None and default_day is not None and len(before):
+        ref = (default_day, tods[points[0]])
+    if ref is None:
+        # Nothing to date them by yet.
+        chunk['time'] = tods[points]
+        state['undated'] = np.concatenate([undated, chunk])
+        return chunk[:0]
+    if len(before) or len(undated):
+        before_tods = np.r_[undated['time'], tods[points[before]]]
+        steps = np.diff(np.r_[ref[1], before_tods])
+        before_days = ref[0] + np.cumsum(
+            (steps < -43200).astype(int) - (steps > 43200))
+        undated['time'] += before_days[:len(undated)] * 86400
+        ref_days[before] = before_days[len(undated):]
+        ref_tods[before] = tods[points[before]]
+    times = ref_days * 86400 + tods[points]
+    # A fix more than 12 hours either side of its RMC sentence is on the
+    # day after or before.
+    gaps = tods[points] - ref_tods
+    with np.errstate(invalid='ignore'):
+        times[gaps < -43200] += 86400
+        times[gaps > 43200] -= 86400
+    if len(points) and not np.isnan(times[-1]):
+        state['day'] = (times[-1] // 86400, tods[points[-1]])
+    chunk['time'] = times
+    if len(undated):
+        chunk = np.concatenate([undated, chunk])
+        state['undated'] = undated[:0]
+    return chunk
+
+
+def _nmea_sentences(chars, starts, name):
+    '''Return a boolean array of the lines which are *name* sentences from
+    any talker, e.g. $GPGGA and $GNGGA for 'GGA'.'''
+    match = chars[starts] == ord('$')
+    for k, c in enumerate(name):
+        match &= chars[starts + 3 + k] == ord(c)
+    return match
+
+
+def _nmea_degrees(values):
+    '''Convert NMEA ``dddmm.mmmm`` values to degrees.'''
+    return values // 100 + values % 100 / 60.
+
+
+def _nmea_days(values):
+    '''Convert NMEA ``ddmmyy`` dates to days since the epoch.'''
+    values = values.astype(np.int64)
+    years = values % 100
+    years += np.where(years < 80, 2000, 1900)
+    months = (years - 1970).astype('M8[Y]').astype('M8[M]')
+    months += (values // 100 % 100 - 1).astype('m8[M]')
+    return months.astype('M8[D]').astype(np.int64) + values // 10000 - 1
+
+
+def _hex_values(chars):
+    '''Return the values of hex digits, or -1 for other bytes.'''
+    chars = chars.astype(np.int32)
+    values = np.full(chars.shape, -1, dtype=np.int32)
+    for low, high, offset in ((48, 57, 48), (65, 70, 55), (97, 102, 87)):
+        digit = (chars >= low) & (chars <= high)
+        values[digit] = chars[digit] - offset
+    return values
+
+
+def read_nmea(fileobj, **kws):
+    '''Get array of times, lons, lats, and elevations from a file of NMEA
+    sentences, as for :func:`read_gpx`. Keyword arguments are passed to
+    :func:`iter_nmea`.'''
+    return chunks_to_coords(list(iter_nmea(fileobj, **kws)))
+
+
+def _iter_blocks(f, block_size):
+    '''Yield blocks of whole lines of about *block_size* bytes from the file
+    object *f*, each ending with a line break.'''
+    carry = ''
+    while True:
+        data = f.read(block_size)
+        if not data:
+            if carry:
+                yield carry + '\n'
+            return
+        data = carry + data
+        cut = data.rfind('\n') + 1
+        carry = data[cut:]
+        if cut:
+            yield data[:cut]
+
+
+def _line_spans(chars):
+    '''Return arrays of the offsets of the start and end (excluding the line
+    break) of each line in a byte array ending with a line break.'''
+    breaks = np.flatnonzero(chars == ord('\n'))
+    starts = np.r_[0, breaks[:-1] + 1]
+    ends = breaks.copy()
+    if not len(breaks):
+        starts = breaks
+    ends -= (ends > starts) & (chars[np.maximum(ends - 1, 0)] == ord('\r'))
+    return starts, ends
+
+
+def _split_fields(chars, starts, ends, delimiter, fields):
+    '''Find fields in the lines of a byte array.
+
+    Args:
+        - *chars*: uint8 array.
+        - *starts, ends*: offsets of the start and end of each line.
+        - *delimiter*: byte value separating fields.
+        - *fields*: list of the numbers of the fields wanted, from 0.
+
+    Returns: tuple (lines, field starts, field ends): the indices of the
+    lines which have all the *fields*, and arrays of shape (len(lines),
+    len(fields)) of the offsets of the fields in those lines.
+
+    '''
+    delimiters = np.flatnonzero(chars == delimiter)
+    first = np.searchsorted(delimiters, starts)
+    count = np.searchsorted(delimiters, ends) - first
+    lines = np.flatnonzero(count >= max(fields))
+    first = first[lines]
+    starts = starts[lines]
+    ends = ends[lines]
+    # A delimiter past the end of the line means it is the last field.
+    delimiters = np.r_[delimiters, len(chars)]
+    field_starts = np.empty((len(lines), len(fields)), dtype=np.int64)
+    field_ends = np.empty((len(lines), len(fields)), dtype=np.int64)
+    for k, j in enumerate(fields):
+        if j:
+            field_starts[:, k] = delimiters[first + j - 1] + 1
+        else:
+            field_starts[:, k] = starts
+        field_ends[:, k] = np.minimum(delimiters[first + j], ends)
+    return lines, field_starts, field_ends
+
+
+def _field_matrix(chars, starts, ends, min_width=1, pad=0):
+    '''Return a byte matrix with one field per row, padded with *pad*.
+    Fields longer than MAX_FIELD_WIDTH are left empty.'''
+    lengths = ends - starts
+    lengths[lengths > MAX_FIELD_WIDTH] = 0
+    width = max(int(lengths.max()) if len(lengths) else 0, min_width)
+    # Rows of a sliding window over the characters, gathered without an
+    # (N, width) array of offsets.
+    padded = np.zeros(len(chars) + width, dtype=np.uint8)
+    padded[:len(chars)] = chars
+    windows = as_strided(padded, shape=(len(chars) + 1, width), strides=(1, 1))
+    matrix = windows[starts]
+    matrix[np.arange(width) >= lengths[:, None]] = pad
+    return matrix, lengths
+
+
+def _field_strings(chars, starts, ends):
+    '''Return a numpy byte string array of fields.'''
+    matrix, lengths = _field_matrix(chars, starts, ends)
+    return matrix.view('S%d' % matrix.shape[1])[:, 0]
+
+
+def _field_letters(chars, starts, ends):
+    '''Return the first byte of each field, or 0 for empty fields.'''
+    return np.where(ends > starts, np.take(chars, starts, mode='clip'), 0)
+
+
+def _field_floats(chars, starts, ends):
+    '''Return a float64 array of the numbers in fields, with NaN for empty
+    fields and fields which are not numbers.'''
+    # Each field is followed by at least one space, and empty fields read
+    # 'nan', so the matrix is one string of numbers.
+    matrix, lengths = _field_matrix(chars, starts, ends, min_width=3, pad=32)
+    matrix = np.column_stack([matrix, np.full(len(matrix), 32, np.uint8)])
+    matrix[lengths == 0, :3] = np.frombuffer(b'nan', dtype=np.uint8)
+    values = np.fromstring(matrix.tostring(), sep=' ')
+    if len(values) == len(matrix):
+        return values
+    # Something other than a number. Fields with other bytes than those of
+    # a decimal number, or with no digits, are converted one by one.
+    odd = ~_NUMBER_BYTES[matrix].all(axis=1)
+    odd |= ~((matrix >= ord('0')) & (matrix <= ord('9'))).any(axis=1)
+    odd &= lengths > 0
+    matrix[odd, :3] = np.frombuffer(b'nan', dtype=np.uint8)
+    matrix[odd, 3:] = 32
+    values = np.fromstring(matrix.tostring(), sep=' ')
+    if len(values) != len(matrix):
+        # Something like '1-2', which is made of those bytes but is not one
+        # number.
+        odd[:] = True
+        values = np.full(len(matrix), np.nan)
+    for i in np.flatnonzero(odd):
+        try:
+            values[i] = float(chars[starts[i]:ends[i]].tostring())
+        except ValueError:
+            values[i] = np.nan
+    return values
+
+
+# Functions which iterate over the points of each format of track file in
+# TRACKPOINT_DTYPE chunks, keyed by filename extension.
+TRACK_ITERATORS = {'gpx': iter_gpx,
+                   'kml': iter_kml,
+                   'kmz': iter_kml,
+                   'csv': iter_csv,
+                   'nmea': iter_nmea,
+                   'nma': iter_nmea}
+
+
+def track_format(fn):
+    '''Return the format of a track file from its extension (a key of
+    :data:`TRACK_ITERATORS`), or 'gpx' if it is not one of those.'''
+    extension = os.path.splitext(fn)[1].lower().lstrip('.')
+    if extension in TRACK_ITERATORS:
+        return extension
+    return 'gpx'
+
+
+def iter_track(source, format=None, chunk_size=None):
+    '''Iterate over the points of a track file in chunks.
+
+    Args:
+        - *source*: filename or file-like object.
+        - *format*: a key of :data:`TRACK_ITERATORS`, e.g. 'gpx' or 'csv'.
+          By default it is found from the filename with
+          :func:`track_format`, and GPX for file objects.
+        - *chunk_size*: passed to the iterator for the format if given: a
+          number of points for GPX and KML, and of bytes for CSV and NMEA.
+
+    Yields: numpy record arrays of :data:`TRACKPOINT_DTYPE`.
+
+    '''
+    if format is None:
+        format = 'gpx'
+        if isinstance(source, basestring):
+            format = track_format(source)
+    if chunk_size is None:
+        return TRACK_ITERATORS[format](source)
+    return TRACK_ITERATORS[format](source, chunk_size=chunk_size)
+
+
+def read_track(fileobj, format=None, chunk_size=None):
+    '''Get array of times, lons, lats, and elevations from a track file of
+    any format in :data:`TRACK_ITERATORS`, as for :func:`read_gpx`.
+    *format* and *chunk_size* are as for :func:`iter_track`.'''
+    return chunks_to_coords(list(iter_track(fileobj, format, chunk_size)))
+
+
+def chunks_to_owners(chunks):
+    '''Concatenate the owner fields of chunks from :func:`iter_csv`, or
+    return None if they have none.'''
+    if not chunks or not 'owner' in chunks[0].dtype.names:
+        return None
+    return np.concatenate([chunk['owner'] for chunk in chunks])
+
+
+def read_track_cached(fn, parse_cache=None):
+    '''Get the array of a track file of any format via the parse cache, as
+    for :func:`read_gpx_cached`.'''
+    if parse_cache is None:
+        parse_cache = cache.default_cache()
+    return parse_cache.load(fn, read_track, parser_version(fn))
+
+
+def parser_version(fn):
+    '''Return the parse cache version of the track file *fn*.
+
+    This is :data:`PARSER_VERSION`, and for CSV files also a hash of the
+    ``[csv]`` settings, since those change which columns are read.
+
+    '''
+    if track_format(fn) != 'csv':
+        return PARSER_VERSION
+    settings = repr(sorted(config.items('csv')))
+    return '%d-csv-%s' % (PARSER_VERSION, hashlib.md5(settings).hexdigest())
+
+
+# Start and end of the GPX documents written by GPXWriter.
+GPX_HEADER = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+              '<gpx version="1.1" creator="%s" '
+              'xmlns="http://www.topografix.com/GPX/1/1">\n'
+              '  <trk>\n'
+              '%s'
+              '    <trkseg>\n')
+GPX_FOOTER = ('    </trkseg>\n'
+              '  </trk>\n'
+              '</gpx>\n')
+
+
+class GPXWriter(object):
+    '''Write a track to a GPX file a chunk of points at a time.
+
+    Args:
+        - *dest*: filename or file-like object to write to.
+        - *name*: optional name of the track.
+        - *digits*: decimal places of longitudes and latitudes.
+        - *elev_digits*: decimal places of elevations.
+        - *time_decimals*: decimal places of the seconds of timestamps, as
+          for :func:`xmlmisc.epoch_to_iso8601`.
+        - *creator*: the creator attribute of the gpx element.
+
+    Each chunk given to :meth:`write` is formatted with a single ``%``
+    operation, on a format string joined from one template per point
+    chosen by whether the point has an elevation and a time and starts a
+    new segment. So there is no Python code per point and no element tree,
+    and memory use depends on the size of the chunks, not of the track.
+
+    Points without a longitude or latitude cannot be written to GPX. They
+    are skipped and end the segment, as they break the track when it is
+    drawn.
+
+    Usage::
+
+        >>> with io.GPXWriter('walk.gpx', name='Walk') as writer:
+        ...     for chunk in chunks:
+        ...         writer.write(chunk)
+
+    '''
+    def __init__(self, dest, name=None, digits=10, elev_digits=3,
+                 time_decimals=None, creator='pyxie'):
+        if isinstance(dest, basestring):
+            self.file = open(dest, mode='wb')
+            self._own_file = True
+        else:
+            self.file = dest
+            self._own_file = False
+        self.time_decimals = time_decimals
+        self.npoints = 0
+        self._templates = _trkpt_templates(digits, elev_digits)
+        self._segment = None
+        self._new_segment = False
+        name_xml = ''
+        if name is not None:
+            name_xml = '    <name>%s</name>\n' % escape(name)
+        self.file.write(GPX_HEADER % (escape(creator, {'"': '&quot;'}),
+                                      name_xml))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, coords, segments=None):
+        '''Write points.
+
+        Args:
+            - *coords*: (N, 4) array of times, lons, lats and elevations,
+              as returned by :func:`read_gpx`.
+            - *segments*: optional array of N segment numbers, e.g. the
+              ``segment`` field of :data:`TRACKPOINT_DTYPE`. A new trkseg
+              is started wherever the number changes.
+
+        '''
+        coords = np.asarray(coords, dtype=np.float64)
+        n = len(coords)
+        if not n:
+            return
+        times, lons, lats, elevs = coords.T
+        valid = ~(np.isnan(lons) | np.isnan(lats))
+        # Mark the segment boundaries, including those from skipped points
+        # and from earlier chunks, and move each to the next valid point.
+        breaks = np.zeros(n, dtype=bool)
+        breaks[1:] = ~valid[:-1]
+        breaks[0] = self._new_segment
+        if segments is not None:
+            segments = np.asarray(segments)
+            breaks[1:] |= segments[1:] != segments[:-1]
+            if self._segment is not None:
+                breaks[0] |= segments[0] != self._segment
+            self._segment = segments[-1]
+        counts = np.cumsum(breaks)
+        valid_counts = counts[valid]
+        new_segment = np.diff(np.r_[0, valid_counts]) > 0
+        self._new_segment = (not valid[-1] or not len(valid_counts)
+                             or counts[-1] > valid_counts[-1])
+        if not len(valid_counts):
+            return
+        if not self.npoints:
+            # The header opens the first segment.
+            new_segment[0] = False
+
+        times = times[valid]
+        elevs = elevs[valid]
+        has_elev = ~np.isnan(elevs)
+        has_time = ~np.isnan(times)
+        values = np.empty((len(times), 4), dtype=object)
+        values[:, 0] = lats[valid]
+        values[:, 1] = lons[valid]
+        values[:, 2] = elevs
+        values[:, 3] = xmlmisc.epoch_to_iso8601(times, self.time_decimals)
+        present = np.ones(values.shape, dtype=bool)
+        present[:, 2] = has_elev
+        present[:, 3] = has_time
+        kinds = has_elev + 2 * has_time + 4 * new_segment
+        template = ''.join(self._templates[kinds].tolist())
+        self.file.write(template % tuple(values[present].tolist()))
+        self.npoints += len(times)
+
+    def close(self):
+        '''Finish the document, and close the file if it was opened by the
+        writer.'''
+        self.file.write(GPX_FOOTER)
+        if self._own_file:
+            self.file.close()
+
+
+def _trkpt_templates(digits, elev_digits):
+    '''Return an array of the format strings of a trkpt element, indexed by
+    has elevation + 2 * has time + 4 * starts a segment.'''
+    templates = []
+    for kind in range(8):
+        template = '      <trkpt lat="%%.%df" lon="%%.%df">' % (digits, digits)
+        if kind & 1:
+            template += '<ele>%%.%df</ele>' % elev_digits
+        if kind & 2:
+            template += '<time>%s</time>'
+        template += '</trkpt>\n'
+        if kind & 4:
+            template = '    </trkseg>\n    <trkseg>\n' + template
+        templates.append(template)
+    return np.array(templates, dtype=object)
+
+
+def write_gpx(dest, coords, name=None, segments=None, chunk_size=65536, **kws):
+    '''Write a track to a GPX file.
+
+    Args:
+        - *dest*: filename or file-like object.
+        - *coords*: (N, 4) array as returned by :func:`read_gpx`, or
+          :data:`pyxie.archive.Columns`, e.g. a slice of an archive.
+        - *name*: optional name of the track.
+        - *segments*: optional array of N segment numbers, see
+          :meth:`GPXWriter.write`.
+        - *chunk_size*: number of points formatted at a time.
+
+    Other keyword arguments are passed to :class:`GPXWriter`. Reading the
+    file with :func:`read_gpx` gives *coords* back, rounded to the decimal
+    places written.
+
+    Returns: number of points written.
+
+    '''
+    with GPXWriter(dest, name=name, **kws) as writer:
+        for i, chunk in iter_coords(coords, chunk_size):
+            writer.write(chunk, _slice(segments, i, i + len(chunk)))
+    return writer.npoints
+
+
+def split_gpx(coords, starts, dests, names=None, segments=None,
+              chunk_size=65536, **kws):
+    '''Write consecutive pieces of a track to separate GPX files.
+
+    Args:
+        - *coords*: as for :func:`write_gpx`.
+        - *starts*: increasing positions of the first point of each piece.
+          Each piece runs to the start of the next, and the last to the end
+          of the track. Points before the first start are not written.
+        - *dests*: list of filenames or file-like objects, one per piece, or
+          a filename pattern like ``'walk-%03d.gpx'`` which is filled in
+          with the number of the piece, from 1.
+        - *names*: optional list of track names, one per piece.
+        - *segments, chunk_size*: as for :func:`write_gpx`.
+
+    Other keyword arguments are passed to :class:`GPXWriter`. The points
+    are read once, in order, a chunk at a time, and each file is open only
+    while its piece is being written, so e.g. a long archive slice can be
+    split without loading it into memory.
+
+    Returns: list of the number of points written to each file.
+
+    '''
+    starts = np.asarray(starts, dtype=np.int64)
+    if np.any(np.diff(starts) < 0):
+        raise ValueError('starts must be increasing')
+    if isinstance(dests, basestring):
+        dests = [dests % (k + 1) for k in range(len(starts))]
+    if names is None:
+        names = [None] * len(starts)
+    stops = np.r_[starts[1:], np.iinfo(np.int64).max]
+    counts = []
+    writers = [None]
+
+    def writer(k):
+        if writers[0] is None:
+            writers[0] = GPXWriter(dests[k], name=names[k], **kws)
+        return writers[0]
+
+    def finish(k):
+        w = writer(k)
+        w.close()
+        counts.append(w.npoints)
+        writers[0] = None
+
+    k = 0
+    for i, chunk in iter_coords(coords, chunk_size):
+        j = i + len(chunk)
+        while k < len(starts) and starts[k] < j:
+            a = max(starts[k], i)
+            b = min(stops[k], j)
+            writer(k).write(chunk[a - i:b - i], _slice(segments, a, b))
+            if stops[k] > j:
+                break
+            finish(k)
+            k += 1
+    # Pieces which run to the end of the track, or start beyond it.
+    while k < len(starts):
+        finish(k)
+        k += 1
+    return counts
+
+
+def split_at_gaps(times, max_gap):
+    '''Return the positions at which to split a track where there is a gap
+    of more than *max_gap* seconds between consecutive times, for
+    :func:`split_gpx`.'''
+    times = np.asarray(times, dtype=np.float64)
+    if not len(times):
+        return np.empty(0, dtype=np.int64)
+    with np.errstate(invalid='ignore'):
+        gaps = np.diff(times) > max_gap
+    return np.r_[0, np.flatnonzero(gaps) + 1]
+
+
+def iter_coords(coords, chunk_size=65536):
+    '''Iterate over an (N, 4) array, or :data:`pyxie.archive.Columns`, in
+    chunks.
+
+    Yields: tuples (position of the first point, (n, 4) array). Chunks of
+    :data:`pyxie.archive.Columns` are copied from the columns as they are
+    reached, so a memory-mapped archive slice is not loaded all at once.
+
+    '''
+    if isinstance(coords, archive.Columns):
+        n = len(coords.time)
+    else:
+        n = len(coords)
+    for i in range(0, n, chunk_size):
+        j = min(i + chunk_size, n)
+        if isinstance(coords, archive.Columns):
+            chunk = np.column_stack([getattr(coords, name)[i:j]
+                                     for name in archive.COLUMNS])
+        else:
+            chunk = coords[i:j]
+        yield i, chunk
+
+
+def _slice(values, i, j):
+    if values is None:
+        return None
+    return values[i:j]
+
+
 def search_directory_tree(root_path, pattern='*.gpx', debug=None):
     '''Find list of filenames from directory tree.'''
     fns = []
     if debug is None:
-        debug = config.log
+        debug = sys.stdout
     for root, dirs, files in os.walk(root_path):
         incr_fns = glob.glob(os.path.join(root, pattern))
         if incr_fns:
@@ -43,14 +1153,195 @@ def search_directory_tree(root_path, pattern='*.gpx', debug=None):
     debug.write('% 9.0f Total\n' % len(fns))
     return fns
 
+
+def import_files(fns, archive_path, processes=None, progress=None,
+                 use_cache=True, dedup=True, owner=None):
+    '''Parse track files across a process pool and write a track archive.
     
-# def gpx_trackpoint(x, y, epsg='4326', dt=None, z=None):
-    # '''Return XML string.
+    Each file is parsed in a worker process. The points are merged and
+    sorted by time once, after the last file has been parsed. A file which
+    fails to parse is recorded in the archive header and skipped. Files
+    which duplicate each other, or overlap with identical points, are
+    stored once (see :class:`pyxie.archive.ArchiveWriter`).
     
-    # <trkpt lat="-35.0001252349" lon="138.5810883343"><ele>47.72</ele><time>2013-08-08T06:06:04Z</time></trkpt>'''
-    # lons, lats = core.convert_coordinate_system(xs, ys, epsg1='4326', epsg2='28353'):
-    # p1 = pyproj.Proj(init='epsg:%s' % epsg1)
-    # p2 = pyproj.Proj(init='epsg:%s' % epsg2)
-    # nxs, nys = pyproj.transform(p1, p2, xs, ys)
-    # return nxs, nys
+    Args:
+        - *fns*: list of track filenames, in any format in
+          :data:`TRACK_ITERATORS`.
+        - *archive_path*: folder to write the archive to, see
+          :mod:`pyxie.archive`.
+        - *processes*: number of worker processes. The default is one per
+          CPU; 1 parses in this process.
+        - *progress*: optional function called as ``progress(n_done,
+          n_total, fn, error)`` after each file, where *error* is None or a
+          message.
+        - *use_cache*: read files through the parse cache.
+        - *dedup*: store duplicated points once.
+        - *owner*: name of the owner of the points, except those in CSV
+          files with an owner column.
+        
+    Returns: dict of error messages keyed by filename.
+    
+    '''
+    fns = sorted(fns)
+    writer = archive.ArchiveWriter(archive_path, fns, dedup=dedup)
+    results = iter_parse_files(fns, processes=processes, use_cache=use_cache)
+    for n_done, (track_id, coords, owners, error) in enumerate(results):
+        if error is None:
+            if owners is None:
+                owners = owner
+            writer.add(track_id, coords, owner=owners)
+        else:
+            logger.warning('Skipping %s: %s' % (fns[track_id], error))
+            writer.add_error(track_id, error)
+        if progress:
+            progress(n_done + 1, len(fns), fns[track_id], error)
+    writer.close()
+    for fn in sorted(writer.duplicates):
+        logger.info('%s is a duplicate of %s' % (fn, writer.duplicates[fn]))
+    return writer.errors
+
+
+def import_tree(root_path, archive_path, pattern='*.gpx', debug=None, **kws):
+    '''Import every file matching *pattern* under *root_path* into a track
+    archive. Keyword arguments are passed to :func:`import_files`.'''
+    fns = search_directory_tree(root_path, pattern=pattern, debug=debug)
+    return import_files(fns, archive_path, **kws)
+
+
+def parse_file(fn, use_cache=True):
+    '''Parse a track file for import into an archive.
+
+    Args:
+        - *fn*: track filename, in any format in :data:`TRACK_ITERATORS`.
+        - *use_cache*: read the file through the parse cache.
+
+    Returns: tuple (coords, owners, error): an (N, 4) array, an array of
+    owner names from a CSV owner column or None, and None. If the file
+    cannot be parsed, coords and owners are None and error is a message.
+
+    '''
+    owners = None
+    try:
+        if track_format(fn) == 'csv':
+            # The parse cache holds only the coordinates, not the owners.
+            chunks = list(iter_track(fn))
+            coords = chunks_to_coords(chunks)
+            owners = chunks_to_owners(chunks)
+        elif use_cache:
+            coords = np.array(read_track_cached(fn))
+        else:
+            coords = read_track(fn)
+    except Exception as e:
+        return None, None, '%s: %s' % (e.__class__.__name__, e)
+    return coords, owners, None
+
+
+def iter_parse_files(fns, processes=None, use_cache=True):
+    '''Parse track files with :func:`parse_file`, in a process pool if
+    there are several.
+
+    Args:
+        - *fns*: list of track filenames.
+        - *processes*: number of worker processes. The default is one per
+          CPU; 1 parses in this process.
+        - *use_cache*: read files through the parse cache.
+
+    Yields: tuples (index into *fns*, coords, owners, error) as each file is
+    parsed, in any order.
+
+    '''
+    jobs = [(i, fn, use_cache) for i, fn in enumerate(fns)]
+    if processes == 1 or len(fns) < 2:
+        for job in jobs:
+            yield _parse_job(job)
+        return
+    pool = multiprocessing.Pool(processes)
+    try:
+        for result in pool.imap_unordered(_parse_job, jobs, chunksize=4):
+            yield result
+    finally:
+        # Also stops the workers if the caller stops part way through.
+        pool.terminate()
+        pool.join()
+
+
+def _parse_job(job):
+    i, fn, use_cache = job
+    return (i, ) + parse_file(fn, use_cache=use_cache)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+            description='Import a folder hierarchy of track files into a Pyxie '
+                        'track archive',
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('root_path')
+    parser.add_argument('archive_path')
+    parser.add_argument('--pattern', default='*.gpx')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='number of worker processes (default: one per CPU)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='do not read or fill the parse cache')
+    parser.add_argument('--no-dedup', action='store_true',
+                        help='store points which are in several files once '
+                             'for each file')
+    parser.add_argument('--owner', default=None,
+                        help='owner of the points, except for CSV files with '
+                             'an owner column')
+    return parser
+
+
+def main():
+    args = get_parser().parse_args(sys.argv[1:])
+
+    logging.basicConfig(format='%(levelname)s:%(name)s.%(funcName)s: %(message)s',
+                        level=logging.INFO)
+
+    def progress(n_done, n_total, fn, error):
+        if error is None:
+            sys.stderr.write('% 9.0f/%d %s\n' % (n_done, n_total, fn))
+        else:
+            sys.stderr.write('% 9.0f/%d %s FAILED (%s)\n' % (
+                    n_done, n_total, fn, error))
+
+    errors = import_tree(args.root_path, args.archive_path,
+                         pattern=args.pattern, debug=sys.stderr,
+                         processes=args.processes, progress=progress,
+                         use_cache=not args.no_cache,
+                         dedup=not args.no_dedup, owner=args.owner)
+    sys.stderr.write('% 9.0f Failed\n' % len(errors))
+
+
+def get_split_parser():
+    parser = argparse.ArgumentParser(
+            description='Split a GPX track into separate files where there '
+                        'are gaps in time',
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('filename')
+    parser.add_argument('-g', '--gap', type=float, default=60.,
+                        help='split where there are more than this many '
+                             'minutes between points')
+    parser.add_argument('-o', '--output', default=None,
+                        help='filename pattern of the pieces (default: the '
+                             'filename with -%%03d before the extension)')
+    return parser
+
+
+def split_main():
+    args = get_split_parser().parse_args(sys.argv[1:])
+    chunks = list(iter_gpx(args.filename))
+    coords = chunks_to_coords(chunks)
+    segments = np.concatenate([chunk['segment'] for chunk in chunks]
+                              or [np.empty(0, dtype=np.int32)])
+    output = args.output
+    if output is None:
+        root, ext = os.path.splitext(args.filename)
+        output = root.replace('%', '%%') + '-%03d' + ext
+    starts = split_at_gaps(coords[:, 0], args.gap * 60)
+    counts = split_gpx(coords, starts, output, segments=segments)
+    for k, count in enumerate(counts):
+        sys.stderr.write('% 9.0f %s\n' % (count, output % (k + 1)))
+
 
+if __name__ == '__main__':
+    main()
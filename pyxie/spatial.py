@@ -0,0 +1,159 @@
+'''Spatial index for bounding-box and nearest-point queries.
+
+:class:`GridIndex` bins points into square grid cells and keeps the point
+indices sorted by cell. Only occupied cells take up any memory, and the
+points in a row of cells are contiguous in the sorted order, so a
+bounding-box query is two binary searches per row of cells followed by an
+exact test of the few points found. Building the index is one sort.
+
+'''
+import logging
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+# Mean radius of the Earth (IUGG), and the length of one degree of latitude.
+EARTH_RADIUS = 6371008.8
+METRES_PER_DEGREE = EARTH_RADIUS * np.pi / 180.
+
+
+class GridIndex(object):
+    '''Uniform grid index over 2-D points.
+
+    Args:
+        - *xs, ys*: coordinate arrays. They are kept by reference, not
+          copied. Points with NaN coordinates are left out of the index.
+        - *cell_size*: length of the side of a grid cell, in units of *ys*.
+          By default it is chosen so that a track passes through a cell
+          about every *points_per_cell* points.
+        - *x_scale*: factor converting *xs* into units of *ys* for distances,
+          e.g. ``cos(latitude)`` when *xs, ys* are longitudes and latitudes.
+        - *points_per_cell*: see *cell_size*.
+
+    '''
+    def __init__(self, xs, ys, cell_size=None, x_scale=1., points_per_cell=8):
+        self.xs = np.asarray(xs, dtype=np.float64)
+        self.ys = np.asarray(ys, dtype=np.float64)
+        self.x_scale = float(x_scale)
+        valid = np.isfinite(self.xs) & np.isfinite(self.ys)
+        valid_indices = np.flatnonzero(valid)
+        if len(valid_indices):
+            vxs = self.xs[valid_indices]
+            vys = self.ys[valid_indices]
+            self.bounds = (vxs.min(), vys.min(), vxs.max(), vys.max())
+        else:
+            vxs = vys = np.empty(0)
+            self.bounds = (0., 0., 0., 0.)
+        if cell_size is None:
+            cell_size = self._default_cell_size(vxs, vys, points_per_cell)
+        self.cell_size = cell_size
+        self.cell_width = cell_size / self.x_scale
+        x0, y0, x1, y1 = self.bounds
+        self.nx = int((x1 - x0) / self.cell_width) + 1
+        self.ny = int((y1 - y0) / self.cell_size) + 1
+        keys = self._cell_keys(vxs, vys)
+        order = np.argsort(keys, kind='mergesort')
+        self.order = valid_indices[order]
+        self.keys = keys[order]
+
+    def __len__(self):
+        return len(self.order)
+
+    def _default_cell_size(self, xs, ys, points_per_cell):
+        x0, y0, x1, y1 = self.bounds
+        width = (x1 - x0) * self.x_scale
+        height = y1 - y0
+        extent = max(width, height)
+        if extent == 0:
+            return 1.
+        path_length = np.sum(np.hypot(np.diff(xs) * self.x_scale, np.diff(ys)))
+        cell_size = path_length * points_per_cell / len(xs)
+        # Never use more than about a million rows or columns.
+        return max(cell_size, extent / 2 ** 20)
+
+    def _cell_keys(self, xs, ys):
+        cxs = ((xs - self.bounds[0]) / self.cell_width).astype(np.int64)
+        cys = ((ys - self.bounds[1]) / self.cell_size).astype(np.int64)
+        return cys * self.nx + cxs
+
+    def _candidates(self, x0, y0, x1, y1):
+        '''Return indices of points in the cells overlapping a box.'''
+        if not len(self.order):
+            return np.empty(0, dtype=np.int64)
+        bx0, by0, bx1, by1 = self.bounds
+        if x1 < bx0 or x0 > bx1 or y1 < by0 or y0 > by1:
+            return np.empty(0, dtype=np.int64)
+        cx0 = int((max(x0, bx0) - bx0) / self.cell_width)
+        cx1 = min(int((min(x1, bx1) - bx0) / self.cell_width), self.nx - 1)
+        cy0 = int((max(y0, by0) - by0) / self.cell_size)
+        cy1 = min(int((min(y1, by1) - by0) / self.cell_size), self.ny - 1)
+        rows = np.arange(cy0, cy1 + 1, dtype=np.int64) * self.nx
+        starts = np.searchsorted(self.keys, rows + cx0, side='left')
+        stops = np.searchsorted(self.keys, rows + cx1, side='right')
+        lengths = stops - starts
+        total = lengths.sum()
+        if not total:
+            return np.empty(0, dtype=np.int64)
+        # Concatenate the ranges starts[i]:stops[i] without a Python loop.
+        offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        return self.order[offsets + np.arange(total)]
+
+    def bbox(self, x0, y0, x1, y1):
+        '''Return sorted indices of the points inside a bounding box.'''
+        indices = self._candidates(x0, y0, x1, y1)
+        xs = self.xs[indices]
+        ys = self.ys[indices]
+        inside = (xs >= x0) & (xs <= x1) & (ys >= y0) & (ys <= y1)
+        return np.sort(indices[inside])
+
+    def distances(self, indices, x, y):
+        '''Return distances from (*x*, *y*) to the points *indices*, in units
+        of *ys*.'''
+        return np.hypot((self.xs[indices] - x) * self.x_scale,
+                        self.ys[indices] - y)
+
+    def within(self, x, y, radius):
+        '''Return sorted indices of the points within *radius* of (*x*, *y*).'''
+        indices = self._candidates(*self._box(x, y, radius))
+        return np.sort(indices[self.distances(indices, x, y) <= radius])
+
+    def nearest(self, x, y, k=1):
+        '''Find the *k* points nearest to (*x*, *y*).
+
+        Returns: tuple (indices, distances), both sorted by distance and of
+        length *k* or less.
+
+        '''
+        if not len(self.order):
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        bx0, by0, bx1, by1 = self.bounds
+        max_radius = np.hypot(max(abs(x - bx0), abs(x - bx1)) * self.x_scale,
+                              max(abs(y - by0), abs(y - by1)))
+        radius = self.cell_size
+        while True:
+            indices = self._candidates(*self._box(x, y, radius))
+            if len(indices) >= k or radius >= max_radius:
+                break
+            radius *= 2
+        distances = self.distances(indices, x, y)
+        if len(indices) >= k:
+            # Points outside the box searched are further away than radius,
+            # so if the k-th nearest candidate is further than that, search
+            # again out to its distance.
+            kth_distance = np.partition(distances, k - 1)[k - 1]
+            if kth_distance > radius:
+                indices = self._candidates(*self._box(x, y, kth_distance))
+                distances = self.distances(indices, x, y)
+        nearest = np.argsort(distances, kind='mergesort')[:k]
+        return indices[nearest], distances[nearest]
+
+    def tracks_through(self, x, y, radius, track_ids):
+        '''Return the unique values of *track_ids* (an array giving the track
+        of each point) for the points within *radius* of (*x*, *y*).'''
+        return np.unique(np.asarray(track_ids)[self.within(x, y, radius)])
+
+    def _box(self, x, y, radius):
+        half_width = radius / self.x_scale
+        return x - half_width, y - radius, x + half_width, y + radius
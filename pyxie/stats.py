@@ -1,6 +1,8 @@
 import datetime
 import numpy as np
 
+from pyxie import core
+
 
 def total_dist(xs, ys):
     return np.sum(distances(xs, ys))
@@ -24,9 +26,38 @@ class Path(object):
         s.dxs = np.gradient(s.xs)
         s.dys = np.gradient(s.ys)
         s.dist = np.sqrt(s.dxs ** 2 + s.dys ** 2)
+        s.spd = s.dist / s.times
+        s._summarise()
+
+    @classmethod
+    def from_lonlat(cls, lons, lats, times=None, geodesic=None):
+        '''Create a Path from longitudes and latitudes, measuring each step
+        along the great circle between neighbouring points (see
+        :func:`pyxie.core.geodesic`) rather than on projected coordinates.
+        
+        A :data:`pyxie.core.Geodesic` already computed for the same points
+        can be passed as *geodesic*.
+        
+        '''
+        if times is None:
+            times = np.ones_like(lons) * np.nan
+        if geodesic is None:
+            geodesic = core.geodesic(lons, lats, times)
+        s = cls.__new__(cls)
+        s.xs = lons
+        s.ys = lats
+        s.abs_times = times
+        s.times = np.empty(len(times))
+        s.times[:1] = np.nan
+        s.times[1:] = np.diff(times)
+        s.dist = geodesic.distances
+        s.spd = geodesic.speeds
+        s._summarise()
+        return s
+
+    def _summarise(s):
         s.tot_dist = np.nansum(s.dist)
         s.tot_time = np.nansum(s.times)
-        s.spd = s.dist / s.times
         s.max_spd = np.nanmax(s.spd)
         s.avg_spd = np.nanmean(s.spd)
         
@@ -42,4 +73,313 @@ class Path(object):
         sl += ['Speed - maximum: %.2f km/h' % 
                (s.max_spd / 1000. * 60. * 60.)]
         return '\n'.join(sl)
-        
\ No newline at end of file
+        
+
+# Steps slower than this (metres per second) count as stopped time.
+MOVING_SPEED = 0.5
+
+
+class TrackStats(object):
+    '''Summary statistics of a track, as returned by :func:`track_stats`.
+    
+    Attributes:
+        - *npoints*: number of points
+        - *distance*: metres
+        - *total_time, moving_time, stopped_time*: seconds
+        - *max_speed, avg_speed, moving_speed*: metres per second. The
+          average speed is over the total time and the moving speed over
+          the moving time.
+        - *elev_gain, elev_loss*: metres climbed and descended
+        - *bounds*: tuple (min lon, min lat, max lon, max lat)
+        
+    '''
+    __slots__ = ('npoints', 'distance', 'total_time', 'moving_time',
+                 'stopped_time', 'max_speed', 'avg_speed', 'moving_speed',
+                 'elev_gain', 'elev_loss', 'bounds')
+    
+    def __init__(s, **kwargs):
+        for name in s.__slots__:
+            setattr(s, name, kwargs.get(name, np.nan))
+            
+    def __repr__(s):
+        return '<%s %s>' % (s.__class__.__name__, ', '.join(
+                '%s=%s' % (name, getattr(s, name)) for name in s.__slots__))
+        
+    def __str__(s):
+        sl = []
+        if s.distance > 10e3:
+            sl += ['Distance - total: %.2f km' % (s.distance / 1000.)]
+        else:
+            sl += ['Distance - total: %.2f m' % (s.distance)]
+        sl += ['Time - total: %s hr:mins:secs' % _format_duration(s.total_time)]
+        sl += ['Time - moving: %s hr:mins:secs' % _format_duration(s.moving_time)]
+        sl += ['Time - stopped: %s hr:mins:secs' % _format_duration(s.stopped_time)]
+        sl += ['Speed - overall: %.2f km/h' % (s.avg_speed * 3.6)]
+        sl += ['Speed - moving: %.2f km/h' % (s.moving_speed * 3.6)]
+        sl += ['Speed - maximum: %.2f km/h' % (s.max_speed * 3.6)]
+        sl += ['Elevation - gain: %.0f m' % s.elev_gain]
+        sl += ['Elevation - loss: %.0f m' % s.elev_loss]
+        return '\n'.join(sl)
+
+
+def track_stats(times, lons, lats, elevs=None, geodesic=None,
+                moving_speed=MOVING_SPEED):
+    '''Calculate summary statistics of a track.
+    
+    Every quantity is computed from one set of step arrays held in a few
+    reused buffers, rather than from separate passes over the track.
+    
+    Args:
+        - *times*: seconds
+        - *lons, lats*: degrees
+        - *elevs*: optional metres
+        - *geodesic*: :data:`pyxie.core.Geodesic` for the same points, if it
+          has already been computed
+        - *moving_speed*: steps faster than this (metres per second) are
+          counted as moving
+        
+    Returns: :class:`TrackStats` object.
+    
+    '''
+    times = np.asarray(times, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    lats = np.asarray(lats, dtype=np.float64)
+    n = len(times)
+    result = TrackStats(npoints=n)
+    if n:
+        result.bounds = (_nanmin(lons), _nanmin(lats),
+                         _nanmax(lons), _nanmax(lats))
+    else:
+        result.bounds = (np.nan, ) * 4
+    if n < 2:
+        return result
+    dtimes, dists, speeds, moving = _steps(times, lons, lats, geodesic,
+                                           moving_speed)
+    result.distance = dists.sum()
+    result.total_time = dtimes.sum()
+    result.moving_time = np.dot(dtimes, moving)
+    result.max_speed = speeds.max()
+    _set_speeds(result, np.dot(dists, moving))
+        
+    if elevs is not None:
+        delevs = np.subtract(elevs[1:], elevs[:-1], out=dtimes)
+        delevs[np.isnan(delevs)] = 0
+        # Gain and loss from the net and total change, which avoids
+        # branching on the sign of every step.
+        net = delevs.sum()
+        total = np.abs(delevs, out=delevs).sum()
+        result.elev_gain = (total + net) / 2.
+        result.elev_loss = (total - net) / 2.
+    return result
+    
+    
+class SelectionStats(object):
+    '''Summary statistics for any run of points in a track, in O(1) time.
+    
+    Cumulative sums of the step distances, durations, moving durations and
+    distances, and elevation gains and losses are built once, so that the
+    totals for points *i* to *j* are differences of two entries. Maximum
+    speed and bounds come from :class:`RangeMax` tables.
+    
+    Args: as for :func:`track_stats`.
+    
+    '''
+    def __init__(s, times, lons, lats, elevs=None, geodesic=None,
+                 moving_speed=MOVING_SPEED):
+        times = np.asarray(times, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        lats = np.asarray(lats, dtype=np.float64)
+        s.npoints = len(times)
+        dtimes, dists, speeds, moving = _steps(times, lons, lats, geodesic,
+                                               moving_speed)
+        s.cum_dist = _cumsum(dists)
+        s.cum_time = _cumsum(dtimes)
+        s.cum_moving_time = _cumsum(dtimes * moving)
+        s.cum_moving_dist = _cumsum(dists * moving)
+        if elevs is None:
+            s.cum_gain = s.cum_loss = None
+        else:
+            delevs = np.subtract(elevs[1:], elevs[:-1])
+            delevs[np.isnan(delevs)] = 0
+            abs_delevs = np.abs(delevs)
+            s.cum_gain = _cumsum((abs_delevs + delevs) / 2.)
+            s.cum_loss = _cumsum((abs_delevs - delevs) / 2.)
+        s.max_speeds = RangeMax(speeds)
+        s.bound_tables = (RangeMax(-lons), RangeMax(-lats),
+                          RangeMax(lons), RangeMax(lats))
+        
+    def query(s, i, j):
+        '''Return :class:`TrackStats` for points *i* up to but not including
+        *j* (as for a slice).'''
+        i, j, step = slice(i, j).indices(s.npoints)
+        result = TrackStats(npoints=max(j - i, 0))
+        if j - i < 1:
+            result.bounds = (np.nan, ) * 4
+            return result
+        min_lon, min_lat, max_lon, max_lat = [
+                table.query(i, j) for table in s.bound_tables]
+        result.bounds = (-min_lon, -min_lat, max_lon, max_lat)
+        if j - i < 2:
+            return result
+        # Step k joins points k and k + 1 and is cumulated at index k + 1.
+        result.distance = s.cum_dist[j - 1] - s.cum_dist[i]
+        result.total_time = s.cum_time[j - 1] - s.cum_time[i]
+        result.moving_time = s.cum_moving_time[j - 1] - s.cum_moving_time[i]
+        result.max_speed = s.max_speeds.query(i, j - 1)
+        _set_speeds(result, s.cum_moving_dist[j - 1] - s.cum_moving_dist[i])
+        if s.cum_gain is not None:
+            result.elev_gain = s.cum_gain[j - 1] - s.cum_gain[i]
+            result.elev_loss = s.cum_loss[j - 1] - s.cum_loss[i]
+        return result
+
+    def query_runs(s, starts, stops):
+        '''Return :class:`TrackStats` for several runs of points, each from
+        one of *starts* up to but not including the matching one of
+        *stops*. The steps between one run and the next are left out.'''
+        starts = np.asarray(starts, dtype=np.int64)
+        stops = np.asarray(stops, dtype=np.int64)
+        keep = stops > starts
+        starts, stops = starts[keep], stops[keep]
+        if len(starts) == 1:
+            return s.query(starts[0], stops[0])
+        result = TrackStats(npoints=int((stops - starts).sum()))
+        if not len(starts):
+            result.bounds = (np.nan, ) * 4
+            return result
+        bounds = np.array([[table.query(i, j) for table in s.bound_tables]
+                           for i, j in zip(starts, stops)])
+        min_lon, min_lat, max_lon, max_lat = np.fmax.reduce(bounds, axis=0)
+        result.bounds = (-min_lon, -min_lat, max_lon, max_lat)
+        # Runs of one point have no steps.
+        steps = stops - starts > 1
+        if not steps.any():
+            return result
+        starts, ends = starts[steps], stops[steps] - 1
+        total = lambda cum: (cum[ends] - cum[starts]).sum()
+        result.distance = total(s.cum_dist)
+        result.total_time = total(s.cum_time)
+        result.moving_time = total(s.cum_moving_time)
+        result.max_speed = np.fmax.reduce(
+                [s.max_speeds.query(i, j) for i, j in zip(starts, ends)])
+        _set_speeds(result, total(s.cum_moving_dist))
+        if s.cum_gain is not None:
+            result.elev_gain = total(s.cum_gain)
+            result.elev_loss = total(s.cum_loss)
+        return result
+        
+
+class RangeMax(object):
+    '''Maximum of any slice of an array in O(1) time.
+    
+    The array is split into blocks of *block_size* values, and a sparse
+    table holds the maximum of every run of 1, 2, 4, ... blocks. A query
+    combines two overlapping runs of whole blocks with a scan of the
+    partial blocks at each end. NaNs are ignored.
+    
+    '''
+    def __init__(s, values, block_size=64):
+        values = np.array(values, dtype=np.float64)
+        values[np.isnan(values)] = -np.inf
+        s.values = values
+        s.block_size = block_size
+        nblocks = -(-len(values) // block_size)
+        padded = np.empty(nblocks * block_size)
+        padded[:len(values)] = values
+        padded[len(values):] = -np.inf
+        s.table = [padded.reshape(nblocks, block_size).max(axis=1)]
+        width = 1
+        while width * 2 <= nblocks:
+            prev = s.table[-1]
+            s.table.append(np.maximum(prev[:-width], prev[width:]))
+            width *= 2
+            
+    def query(s, i, j):
+        '''Return the maximum of ``values[i:j]``, or NaN.'''
+        if j <= i:
+            return np.nan
+        b = s.block_size
+        first = -(-i // b)
+        last = j // b
+        if last - first < 1:
+            value = s.values[i:j].max()
+        else:
+            level = int(np.log2(last - first))
+            value = max(s.table[level][first],
+                        s.table[level][last - 2 ** level])
+            if i < first * b:
+                value = max(value, s.values[i:first * b].max())
+            if j > last * b:
+                value = max(value, s.values[last * b:j].max())
+        if value == -np.inf:
+            return np.nan
+        return value
+        
+    
+def index_runs(indices):
+    '''Split sorted point indices into runs of consecutive points.
+
+    Returns: tuple (starts, stops) of arrays of the first index of each run
+    and one past its last, as for :meth:`SelectionStats.query_runs`.
+
+    '''
+    indices = np.asarray(indices, dtype=np.int64)
+    if not len(indices):
+        return indices, indices
+    breaks = np.flatnonzero(np.diff(indices) > 1) + 1
+    starts = indices[np.r_[0, breaks]]
+    stops = indices[np.r_[breaks - 1, len(indices) - 1]] + 1
+    return starts, stops
+
+
+def _steps(times, lons, lats, geodesic, moving_speed):
+    '''Return arrays of step durations, distances and speeds, and a 0/1
+    array flagging moving steps.'''
+    if geodesic is None:
+        geodesic = core.geodesic(lons, lats)
+    # fmax turns both NaNs and negative durations into zeros.
+    dtimes = np.subtract(times[1:], times[:-1])
+    np.fmax(dtimes, 0, out=dtimes)
+    dists = np.fmax(geodesic.distances[1:], 0)
+    # Speeds are zero where there is no duration.
+    speeds = np.array(dtimes)
+    speeds[speeds == 0] = np.inf
+    np.divide(dists, speeds, out=speeds)
+    moving = np.greater(speeds, moving_speed, out=np.empty_like(speeds))
+    return dtimes, dists, speeds, moving
+
+
+def _set_speeds(result, moving_distance):
+    result.stopped_time = result.total_time - result.moving_time
+    if result.total_time:
+        result.avg_speed = result.distance / result.total_time
+    if result.moving_time:
+        result.moving_speed = moving_distance / result.moving_time
+
+
+def _cumsum(steps):
+    '''Return cumulative sums of step values with a leading zero.'''
+    cum = np.empty(len(steps) + 1)
+    cum[0] = 0
+    np.cumsum(steps, out=cum[1:])
+    return cum
+
+
+def _nanmin(arr):
+    # Much quicker than np.nanmin when there are no NaNs.
+    value = arr.min()
+    if np.isnan(value):
+        value = np.nanmin(arr)
+    return value
+
+
+def _nanmax(arr):
+    value = arr.max()
+    if np.isnan(value):
+        value = np.nanmax(arr)
+    return value
+
+
+def _format_duration(seconds):
+    if not np.isfinite(seconds):
+        return '-'
+    return str(datetime.timedelta(seconds=int(seconds)))
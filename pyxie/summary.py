@@ -0,0 +1,235 @@
+'''Persistent store of short summaries of track files.
+
+A summary holds what is needed to describe a track in a file list without
+opening it: the number of points, the time span, the distance, the
+bounding box, and a polyline of a few points for drawing a thumbnail.
+Summaries are kept in one SQLite database, ``summaries.sqlite`` under
+:data:`pyxie.config.data_dir`, keyed by absolute path, and are stale once
+the file's modification time or size changes. Files which could not be
+summarised are recorded the same way, so they are not read again until
+they change.
+
+Usage::
+
+    >>> from pyxie import summary
+    >>> store = summary.SummaryStore()
+    >>> s = store.load('track.gpx')
+    >>> s.npoints, s.distance
+
+'''
+import collections
+import logging
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+from pyxie.config import data_dir
+from pyxie import core
+from pyxie import decimate
+from pyxie import io
+
+
+logger = logging.getLogger(__name__)
+
+DB_FILENAME = os.path.join(data_dir, 'summaries.sqlite')
+
+# Bump to invalidate stored summaries when what they hold changes.
+SUMMARY_VERSION = 1
+
+# Number of points in the thumbnail polyline.
+POLYLINE_POINTS = 32
+
+# Result of summarise(): number of points, first and last times (seconds
+# since the epoch, or NaN), length in metres, (min lon, min lat, max lon,
+# max lat), and an (N, 2) array of the lons and lats of a simplified
+# version of the track with N at most POLYLINE_POINTS.
+Summary = collections.namedtuple('Summary', (
+        'npoints', 'tmin', 'tmax', 'distance', 'bounds', 'polyline'))
+
+
+class SummaryError(Exception):
+    '''Raised for a file which could not be summarised.'''
+    pass
+
+
+class SummaryStore(object):
+    '''SQLite-backed store of :class:`Summary` tuples by filename.
+
+    Args:
+        - *filename*: database file; created if necessary.
+
+    A store can be used from several threads; each gets its own connection.
+
+    '''
+    def __init__(self, filename=DB_FILENAME):
+        self.filename = filename
+        self._local = threading.local()
+        self._connection().execute(
+                'CREATE TABLE IF NOT EXISTS summaries ('
+                'path TEXT PRIMARY KEY, mtime REAL, size INTEGER, '
+                'version INTEGER, npoints INTEGER, tmin REAL, tmax REAL, '
+                'distance REAL, lon0 REAL, lat0 REAL, lon1 REAL, lat1 REAL, '
+                'polyline BLOB)')
+        self._connection().execute(
+                'CREATE TABLE IF NOT EXISTS failures ('
+                'path TEXT PRIMARY KEY, mtime REAL, size INTEGER, '
+                'version INTEGER, message TEXT)')
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.filename)
+            self._local.connection = connection
+        return connection
+
+    def get(self, path):
+        '''Return the stored summary of *path*, or None if there is none or
+        it is stale.'''
+        path = os.path.abspath(path)
+        row = self._connection().execute(
+                'SELECT mtime, size, version, npoints, tmin, tmax, distance, '
+                'lon0, lat0, lon1, lat1, polyline FROM summaries '
+                'WHERE path = ?', (path, )).fetchone()
+        if row is None:
+            return None
+        st = os.stat(path)
+        if tuple(row[:3]) != (st.st_mtime, st.st_size, SUMMARY_VERSION):
+            return None
+        polyline = np.frombuffer(row[11], dtype=np.float32).reshape(-1, 2)
+        return Summary(row[3], _from_db(row[4]), _from_db(row[5]), row[6],
+                       tuple(_from_db(value) for value in row[7:11]),
+                       polyline)
+
+    def put(self, path, summary):
+        '''Store *summary* for the current state of *path*.'''
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        polyline = np.ascontiguousarray(summary.polyline, dtype=np.float32)
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                    'INSERT OR REPLACE INTO summaries VALUES '
+                    '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    [path, st.st_mtime, st.st_size, SUMMARY_VERSION,
+                     int(summary.npoints), _to_db(summary.tmin),
+                     _to_db(summary.tmax), float(summary.distance)]
+                    + [_to_db(value) for value in summary.bounds]
+                    + [sqlite3.Binary(polyline.tostring())])
+            connection.execute('DELETE FROM failures WHERE path = ?',
+                               (path, ))
+
+    def get_failure(self, path):
+        '''Return the error message recorded for the current state of
+        *path*, or None if it has not failed since it last changed.'''
+        path = os.path.abspath(path)
+        row = self._connection().execute(
+                'SELECT mtime, size, version, message FROM failures '
+                'WHERE path = ?', (path, )).fetchone()
+        if row is None:
+            return None
+        st = os.stat(path)
+        if tuple(row[:3]) != (st.st_mtime, st.st_size, SUMMARY_VERSION):
+            return None
+        return row[3]
+
+    def put_failure(self, path, message):
+        '''Record that the current state of *path* could not be
+        summarised.'''
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                    'INSERT OR REPLACE INTO failures VALUES (?, ?, ?, ?, ?)',
+                    (path, st.st_mtime, st.st_size, SUMMARY_VERSION,
+                     message))
+
+    def load(self, path, reader=io.read_track):
+        '''Return the summary of *path*, reading the file with *reader* and
+        storing the summary if there is no current one.
+
+        The default reader does not go through the parse cache, which is
+        kept for the files opened in the editor. A file which fails to
+        read is recorded with :meth:`put_failure`, and raises
+        :class:`SummaryError` without being read again until it changes.
+
+        '''
+        result = self.get(path)
+        if result is None:
+            message = self.get_failure(path)
+            if message is not None:
+                raise SummaryError(message)
+            logger.debug('Summarising %s' % path)
+            try:
+                result = summarise(reader(path))
+            except Exception as e:
+                message = '%s: %s' % (e.__class__.__name__, e)
+                self.put_failure(path, message)
+                raise SummaryError(message)
+            self.put(path, result)
+        return result
+
+    def remove(self, paths):
+        '''Remove the summaries of a list of files.'''
+        rows = [(os.path.abspath(path), ) for path in paths]
+        connection = self._connection()
+        with connection:
+            for table in ('summaries', 'failures'):
+                connection.executemany(
+                        'DELETE FROM %s WHERE path = ?' % table, rows)
+
+    def remove_missing(self):
+        '''Remove the summaries of files which no longer exist.'''
+        connection = self._connection()
+        paths = [row[0] for row in connection.execute(
+                'SELECT path FROM summaries UNION SELECT path FROM failures')]
+        missing = [path for path in paths if not os.path.isfile(path)]
+        self.remove(missing)
+        return len(missing)
+
+
+def summarise(coords, npoints=POLYLINE_POINTS):
+    '''Return a :class:`Summary` of a track.
+
+    Args:
+        - *coords*: array from :func:`pyxie.io.read_track`.
+        - *npoints*: maximum number of points in the polyline.
+
+    '''
+    times, lons, lats = coords[:, 0], coords[:, 1], coords[:, 2]
+    geodesic = core.geodesic(lons, lats)
+    valid = ~(np.isnan(lons) | np.isnan(lats))
+    if valid.any():
+        bounds = (lons[valid].min(), lats[valid].min(),
+                  lons[valid].max(), lats[valid].max())
+    else:
+        bounds = (np.nan, ) * 4
+    if (~np.isnan(times)).any():
+        tmin, tmax = np.nanmin(times), np.nanmax(times)
+    else:
+        tmin = tmax = np.nan
+    # The most important points of the track in Douglas-Peucker order,
+    # with longitudes scaled so that the shape is not stretched.
+    x_scale = np.cos(np.radians(np.mean(bounds[1::2]))) if valid.any() else 1.
+    vlons = lons[valid] * x_scale
+    importance = decimate.douglas_peucker_importance(vlons, lats[valid])
+    keep = np.sort(np.argsort(-importance, kind='mergesort')[:npoints])
+    polyline = np.column_stack([lons[valid][keep], lats[valid][keep]])
+    return Summary(len(coords), tmin, tmax, np.nansum(geodesic.distances),
+                   bounds, polyline)
+
+
+def _to_db(value):
+    # SQLite stores NaN as NULL.
+    value = float(value)
+    if np.isnan(value):
+        return None
+    return value
+
+
+def _from_db(value):
+    if value is None:
+        return np.nan
+    return value
@@ -0,0 +1,398 @@
+'''Keep a track archive in sync with a folder of track files.
+
+:class:`Watcher` keeps a manifest of the size, modification time and
+content hash of every track file under a folder, saved as
+``manifest.json`` in the archive folder. Each :meth:`Watcher.sync` finds
+the files which are new, changed or deleted since the last one, and
+re-imports only those into the archive (see
+:func:`pyxie.archive.update_archive`) and the summary store (see
+:mod:`pyxie.summary`). A file whose modification time changed but whose
+contents did not is not re-imported.
+
+Changes are found by scanning the folder with ``scandir`` (one ``stat``
+per file and no parsing), or, when ``pyinotify`` is installed, from
+inotify events, in which case only the files named in the events are
+looked at. :meth:`Watcher.start` runs the watcher in a background thread.
+
+Usage::
+
+    >>> from pyxie import watcher
+    >>> w = watcher.Watcher('~/Dropbox/tracks', 'tracks.archive')
+    >>> w.sync()
+    Changes(added=[...], changed=[], removed=[])
+    >>> w.start(interval=60)
+
+or from the command line::
+
+    $ pyxie-watch ~/Dropbox/tracks tracks.archive
+
+'''
+import argparse
+import collections
+import fnmatch
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+from pyxie import archive
+from pyxie import io
+from pyxie import summary
+
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+
+# Lists of filenames found by Watcher.sync().
+Changes = collections.namedtuple('Changes', ('added', 'changed', 'removed'))
+
+
+class Watcher(object):
+    '''Keeps a track archive up to date with the files under a folder.
+
+    Args:
+        - *root*: folder to watch.
+        - *archive_path*: archive folder, created on the first sync.
+        - *pattern*: glob pattern of the track filenames.
+        - *summary_store*: :class:`pyxie.summary.SummaryStore` to update, or
+          None to leave summaries alone.
+        - *processes*: number of processes to parse files with, as for
+          :func:`pyxie.io.import_files`.
+        - *owner*: owner of the points, as for
+          :func:`pyxie.io.import_files`.
+
+    '''
+    def __init__(self, root, archive_path, pattern='*.gpx',
+                 summary_store=None, processes=None, owner=None):
+        self.root = os.path.abspath(os.path.expanduser(root))
+        self.archive_path = archive_path
+        self.pattern = pattern
+        self.summary_store = summary_store
+        self.processes = processes
+        self.owner = owner
+        self.manifest_fn = os.path.join(archive_path, 'manifest.json')
+        self.manifest = self.load_manifest()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def load_manifest(self):
+        '''Return the saved manifest: a dict of [size, mtime, hash] lists
+        keyed by filename.
+
+        An archive created by :func:`pyxie.io.import_files` has no manifest.
+        Its sources that have not been modified since the archive was
+        written are then taken to be current, and will be hashed (but not
+        re-imported) on the first sync.
+
+        '''
+        if os.path.isfile(self.manifest_fn):
+            with open(self.manifest_fn, mode='r') as f:
+                data = json.load(f)
+            if data.get('version') == MANIFEST_VERSION:
+                return data['files']
+        header_fn = os.path.join(self.archive_path, 'header.json')
+        if not os.path.isfile(header_fn):
+            return {}
+        written = os.path.getmtime(header_fn)
+        with open(header_fn, mode='r') as f:
+            sources = json.load(f)['sources']
+        manifest = {}
+        for source in sources:
+            try:
+                st = os.stat(source)
+            except OSError:
+                manifest[source] = [None, None, None]
+                continue
+            if st.st_mtime < written:
+                manifest[source] = [st.st_size, st.st_mtime, None]
+            else:
+                manifest[source] = [None, None, None]
+        return manifest
+
+    def save_manifest(self):
+        tmp_fn = self.manifest_fn + '.tmp'
+        with open(tmp_fn, mode='w') as f:
+            json.dump({'version': MANIFEST_VERSION, 'root': self.root,
+                       'files': self.manifest}, f)
+        if os.path.isfile(self.manifest_fn):
+            os.remove(self.manifest_fn)
+        os.rename(tmp_fn, self.manifest_fn)
+
+    def scan(self):
+        '''Return a dict of (size, mtime) tuples for the track files under
+        the root folder.'''
+        return dict((path, (st.st_size, st.st_mtime)) for path, st
+                    in scan_tree(self.root, self.pattern))
+
+    def find_changes(self, paths=None):
+        '''Compare the files on disk with the manifest.
+
+        Args:
+            - *paths*: filenames to check. By default the whole root folder
+              is scanned, and files in the manifest not found are removed.
+
+        Returns: tuple (:data:`Changes`, dict of new manifest entries).
+
+        '''
+        if paths is None:
+            current = self.scan()
+            missing = set(self.manifest) - set(current)
+        else:
+            current = {}
+            missing = set()
+            for path in paths:
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    if path in self.manifest:
+                        missing.add(path)
+                    continue
+                if fnmatch.fnmatch(os.path.basename(path), self.pattern):
+                    current[path] = (st.st_size, st.st_mtime)
+        added = []
+        changed = []
+        entries = {}
+        for path, (size, mtime) in current.items():
+            old = self.manifest.get(path)
+            if old is not None and old[:2] == [size, mtime] and old[2]:
+                continue
+            try:
+                digest = file_hash(path)
+            except IOError:
+                continue
+            entries[path] = [size, mtime, digest]
+            if old is None:
+                added.append(path)
+            elif old[2] != digest and (old[2] or old[:2] != [size, mtime]):
+                changed.append(path)
+        return Changes(sorted(added), sorted(changed), sorted(missing)), entries
+
+    def sync(self, paths=None, progress=None):
+        '''Re-import new and changed files and drop deleted ones.
+
+        Args:
+            - *paths*: as for :meth:`find_changes`.
+            - *progress*: as for :func:`pyxie.io.import_files`.
+
+        Returns: :data:`Changes`.
+
+        '''
+        changes, entries = self.find_changes(paths)
+        fns = changes.added + changes.changed
+        if fns or changes.removed:
+            logger.info('%s: %d new, %d changed, %d removed' % (
+                    self.root, len(changes.added), len(changes.changed),
+                    len(changes.removed)))
+            tracks, errors, owners = parse_files(fns, self.processes, progress)
+            for fn in tracks:
+                owners.setdefault(fn, self.owner)
+            archive.update_archive(self.archive_path, tracks,
+                                   removed=changes.removed, errors=errors,
+                                   owners=owners)
+            if self.summary_store is not None:
+                for fn in tracks:
+                    self.summary_store.put(fn, summary.summarise(tracks[fn]))
+                for fn in errors:
+                    self.summary_store.put_failure(fn, errors[fn])
+                self.summary_store.remove(changes.removed)
+        for path in changes.removed:
+            del self.manifest[path]
+        self.manifest.update(entries)
+        if entries or changes.removed or not os.path.isfile(self.manifest_fn):
+            if not os.path.isdir(self.archive_path):
+                archive.update_archive(self.archive_path, {})
+            self.save_manifest()
+        return changes
+
+    def watch(self, interval=60., callback=None, rescan_interval=3600.):
+        '''Sync whenever files change, until :meth:`stop` is called.
+
+        With pyinotify, changes are picked up within a second or so of
+        being written, and only the files named in the events are looked
+        at; the whole folder is still rescanned every *rescan_interval*
+        seconds, to catch any events that were missed. Otherwise the folder
+        is rescanned every *interval* seconds. *callback* is called with
+        the :data:`Changes` after each sync which found any.
+
+        '''
+        def report(changes):
+            if callback is not None and any(changes):
+                callback(changes)
+
+        report(self.sync())
+        if pyinotify is None:
+            while not self._stop.wait(interval):
+                report(self.sync())
+            return
+
+        paths = set()
+
+        class Handler(pyinotify.ProcessEvent):
+            def process_default(self, event):
+                paths.add(event.pathname)
+
+        manager = pyinotify.WatchManager()
+        notifier = pyinotify.Notifier(manager, Handler(), timeout=1000)
+        mask = (pyinotify.IN_CLOSE_WRITE | pyinotify.IN_DELETE
+                | pyinotify.IN_MOVED_TO | pyinotify.IN_MOVED_FROM)
+        manager.add_watch(self.root, mask, rec=True, auto_add=True)
+        last_scan = time.time()
+        try:
+            while not self._stop.is_set():
+                if notifier.check_events():
+                    notifier.read_events()
+                    notifier.process_events()
+                    # Wait for a burst of events (e.g. a folder being
+                    # copied in) to finish before syncing.
+                    continue
+                if paths:
+                    changed = list(paths)
+                    paths.clear()
+                    report(self.sync(paths=changed))
+                if time.time() - last_scan > rescan_interval:
+                    # Catch anything inotify missed, e.g. events dropped
+                    # when its queue overflowed.
+                    report(self.sync())
+                    last_scan = time.time()
+        finally:
+            notifier.stop()
+
+    def start(self, interval=60., callback=None, rescan_interval=3600.):
+        '''Run :meth:`watch` in a background thread.'''
+        self._stop.clear()
+        self._thread = threading.Thread(
+                target=self.watch, args=(interval, callback, rescan_interval))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        '''Stop the background thread started by :meth:`start`.'''
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def scan_tree(root, pattern='*.gpx'):
+    '''Yield (filename, stat result) for the files under *root* whose names
+    match *pattern*, using scandir when it is available.'''
+    if scandir is None:
+        for dirpath, dirnames, filenames in os.walk(root):
+            for fn in fnmatch.filter(filenames, pattern):
+                path = os.path.join(dirpath, fn)
+                yield path, os.stat(path)
+        return
+    folders = [root]
+    while folders:
+        folder = folders.pop()
+        try:
+            entries = list(scandir(folder))
+        except OSError:
+            logger.warning('Cannot scan %s' % folder)
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                folders.append(entry.path)
+            elif fnmatch.fnmatch(entry.name, pattern):
+                yield entry.path, entry.stat()
+
+
+def file_hash(path, block_size=1 << 20):
+    '''Return the SHA-1 hex digest of the contents of a file.'''
+    digest = hashlib.sha1()
+    with open(path, mode='rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def parse_files(fns, processes=None, progress=None):
+    '''Parse track files, in a process pool if there are several.
+
+    Returns: tuple (dict of coordinate arrays, dict of error messages, dict
+    of arrays of owner names from CSV owner columns), all keyed by filename.
+
+    '''
+    tracks = {}
+    errors = {}
+    owners = {}
+    results = io.iter_parse_files(fns, processes=processes)
+    for n_done, (i, coords, owner, error) in enumerate(results):
+        if error is None:
+            tracks[fns[i]] = coords
+            if owner is not None:
+                owners[fns[i]] = owner
+        else:
+            logger.warning('Skipping %s: %s' % (fns[i], error))
+            errors[fns[i]] = error
+        if progress:
+            progress(n_done + 1, len(fns), fns[i], error)
+    return tracks, errors, owners
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+            description='Keep a pyxie track archive in sync with a folder of '
+                        'track files.',
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('root', help='folder to watch')
+    parser.add_argument('archive', help='archive folder')
+    parser.add_argument('-p', '--pattern', default='*.gpx',
+                        help='pattern of track filenames')
+    parser.add_argument('-i', '--interval', type=float, default=60.,
+                        help='seconds between rescans without inotify')
+    parser.add_argument('--rescan-interval', type=float, default=3600.,
+                        help='seconds between rescans with inotify')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='number of parsing processes (default: one per '
+                             'CPU)')
+    parser.add_argument('--once', action='store_true',
+                        help='sync once and exit')
+    parser.add_argument('--no-summaries', action='store_true',
+                        help='do not update the file summaries')
+    parser.add_argument('--owner', default=None,
+                        help='owner of the points, except for CSV files with '
+                             'an owner column')
+    return parser
+
+
+def main():
+    args = get_parser().parse_args(sys.argv[1:])
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
+                        level=logging.INFO)
+    store = None if args.no_summaries else summary.SummaryStore()
+    w = Watcher(args.root, args.archive, pattern=args.pattern,
+                summary_store=store, processes=args.processes,
+                owner=args.owner)
+    if args.once:
+        print(w.sync())
+        return
+    try:
+        w.watch(interval=args.interval,
+                rescan_interval=args.rescan_interval)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,5 @@
 '''Miscellaneous routines for getting coordinate data out of GPX and KML files.'''
 import datetime
-import time
 try:
     import cStringIO as StringIO
 except ImportError:
@@ -34,7 +33,8 @@ class GPXTrackpoint(Element):
     
     Attributes:
         - *lat, lon, elev*: floats
-        - *datetime*: datetime object
+        - *time*: seconds since the epoch (UTC), or NaN
+        - *datetime*: naive UTC datetime object, or None
         
     '''
     name = 'trkpt'
@@ -55,17 +55,13 @@ class GPXTrackpoint(Element):
 
     @property
     def datetime(self):
-        for echild in self.elem:
-            if echild.tag.endswith('time'):
-                return datetime.datetime.strptime(
-                        echild.text[:19], '%Y-%m-%dT%H:%M:%S')
+        epoch = self.time
+        if not np.isnan(epoch):
+            return datetime.datetime.utcfromtimestamp(epoch)
                         
     @property
     def time(self):
-        if self.datetime:
-            return time.mktime(self.datetime.timetuple())
-        else:
-            return np.nan
+        return _element_time(self.elem)
 
 
 
@@ -74,7 +70,7 @@ class GPXWaypoint(Element):
     
     Attributes:
         - *lat, lon, elev*: floats
-        - *datetime*: datetime object
+        - *datetime*: naive UTC datetime object, or None
         
     '''
     name = 'wpt'
@@ -95,10 +91,9 @@ class GPXWaypoint(Element):
 
     @property
     def datetime(self):
-        for echild in self.elem:
-            if echild.tag.endswith('time'):
-                return datetime.datetime.strptime(
-                        echild.text[:19], '%Y-%m-%dT%H:%M:%S')
+        epoch = _element_time(self.elem)
+        if not np.isnan(epoch):
+            return datetime.datetime.utcfromtimestamp(epoch)
 
     @property
     def name(self):
@@ -112,38 +107,191 @@ class KMLcoordinates(Element):
     '''Wrapper for KML coordinates elements.
     
     Attributes:
-        - *lat, lon, elev*: floats
-        - *datetime*: datetime object
+        - *array*: (N, 3) array of lons, lats and elevations, parsed once
+          with :func:`kml_coordinates`
+        - *lat, lon, elev*: arrays
 
     '''
     name = 'coordinates'
     
     @property
     def array(self):
-        txt = self.elem.text.replace(' ', '\n')
-        rows = txt.splitlines()
-        arr = []
-        for row in rows:
-            row = row.strip()
-            if not row:
-                continue
-            items = map(float, row.split(','))
-            arr.append(items)
-        return arr
+        if not hasattr(self, '_array'):
+            self._array = kml_coordinates(self.elem.text)
+        return self._array
     
     @property
     def lon(self):
-        return [row[0] for row in self.array]
+        return self.array[:, 0]
     
     @property
     def lat(self):
-        return [row[1] for row in self.array]
+        return self.array[:, 1]
         
+    @property
     def elev(self):
-        return [row[2] for row in self.array]
-                        
+        return self.array[:, 2]
+
+
+def kml_coordinates(text):
+    '''Parse the text of a KML coordinates element.
+
+    Args:
+        - *text*: whitespace-separated tuples ``lon,lat[,alt]``.
+
+    Returns: (N, 3) float64 array of lons, lats and altitudes, with NaN for
+    missing altitudes.
+
+    The text is converted in one call to ``np.fromstring``. Only when some
+    tuples have an altitude and others do not are the tuples handled one
+    by one.
+
+    '''
+    text = text or ''
+    tuples = text.split()
+    n = len(tuples)
+    commas = text.count(',')
+    if commas == 2 * n:
+        values = np.fromstring(text.replace(',', ' '), sep=' ')
+    elif commas == n:
+        values = np.fromstring(text.replace(',', ' '), sep=' ')
+        if len(values) == 2 * n:
+            values = np.column_stack([values.reshape(n, 2), np.full(n, np.nan)])
+    else:
+        tuples = [t if t.count(',') == 2 else t + ',nan' for t in tuples]
+        values = np.fromstring(' '.join(tuples).replace(',', ' '), sep=' ')
+    if values.size != 3 * n:
+        raise ValueError('Cannot parse KML coordinates %r' % text[:80])
+    return values.reshape(n, 3)
+
+
+def kml_track_coords(texts):
+    '''Parse the texts of the ``gx:coord`` elements of a KML ``gx:Track``.
+
+    Args:
+        - *texts*: sequence of strings ``lon lat [alt]``.
+
+    Returns: (N, 3) float64 array of lons, lats and altitudes, with NaN for
+    missing altitudes.
+
+    '''
+    n = len(texts)
+    values = np.fromstring(' '.join(t or '' for t in texts), sep=' ')
+    if values.size == 2 * n:
+        return np.column_stack([values.reshape(n, 2), np.full(n, np.nan)])
+    if values.size != 3 * n:
+        raise ValueError('Cannot parse gx:coord elements')
+    return values.reshape(n, 3)
                         
                         
+def iso8601_to_epoch(texts):
+    '''Convert ISO 8601 timestamps to seconds since the epoch.
+
+    Args:
+        - *texts*: sequence of strings like ``2013-08-08T06:06:04Z``,
+          ``2013-08-08T16:06:04.250+10:00`` or ``2013-08-08T06:06:04``
+          (taken as UTC). Empty strings and None are allowed. A single byte
+          string is split on whitespace into timestamps, and a numpy byte
+          string array is used as it is.
+
+    Returns: float64 numpy array of seconds since 1970-01-01 UTC, with NaN
+    wherever a timestamp was missing.
+
+    The date and time of day are converted by numpy's ``datetime64``, and
+    the fractional seconds and UTC offset are decoded from a byte matrix of
+    the remaining characters, so there is no per-timestamp Python code.
+
+    '''
+    if isinstance(texts, bytes):
+        texts = texts.split()
+    if isinstance(texts, np.ndarray) and texts.dtype.kind == 'S':
+        strings = texts.astype('S%d' % _ISO8601_WIDTH)
+    else:
+        strings = np.array([t or '' for t in texts], dtype='S%d' % _ISO8601_WIDTH)
+    if not len(strings):
+        return np.empty(0)
+    chars = strings.view(np.uint8).reshape(len(strings), _ISO8601_WIDTH)
+    seconds = np.ascontiguousarray(chars[:, :19]).view('S19')[:, 0]
+    seconds = seconds.astype('datetime64[s]').astype(np.int64)
+    epochs = seconds.astype(np.float64)
+    epochs[seconds == np.iinfo(np.int64).min] = np.nan
+    
+    # Only timestamps with more than a 'Z' after the seconds need decoding.
+    rows = np.flatnonzero((chars[:, 19] != 0) & (chars[:, 19] != ord('Z')))
+    if len(rows):
+        epochs[rows] += _iso8601_suffix_seconds(chars[rows, 19:])
+    return epochs
+
+
+# Room for a timestamp with nanoseconds and a UTC offset.
+_ISO8601_WIDTH = 40
+
+
+def epoch_to_iso8601(epochs, decimals=None):
+    '''Convert seconds since the epoch to ISO 8601 timestamps.
+
+    Args:
+        - *epochs*: sequence of seconds since 1970-01-01 UTC, with NaN for
+          missing times.
+        - *decimals*: number of decimal places of the seconds: 0, 3, 6 or
+          9. By default 0, or 3 if any time has fractional seconds.
+
+    Returns: numpy byte string array of timestamps like
+    ``2013-08-08T06:06:04Z``, with empty strings for missing times. The
+    inverse of :func:`iso8601_to_epoch`.
+
+    '''
+    epochs = np.asarray(epochs, dtype=np.float64)
+    valid = ~np.isnan(epochs)
+    if decimals is None:
+        decimals = 0 if np.all(epochs[valid] % 1 == 0) else 3
+    unit = {0: 's', 3: 'ms', 6: 'us', 9: 'ns'}[decimals]
+    ticks = np.zeros(len(epochs), dtype=np.int64)
+    ticks[valid] = np.round(epochs[valid] * 10 ** decimals)
+    texts = np.datetime_as_string(ticks.astype('datetime64[%s]' % unit),
+                                  timezone='UTC').astype(bytes)
+    texts[~valid] = b''
+    return texts
+
+
+def _iso8601_suffix_seconds(chars):
+    '''Return the seconds to add for the fractional seconds and UTC offset
+    given in a matrix of the characters after ``YYYY-MM-DDTHH:MM:SS``.'''
+    n = len(chars)
+    width = np.flatnonzero(chars.any(axis=0))[-1] + 1
+    # Padding so that an offset can always be read after the last column.
+    suffix = np.zeros((n, width + 6), dtype=np.int32)
+    suffix[:, :width] = chars[:, :width]
+    digits = suffix - ord('0')
+    is_digit = (digits >= 0) & (digits <= 9)
+    
+    # Fractional seconds: a run of digits after a '.' or ','.
+    has_fraction = (suffix[:, 0] == ord('.')) | (suffix[:, 0] == ord(','))
+    in_fraction = np.cumprod(is_digit[:, 1:], axis=1)
+    in_fraction[~has_fraction] = 0
+    scales = 0.1 ** np.arange(1, suffix.shape[1])
+    seconds = np.dot(digits[:, 1:] * in_fraction, scales)
+    
+    # UTC offset: '+' or '-' followed by hh, hh:mm or hhmm.
+    rows = np.arange(n)
+    sign_col = np.where(has_fraction, in_fraction.sum(axis=1) + 1, 0)
+    sign = suffix[rows, sign_col]
+    signs = np.where(sign == ord('+'), 1, np.where(sign == ord('-'), -1, 0))
+    hours = digits[rows, sign_col + 1] * 10 + digits[rows, sign_col + 2]
+    minute_col = sign_col + 3 + (suffix[rows, sign_col + 3] == ord(':'))
+    has_minutes = is_digit[rows, minute_col] & is_digit[rows, minute_col + 1]
+    minutes = (digits[rows, minute_col] * 10 + digits[rows, minute_col + 1])
+    seconds -= signs * (hours * 3600 + minutes * has_minutes * 60)
+    return seconds
+
+
+def _element_time(elem):
+    for echild in elem:
+        if echild.tag.endswith('time'):
+            return iso8601_to_epoch([(echild.text or '').strip()])[0]
+    return np.nan
+
+
 def iterparse(source, cls=GPXTrackpoint, **kwargs):
     '''Iterate over *cls* elements in *source* file object.
     
@@ -8,7 +8,10 @@ except ImportError:
     
 setup(name='pyxie',
       entry_points={'console_scripts': [
-                        'pyxie-trackeditor = pyxie.gui.trackeditor:main'
+                        'pyxie-trackeditor = pyxie.gui.trackeditor:main',
+                        'pyxie-import = pyxie.io:main',
+                        'pyxie-watch = pyxie.watcher:main',
+                        'pyxie-split = pyxie.io:split_main',
                         ],
                     },
       )
@@ -0,0 +1,217 @@
+import numpy as np
+
+from pyxie import archive
+
+
+def write_archive(path, tracks, **kws):
+    '''Write an archive of a list of (source, coords) pairs.'''
+    writer = archive.ArchiveWriter(str(path), [source for source, coords in tracks],
+                                   **kws)
+    for track_id, (source, coords) in enumerate(tracks):
+        writer.add(track_id, coords)
+    writer.close()
+    return archive.Archive(str(path))
+
+
+def test_spatial_queries_without_positions(tmpdir):
+    coords = np.full((5, 4), np.nan)
+    coords[:, 0] = np.arange(5)
+    a = write_archive(tmpdir.join('arch'), [('a.csv', coords)])
+    positions, track_ids = a.query_bbox(-180, -90, 180, 90)
+    assert len(positions) == 0 and len(track_ids) == 0
+    positions, distances = a.nearest_points(138.6, -35.)
+    assert len(positions) == 0
+    assert len(a.tracks_through(138.6, -35.)) == 0
+
+
+def random_coords(rng, n, t0):
+    coords = np.empty((n, 4))
+    coords[:, 0] = t0 + np.cumsum(rng.choice([0., 1., 2.], n))
+    coords[:, 1] = 138.6 + rng.rand(n)
+    coords[:, 2] = -35. + rng.rand(n)
+    coords[:, 3] = rng.rand(n)
+    coords[rng.rand(n) < 0.05, 0] = np.nan
+    return coords
+
+
+def track_points(a, source):
+    '''Return the sorted rows of a source's points, with owner names.'''
+    columns = a.get_track(source)
+    rows = [tuple(row) for row in archive.columns_to_coords(columns)]
+    return sorted(zip([repr(row) for row in rows], a.owner_names(columns)))
+
+
+def assert_same_tracks(a, b):
+    assert sorted(a.sources) == sorted(b.sources)
+    assert a.header['errors'] == b.header['errors']
+    for source in a.sources:
+        assert track_points(a, source) == track_points(b, source), source
+        ra = a.tracks[a.track_id(source)]
+        rb = b.tracks[b.track_id(source)]
+        assert ra['npoints'] == rb['npoints']
+        assert np.allclose([ra['tmin'], ra['tmax']], [rb['tmin'], rb['tmax']],
+                           equal_nan=True)
+    assert len(a) == len(b)
+    assert np.all(np.diff(a.time[~np.isnan(a.time)]) >= 0)
+
+
+def test_update_matches_fresh_archive(tmpdir):
+    rng = np.random.RandomState(0)
+    base = random_coords(rng, 300, 1e9)
+    tracks = {
+        'a.gpx': base[:200],
+        'b.gpx': np.concatenate([base[150:], random_coords(rng, 50, 1e9)]),
+        'c.gpx': base[:200].copy(),
+        'd.gpx': random_coords(rng, 100, 2e9),
+        'e.gpx': base[50:120].copy(),
+    }
+    owners = {'d.gpx': np.array(['x', 'y'] * 50)}
+    archive.update_archive(str(tmpdir.join('arch')), tracks, owners=owners,
+                           errors={'f.gpx': 'ValueError: bad'})
+
+    changes = {
+        # a stores points that c and e share, and b overlaps it.
+        'a.gpx': random_coords(rng, 80, 1e9),
+        'g.gpx': np.concatenate([base[100:160], random_coords(rng, 30, 3e9)]),
+        'f.gpx': base[250:].copy(),
+    }
+    updated = archive.update_archive(str(tmpdir.join('arch')), changes,
+                                     removed=['d.gpx'],
+                                     errors={'h.gpx': 'IOError: gone'})
+    expected_tracks = dict(tracks)
+    del expected_tracks['d.gpx']
+    expected_tracks.update(changes)
+    sources = sorted(expected_tracks) + ['h.gpx']
+    writer = archive.ArchiveWriter(str(tmpdir.join('fresh')), sources)
+    for source, coords in expected_tracks.items():
+        writer.add(sources.index(source), coords)
+    writer.add_error(sources.index('h.gpx'), 'IOError: gone')
+    writer.close()
+    fresh = archive.Archive(str(tmpdir.join('fresh')))
+    assert_same_tracks(updated, fresh)
+    assert len(updated.refs) == len(fresh.refs)
+    assert 'x' in updated.owners
+
+    # Removing everything else leaves the tracks which shared a's points.
+    updated = archive.update_archive(str(tmpdir.join('arch')), {},
+                                     removed=['a.gpx', 'b.gpx', 'f.gpx',
+                                              'g.gpx', 'h.gpx'])
+    assert updated.sources == ['c.gpx', 'e.gpx']
+    fresh = write_archive(tmpdir.join('fresh2'),
+                          [(source, tracks[source]) for source in updated.sources])
+    assert_same_tracks(updated, fresh)
+    assert len(updated.refs) == len(fresh.refs)
+
+
+def test_update_empty_archive(tmpdir):
+    path = str(tmpdir.join('arch'))
+    archive.update_archive(path, {}, errors={'a.gpx': 'ValueError: bad'})
+    coords = random_coords(np.random.RandomState(1), 10, 1e9)
+    a = archive.update_archive(path, {'b.gpx': coords})
+    assert a.sources == ['a.gpx', 'b.gpx']
+    assert len(a) == 10
+    assert a.header['errors'] == {'a.gpx': 'ValueError: bad'}
+    a = archive.update_archive(path, {}, removed=['a.gpx', 'b.gpx'])
+    assert a.sources == [] and len(a) == 0
+
+
+def test_shared_points():
+    points = np.array([[1., 0, 0, 0],
+                       [1., 0, 0, 0],
+                       [2., 1, 1, 1],
+                       [1., 0, 0, 0],
+                       [2., 1, 1, 2],
+                       [2., 1, 1, 1]])
+    track_ids = np.array([2, 0, 0, 1, 1, 1])
+    order = np.argsort(points[:, 0], kind='mergesort')
+    copies, owners = archive.shared_points(points, order, track_ids)
+    pairs = sorted(zip(order[copies], order[owners]))
+    # Point 1 of track 0 is shared by tracks 1 and 2, and point 2 by 1.
+    assert pairs == [(0, 1), (3, 1), (5, 2)]
+    owner_ids = np.array([0, 0, 0, 1, 0, 0])
+    copies, owners = archive.shared_points(points, order, track_ids, owner_ids)
+    assert sorted(zip(order[copies], order[owners])) == [(0, 1), (5, 2)]
+
+
+def test_dedup_round_trip(tmpdir):
+    rng = np.random.RandomState(2)
+    base = random_coords(rng, 400, 1e9)
+    repeats = base[300:340].copy()
+    tracks = [
+        ('a.gpx', base[:250]),
+        # Overlaps a in time, sharing some points and not others.
+        ('b.gpx', np.concatenate([base[200:300], random_coords(rng, 60, 1e9)])),
+        # Identical to a.
+        ('c.gpx', base[:250].copy()),
+        # Repeats points within itself and shares some with b.
+        ('d.gpx', np.concatenate([repeats, repeats, base[280:290]])),
+        ('e.gpx', np.empty((0, 4))),
+    ]
+    a = write_archive(tmpdir.join('arch'), tracks)
+    plain = write_archive(tmpdir.join('plain'), tracks, dedup=False)
+    assert a.header['duplicates'] == {'c.gpx': 'a.gpx'}
+    assert len(a) < len(plain) == sum(len(coords) for source, coords in tracks)
+    assert np.all(np.diff(a.refs['track']) >= 0)
+    for source, coords in tracks:
+        expected = sorted(repr(tuple(row)) for row in coords)
+        assert [row for row, owner in track_points(a, source)] == expected
+        assert track_points(plain, source) == track_points(a, source)
+        track_id = a.track_id(source)
+        assert a.tracks[track_id]['npoints'] == len(coords)
+        shared = a.shared_positions(track_id)
+        assert np.all(a.track[shared] != track_id)
+        assert np.all(np.diff(shared) > 0)
+    assert a.is_contiguous(a.track_id('e.gpx'))
+    assert not a.is_contiguous(a.track_id('c.gpx'))
+
+    # Removing the tracks which store the shared points leaves the others
+    # as they were.
+    path = str(tmpdir.join('arch'))
+    for removed in (['a.gpx'], ['b.gpx', 'c.gpx']):
+        a = archive.update_archive(path, {}, removed=removed)
+        for source, coords in tracks:
+            if source in a.sources:
+                expected = sorted(repr(tuple(row)) for row in coords)
+                assert [row for row, owner in track_points(a, source)] == \
+                    expected
+                assert np.all(a.track[a.shared_positions(
+                        a.track_id(source))] != a.track_id(source))
+    assert a.sources == ['d.gpx', 'e.gpx']
+    assert len(a) == 90
+    assert len(a.refs) == 0
+
+
+def test_time_range(tmpdir):
+    times = np.r_[np.arange(10000) * 2., np.nan, np.nan]
+    coords = np.zeros((len(times), 4))
+    coords[:, 0] = times
+    a = write_archive(tmpdir.join('arch'), [('a.csv', coords[:6000]),
+                                            ('b.csv', coords[6000:])])
+    valid = times[~np.isnan(times)]
+    queries = [(10, 20), (11, 11.5), (archive.BLOCK_SIZE * 2 - 10,
+                                      archive.BLOCK_SIZE * 2 + 10),
+               (-100, -10), (-100, 5), (19990, 1e12), (1e11, 1e12),
+               (-1e12, 1e12)]
+    for start, end in queries:
+        i, j = a.time_range(start, end)
+        assert (i, j) == tuple(np.searchsorted(valid, [start, end]))
+        columns, track_ids = a.query_time(start, end)
+        assert np.array_equal(columns.time,
+                              valid[(valid >= start) & (valid < end)])
+        # Sources whose time span overlaps, whether or not any of their
+        # points are in the range.
+        expected = [k for k, (tmin, tmax) in enumerate([(0, 11998),
+                                                        (12000, 19998)])
+                    if tmin < end and tmax >= start]
+        assert list(track_ids) == expected
+
+
+def test_time_range_small_archive(tmpdir):
+    coords = np.zeros((5, 4))
+    coords[:, 0] = [1, 2, np.nan, 3, 4]
+    a = write_archive(tmpdir.join('arch'), [('a.csv', coords)])
+    assert a.time_range(0, 1e9) == (0, 4)
+    assert a.time_range(5, 1e9) == (4, 4)
+    b = write_archive(tmpdir.join('arch2'), [('a.csv', coords[[0, 1, 3, 4]])])
+    assert b.time_range(0, 1e9) == (0, 4)
+    assert b.time_range(2, 3) == (1, 2)
@@ -0,0 +1,83 @@
+import os
+
+import numpy as np
+
+from pyxie import cache
+
+
+def make_files(tmpdir, names):
+    files = []
+    for name in names:
+        fn = tmpdir.join(name)
+        fn.write(name)
+        files.append(str(fn))
+    return files
+
+
+def entry_size(arr):
+    return arr.nbytes + 128  # the .npy header
+
+
+def test_get_put(tmpdir):
+    a, = make_files(tmpdir, ['a.gpx'])
+    pc = cache.ParseCache(str(tmpdir.join('cache')), max_size=10**6)
+    arr = np.arange(40.).reshape(10, 4)
+    assert pc.get(a, 1) is None
+    np.testing.assert_array_equal(pc.put(a, 1, arr), arr)
+    np.testing.assert_array_equal(pc.get(a, 1), arr)
+    calls = []
+    def parser(fn):
+        calls.append(fn)
+        return arr * 2
+    np.testing.assert_array_equal(pc.load(a, parser, 1), arr)
+    assert calls == []
+    np.testing.assert_array_equal(pc.load(a, parser, 2), arr * 2)
+    assert calls == [a]
+    assert pc.size() == sum(os.path.getsize(fn) for fn in pc._entries())
+    pc.clear()
+    assert pc.size() == 0
+    assert pc._entries() == []
+
+
+def test_version_and_file_changes(tmpdir):
+    a, = make_files(tmpdir, ['a.gpx'])
+    pc = cache.ParseCache(str(tmpdir.join('cache')), max_size=10**6)
+    arr = np.zeros((10, 4))
+    pc.put(a, 1, arr)
+    assert pc.get(a, 2) is None
+    # Storing the new version replaces the old entry.
+    pc.put(a, 2, arr + 1)
+    assert len(pc._entries()) == 1
+    assert pc.get(a, 1) is None
+    np.testing.assert_array_equal(pc.get(a, 2), arr + 1)
+    st = os.stat(a)
+    os.utime(a, (st.st_atime, st.st_mtime + 10))
+    assert pc.get(a, 2) is None
+
+
+def test_eviction(tmpdir):
+    a, b, c = make_files(tmpdir, ['a.gpx', 'b.gpx', 'c.gpx'])
+    arr = np.zeros((10, 4))
+    size = entry_size(arr)
+    pc = cache.ParseCache(str(tmpdir.join('cache')), max_size=size * 5 // 2)
+    pc.put(a, 1, arr)
+    pc.put(b, 1, arr)
+    assert pc.size() == 2 * size
+    # Make a the least recently used, then use it so that b is.
+    os.utime(pc.entry_filename(a, 1), (1000, 1000))
+    os.utime(pc.entry_filename(b, 1), (2000, 2000))
+    assert pc.get(a, 1) is not None
+    pc.put(c, 1, arr)
+    assert pc.get(b, 1) is None
+    assert pc.get(a, 1) is not None
+    assert pc.get(c, 1) is not None
+    assert pc.size() == 2 * size
+    # A fresh cache finds the existing entries, and evicts down to a
+    # smaller limit.
+    os.utime(pc.entry_filename(c, 1), (3000, 3000))
+    pc = cache.ParseCache(str(tmpdir.join('cache')), max_size=size * 5 // 2)
+    assert pc.size() == 2 * size
+    pc.evict(size)
+    assert pc.get(c, 1) is None
+    assert pc.get(a, 1) is not None
+    assert pc.size() == size
@@ -0,0 +1,93 @@
+import math
+import threading
+
+import numpy as np
+
+from pyxie import core
+
+
+def test_transformer_per_thread():
+    functions = []
+
+    def get():
+        functions.append(core.get_transformer(4326, 32754))
+
+    threads = [threading.Thread(target=get) for k in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    get()
+    get()
+    assert functions[0] is not functions[1]
+    assert functions[2] is functions[3]
+    assert functions[2] is not functions[0]
+
+
+def test_convert_coordinate_system_in_threads():
+    rng = np.random.RandomState(0)
+    lons = 138.6 + rng.rand(20000)
+    lats = -35. + rng.rand(20000)
+    expected = core.convert_coordinate_system(lons, lats, epsg2=32754)
+    results = [None] * 4
+
+    def project(k):
+        for repeat in range(5):
+            results[k] = core.convert_coordinate_system(lons, lats,
+                                                        epsg2=32754,
+                                                        chunk_size=1000)
+
+    threads = [threading.Thread(target=project, args=(k, )) for k in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for xs, ys in results:
+        assert np.array_equal(xs, expected[0])
+        assert np.array_equal(ys, expected[1])
+
+
+def haversine(lon1, lat1, lon2, lat2):
+    lon1, lat1, lon2, lat2 = [math.radians(v) for v in (lon1, lat1, lon2, lat2)]
+    a = (math.sin((lat2 - lat1) / 2) ** 2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * core.EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+def test_geodesic_steps():
+    lons = [0., 0., 1., 1., np.nan, 1., 0., 0.]
+    lats = [0., 1., 1., 1., 5., 0., 0., 0.]
+    times = [0., 10., 20., 30., 40., 50., 60., 60.]
+    g = core.geodesic(lons, lats, times)
+    degree = core.EARTH_RADIUS * math.pi / 180
+    assert np.isclose(g.distances[1], degree)
+    assert np.isclose(g.distances[2], haversine(0, 1, 1, 1))
+    assert g.distances[0] == 0 and g.distances[3] == 0
+    assert np.isnan(g.distances[[4, 5]]).all()
+    assert np.isclose(g.distances[6], degree)
+    assert np.isclose(g.cumulative[-1], np.nansum(g.distances))
+    # North, then nearly east, nowhere, across the gap, west, nowhere.
+    assert np.isnan(g.bearings[[0, 3, 4, 5, 7]]).all()
+    assert np.isclose(g.bearings[1], 0)
+    assert np.isclose(g.bearings[2], 90, atol=0.01)
+    assert np.isclose(g.bearings[6], 270)
+    assert np.isclose(g.speeds[1], degree / 10)
+    # No time passes in the last step.
+    assert np.isnan(g.speeds[[0, 7]]).all()
+
+
+def test_geodesic_float32():
+    rng = np.random.RandomState(0)
+    lons = 138.6 + np.cumsum(rng.normal(0, 1e-5, 10000))
+    lats = -35. + np.cumsum(rng.normal(0, 1e-5, 10000))
+    times = np.arange(10000.)
+    g64 = core.geodesic(lons, lats, times)
+    g32 = core.geodesic(lons, lats, times, dtype=np.float32)
+    for name in g64._fields:
+        assert getattr(g32, name).dtype == np.float32
+    # Steps of about a metre keep their precision in float32.
+    assert np.allclose(g32.distances, g64.distances, rtol=1e-4, atol=1e-4)
+    assert np.allclose(g32.speeds[1:], g64.speeds[1:], rtol=1e-4)
+    assert np.allclose(g32.cumulative, g64.cumulative, rtol=1e-5)
+    assert np.isclose(g64.distances[1],
+                      haversine(lons[0], lats[0], lons[1], lats[1]))
@@ -0,0 +1,95 @@
+import numpy as np
+
+from pyxie import decimate
+
+
+def random_path(n, seed=0):
+    rng = np.random.RandomState(seed)
+    return np.cumsum(rng.normal(size=n)), np.cumsum(rng.normal(size=n))
+
+
+def segment_distance(x, y, x0, y0, x1, y1):
+    return decimate._segment_distances(np.array([x]), np.array([y]),
+                                       x0, y0, x1, y1)[0]
+
+
+def test_importance_keeps_ends_and_extreme():
+    xs = np.array([0., 1, 2, 3, 4, 5, 6])
+    ys = np.array([0., 0.5, 1, 3, 1, 0.2, 0])
+    importance = decimate.douglas_peucker_importance(xs, ys)
+    assert np.isinf(importance[[0, -1]]).all()
+    # The furthest point from the line between the ends is split first.
+    assert np.argmax(np.where(np.isinf(importance), -1, importance)) == 3
+    assert importance[3] == 3
+    assert (importance[[1, 2, 4, 5]] < 3).all()
+
+
+def test_importance_tolerance_guarantee():
+    xs, ys = random_path(500)
+    xs[200] = np.nan
+    importance = decimate.douglas_peucker_importance(xs, ys)
+    assert np.isinf(importance[[0, 199, 200, 201, 499]]).all()
+    for tolerance in (0.5, 2., 10.):
+        kept = np.flatnonzero(importance >= tolerance)
+        # Every point dropped is within the tolerance of the segment
+        # between the kept points either side of it.
+        for k in range(len(xs)):
+            if k in kept or np.isnan(xs[k]):
+                continue
+            j = np.searchsorted(kept, k)
+            a, b = kept[j - 1], kept[j]
+            assert segment_distance(xs[k], ys[k], xs[a], ys[a], xs[b],
+                                    ys[b]) <= tolerance + 1e-9
+
+
+def test_path_select_bbox():
+    xs, ys = random_path(2000, seed=1)
+    decimator = decimate.PathDecimator(xs, ys)
+    x0, x1 = np.percentile(xs, [30, 60])
+    y0, y1 = np.percentile(ys, [30, 60])
+    tolerance = 0.5
+    selected = decimator.select(tolerance, bbox=(x0, y0, x1, y1))
+    inside = (xs >= x0) & (xs <= x1) & (ys >= y0) & (ys <= y1)
+    near = inside.copy()
+    near[1:] |= inside[:-1]
+    near[:-1] |= inside[1:]
+    kept = np.flatnonzero(decimator.importance >= tolerance)
+    assert set(selected) <= set(kept)
+    # All the kept points in view, and at most one kept point either side
+    # of the view besides the neighbours of points in it.
+    assert set(kept[inside[kept]]) <= set(selected)
+    outside = [k for k in selected if not near[k]]
+    assert len(outside) <= 2
+    assert np.array_equal(selected, np.sort(selected))
+    assert np.array_equal(decimator.select(tolerance), kept)
+
+
+def test_series_levels_hold_bucket_extremes():
+    rng = np.random.RandomState(2)
+    ys = rng.normal(size=1000)
+    ys[rng.rand(1000) < 0.1] = np.nan
+    ys[512:520] = np.nan
+    decimator = decimate.SeriesDecimator(np.arange(1000.), ys)
+    for level, (mins, maxs) in enumerate(decimator.levels):
+        size = 2 ** (level + 1)
+        for b in range(len(mins)):
+            bucket = ys[b * size:(b + 1) * size]
+            if np.isnan(bucket).all():
+                continue
+            assert ys[mins[b]] == np.nanmin(bucket)
+            assert ys[maxs[b]] == np.nanmax(bucket)
+
+
+def test_series_select_keeps_extremes():
+    rng = np.random.RandomState(3)
+    ys = rng.normal(size=10000)
+    xs = np.arange(10000.)
+    decimator = decimate.SeriesDecimator(xs, ys)
+    selected = decimator.select(1000, 8000, 100)
+    assert len(selected) < 1000
+    assert selected[0] == 999 and selected[-1] == 8001
+    # Whatever buckets were drawn, the extremes of the range are in them.
+    window = slice(999, 8002)
+    assert ys[selected].min() == ys[window].min()
+    assert ys[selected].max() == ys[window].max()
+    assert np.array_equal(decimator.select(10, 20, 100), np.arange(9, 22))
@@ -0,0 +1,283 @@
+import calendar
+import zipfile
+try:
+    import cStringIO as StringIO
+except ImportError:
+    import StringIO
+
+import numpy as np
+
+from pyxie import cache
+from pyxie.config import config
+from pyxie import io
+from pyxie import xmlmisc
+
+
+GPX = '''<?xml version="1.0" encoding="UTF-8"?>
+<gpx xmlns="http://www.topografix.com/GPX/1/1" version="1.1" creator="test">
+<metadata><time>2000-01-01T00:00:00Z</time></metadata>
+<trk><name>test</name>
+<trkseg>
+<trkpt lat="-35.0001252349" lon="138.5810883343"><ele>47.72</ele><time>2013-08-08T06:06:04Z</time></trkpt>
+<trkpt lat="-35.0001" lon="138.581"><time>2013-08-08T06:06:05.250Z</time></trkpt>
+<trkpt lat="-35.0002" lon="138.582"><ele>48.5</ele></trkpt>
+</trkseg>
+<trkseg>
+<trkpt lat="-35.0003" lon="138.583"><ele>49</ele><time>2013-08-08T16:06:07+10:00</time></trkpt>
+<trkpt lat="-35.0004" lon="138.584"><ele>-1.5</ele><time>2013-08-08T06:06:08.5-09:30</time></trkpt>
+<trkpt lat="-35.0005" lon="138.585"/>
+</trkseg>
+</trk>
+</gpx>
+'''
+
+EPOCH = calendar.timegm((2013, 8, 8, 6, 6, 4))
+
+EXPECTED = np.array([
+    [EPOCH, 138.5810883343, -35.0001252349, 47.72],
+    [EPOCH + 1.25, 138.581, -35.0001, np.nan],
+    [np.nan, 138.582, -35.0002, 48.5],
+    [EPOCH + 3, 138.583, -35.0003, 49],
+    [EPOCH + 4.5 + 9.5 * 3600, 138.584, -35.0004, -1.5],
+    [np.nan, 138.585, -35.0005, np.nan]])
+
+
+def read_gpx_iterparse(fileobj):
+    '''The read_gpx which io.read_gpx replaced.'''
+    rows = []
+    for trkpt, elem in xmlmisc.iterparse(fileobj, cls=xmlmisc.GPXTrackpoint):
+        if trkpt:
+            elev = elem.elev
+            rows.append((elem.time, elem.lon, elem.lat,
+                         np.nan if elev is None else elev))
+    return np.array(rows, dtype=np.float64).reshape(-1, 4)
+
+
+def assert_same(a, b):
+    assert a.shape == b.shape
+    assert np.array_equal(np.isnan(a), np.isnan(b))
+    assert np.array_equal(a[~np.isnan(a)], b[~np.isnan(b)])
+
+
+def test_read_gpx_values():
+    assert_same(io.read_gpx(StringIO.StringIO(GPX)), EXPECTED)
+
+
+def test_read_gpx_matches_iterparse():
+    assert_same(io.read_gpx(StringIO.StringIO(GPX)),
+                read_gpx_iterparse(StringIO.StringIO(GPX)))
+
+
+def test_iter_gpx_segments_and_chunks():
+    for chunk_size in (1, 2, 4, 65536):
+        chunks = list(io.iter_gpx(StringIO.StringIO(GPX), chunk_size=chunk_size))
+        assert all(len(chunk) == chunk_size for chunk in chunks[:-1])
+        segments = np.concatenate([chunk['segment'] for chunk in chunks])
+        assert segments.tolist() == [0, 0, 0, 1, 1, 1]
+        assert_same(io.chunks_to_coords(chunks), EXPECTED)
+
+
+def test_read_gpx_empty():
+    gpx = '<gpx xmlns="http://www.topografix.com/GPX/1/1"><trk/></gpx>'
+    assert io.read_gpx(StringIO.StringIO(gpx)).shape == (0, 4)
+
+
+CSV = '''time,lon,lat,ele,owner
+2013-08-08T06:06:04Z,138.581,-35.0001,47.5,alice
+
+2013-08-08T06:06:05Z,138.582,-35.0002,,bob
+2013-08-08T06:06:06Z,n/a,-35.0003,48,alice
+2013-08-08T06:06:07Z,138.584,-35.0004, 49 ,alice
+short,line
+2013-08-08T06:06:08Z,138.585,-35.0005,high,bob
+2013-08-08T06:06:09Z,,-35.0006,50,bob
+
+
+'''
+
+
+def test_read_csv_rows():
+    coords = io.read_csv(StringIO.StringIO(CSV))
+    # Rows without a longitude are dropped, and a bad elevation is NaN
+    # without affecting the others.
+    assert_same(coords[:, 1:], np.array([[138.581, -35.0001, 47.5],
+                                         [138.582, -35.0002, np.nan],
+                                         [138.584, -35.0004, 49],
+                                         [138.585, -35.0005, np.nan]]))
+    assert coords[:, 0].tolist() == [EPOCH, EPOCH + 1, EPOCH + 3, EPOCH + 4]
+
+
+def test_read_csv_bad_times():
+    text = ('time,lon,lat\n2013-08-08T06:06:04Z,1,2\ngarbage,3,4\n'
+            '2013-08-08T06:06:06Z,5,6\n2013-13-45T99:00:00Z,7,8\n')
+    coords = io.read_csv(StringIO.StringIO(text))
+    assert_same(coords[:, 0], np.array([EPOCH, np.nan, EPOCH + 2, np.nan]))
+    assert coords[:, 1].tolist() == [1, 3, 5, 7]
+
+
+def test_csv_parse_cache_follows_settings(tmpdir):
+    fn = str(tmpdir.join('a.csv'))
+    with open(fn, 'w') as f:
+        f.write('time,x,y,lon,lat\n1,2,3,4,5\n')
+    parse_cache = cache.ParseCache(str(tmpdir.join('cache')))
+    old_columns = config.get('csv', 'columns')
+    try:
+        config.set('csv', 'columns', '')
+        assert io.read_track_cached(fn, parse_cache)[0, 1] == 4
+        config.set('csv', 'columns', 'time=time, lon=x, lat=y')
+        assert io.read_track_cached(fn, parse_cache)[0, 1] == 2
+    finally:
+        config.set('csv', 'columns', old_columns)
+    assert io.parser_version('a.gpx') == io.PARSER_VERSION
+
+
+def test_iter_csv_chunk_sizes():
+    expected = list(io.iter_csv(StringIO.StringIO(CSV)))
+    for chunk_size in (1, 2, 8, 50, 100):
+        chunks = list(io.iter_csv(StringIO.StringIO(CSV),
+                                  chunk_size=chunk_size))
+        assert all(len(chunk) for chunk in chunks)
+        assert_same(io.chunks_to_coords(chunks), io.chunks_to_coords(expected))
+        assert (io.chunks_to_owners(chunks) ==
+                io.chunks_to_owners(expected)).all()
+
+
+def test_read_csv_without_rows():
+    assert io.read_csv(StringIO.StringIO('time,lon,lat\n')).shape == (0, 4)
+    assert io.read_csv(StringIO.StringIO('time,lon,lat\n\n\n')).shape == (0, 4)
+    coords = io.read_csv(StringIO.StringIO('time,lon,lat\n1,2,3\nx\nx\nx\n'),
+                         chunk_size=8)
+    assert_same(coords, np.array([[1., 2., 3., np.nan]]))
+
+
+NMEA = '''$GPGGA,235958,3500.000,S,13835.000,E,1,08,0.9,47.0,M,,,,
+$GPGSV,3,1,12,01,40,083,46
+$GPGGA,235959,3500.001,S,13835.001,E,1,08,0.9,47.5,M,,,,
+$GPGGA,000000,3500.002,S,13835.002,E,1,08,0.9,48.0,M,,,,
+$GPRMC,000000,A,3500.002,S,13835.002,E,0.0,0.0,010120,,
+$GPGGA,000001,3500.003,S,13835.003,E,1,08,0.9,48.5,M,,,,
+$GPGGA,000002,3500.004,S,13835.004,E,0,08,0.9,49.0,M,,,,
+$GPRMC,000003,A,3500.005,S,13835.005,E,0.0,0.0,010120,,
+'''
+
+
+def test_iter_nmea_chunk_sizes():
+    coords = io.read_nmea(StringIO.StringIO(NMEA))
+    day = calendar.timegm((2020, 1, 1, 0, 0, 0))
+    # The fixes before the first RMC sentence are on the day before it.
+    assert coords[:, 0].tolist() == [day - 2, day - 1, day, day + 1, day + 3]
+    assert_same(coords[:, 3], np.array([47, 47.5, 48, 48.5, np.nan]))
+    for chunk_size in (1, 10, 60, 100, 200):
+        assert_same(io.read_nmea(StringIO.StringIO(NMEA),
+                                 chunk_size=chunk_size), coords)
+
+
+def test_iter_nmea_without_dates():
+    gga = ''.join(line + '\n' for line in NMEA.splitlines()
+                  if 'GGA' in line)
+    for chunk_size in (60, 1 << 22):
+        coords = io.read_nmea(StringIO.StringIO(gga), chunk_size=chunk_size)
+        assert coords.shape == (4, 4)
+        assert np.isnan(coords[:, 0]).all()
+        coords = io.read_nmea(StringIO.StringIO(gga), chunk_size=chunk_size,
+                              date='2019-12-31')
+        day = calendar.timegm((2019, 12, 31, 0, 0, 0))
+        assert coords[:, 0].tolist() == [day + 86398, day + 86399,
+                                         day + 86400, day + 86401]
+
+
+def test_write_gpx_round_trip(tmpdir):
+    rng = np.random.RandomState(0)
+    coords = np.empty((300, 4))
+    coords[:, 0] = EPOCH + np.arange(300) * 1.25
+    coords[:, 1] = 138.58 + rng.rand(300) * 1e-2
+    coords[:, 2] = -35. + rng.rand(300) * 1e-2
+    coords[:, 3] = np.round(rng.rand(300) * 100, 3)
+    coords[10:20, 0] = np.nan
+    coords[15:30, 3] = np.nan
+    fn = str(tmpdir.join('a.gpx'))
+    for chunk_size in (7, 65536):
+        assert io.write_gpx(fn, coords, name='a & b',
+                            chunk_size=chunk_size) == 300
+        result = io.read_gpx(fn)
+        assert_same(result[:, [0, 3]], coords[:, [0, 3]])
+        assert np.allclose(result[:, 1:3], coords[:, 1:3], rtol=0,
+                           atol=1e-10)
+        chunks = list(io.iter_gpx(fn))
+        assert set(np.concatenate([c['segment'] for c in chunks])) == set([0])
+
+
+def test_write_gpx_segments_and_missing_positions():
+    coords = EXPECTED.copy()
+    coords[1, 1] = np.nan
+    dest = StringIO.StringIO()
+    assert io.write_gpx(dest, coords, segments=[0, 0, 0, 1, 1, 1]) == 5
+    chunks = list(io.iter_gpx(StringIO.StringIO(dest.getvalue())))
+    segments = np.concatenate([chunk['segment'] for chunk in chunks])
+    # The point without a longitude is skipped and ends its segment.
+    assert segments.tolist() == [0, 1, 2, 2, 2]
+    assert_same(io.chunks_to_coords(chunks), EXPECTED[[0, 2, 3, 4, 5]])
+
+
+def test_split_at_gaps():
+    times = np.array([0., 10, 20, 200, 210, np.nan, 215, 1000])
+    assert io.split_at_gaps(times, 60).tolist() == [0, 3, 7]
+    assert io.split_at_gaps(times, 1e6).tolist() == [0]
+    assert io.split_at_gaps([], 60).tolist() == []
+
+
+def test_split_gpx(tmpdir):
+    coords = EXPECTED.copy()
+    pattern = str(tmpdir.join('part-%02d.gpx'))
+    counts = io.split_gpx(coords, [1, 3, 5], pattern, chunk_size=2,
+                          names=['one', 'two', 'three'])
+    assert counts == [2, 2, 1]
+    assert sorted(tmpdir.listdir()) == [tmpdir.join('part-%02d.gpx' % k)
+                                        for k in (1, 2, 3)]
+    for k, (i, j) in enumerate([(1, 3), (3, 5), (5, 6)]):
+        fn = pattern % (k + 1)
+        assert_same(io.read_gpx(fn), EXPECTED[i:j])
+        assert '<name>%s</name>' % ['one', 'two', 'three'][k] in open(fn).read()
+
+
+KML = '''<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2"
+     xmlns:gx="http://www.google.com/kml/ext/2.2">
+<Document><Placemark><LineString><coordinates>
+  138.58,-35.0,47 138.59,-35.01
+  138.6,-35.02,49.5
+</coordinates></LineString></Placemark>
+<Placemark><gx:Track>
+  <when>2013-08-08T06:06:04Z</when>
+  <when>2013-08-08T16:06:05.5+10:00</when>
+  <gx:coord>138.61 -35.03 50</gx:coord>
+  <gx:coord>138.62 -35.04 51</gx:coord>
+</gx:Track></Placemark></Document></kml>
+'''
+
+KML_EXPECTED = np.array([
+    [np.nan, 138.58, -35.0, 47],
+    [np.nan, 138.59, -35.01, np.nan],
+    [np.nan, 138.6, -35.02, 49.5],
+    [EPOCH, 138.61, -35.03, 50],
+    [EPOCH + 1.5, 138.62, -35.04, 51]])
+
+
+def test_read_kml():
+    assert_same(io.read_kml(StringIO.StringIO(KML)), KML_EXPECTED)
+    chunks = list(io.iter_kml(StringIO.StringIO(KML), chunk_size=2))
+    assert all(len(chunk) <= 2 for chunk in chunks)
+    segments = np.concatenate([chunk['segment'] for chunk in chunks])
+    assert segments.tolist() == [0, 0, 0, 1, 1]
+    assert_same(io.chunks_to_coords(chunks), KML_EXPECTED)
+
+
+def test_read_kmz(tmpdir):
+    fn = str(tmpdir.join('a.kmz'))
+    with zipfile.ZipFile(fn, 'w', zipfile.ZIP_DEFLATED) as kmz:
+        kmz.writestr('files/readme.txt', 'not a track')
+        kmz.writestr('doc.kml', KML)
+    assert io.track_format(fn) == 'kmz'
+    assert_same(io.read_track(fn), KML_EXPECTED)
+    with open(fn, 'rb') as f:
+        assert_same(io.read_kml(f), KML_EXPECTED)
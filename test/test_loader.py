@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+# The loader's job classes need Qt, but the bundles tested here do not.
+pytest.importorskip('PyQt4')
+
+from pyxie.gui import loader
+
+
+POINT = ('<trkpt lat="%.6f" lon="%.6f"><ele>%.1f</ele>'
+         '<time>2013-08-08T06:%02d:%02dZ</time></trkpt>\n')
+
+
+def make_gpx(n=40):
+    points = [POINT % (-35 + 0.0001 * k, 138.58 + 0.0002 * k, 40 + k % 7,
+                       k // 60, k % 60)
+              for k in range(n)]
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<gpx xmlns="http://www.topografix.com/GPX/1/1" version="1.1" '
+            'creator="test">\n'
+            '<metadata><time>2000-01-01T00:00:00Z</time></metadata>\n'
+            '<trk><name>test</name>\n<trkseg>\n%s</trkseg>\n<trkseg>\n%s'
+            '</trkseg>\n</trk>\n</gpx>\n' % (''.join(points[:n // 2]),
+                                              ''.join(points[n // 2:])))
+
+
+def check_edit(text, new, spliced=True):
+    previous = loader.TrackData.from_text(text)
+    assert (previous._splice_text(new) is not None) == spliced
+    edited = previous.edited(new)
+    full = loader.TrackData.from_text(new)
+    np.testing.assert_array_equal(edited.coords, full.coords)
+    np.testing.assert_array_equal(edited.trkpt_spans(), full.trkpt_spans())
+    np.testing.assert_array_equal(edited.trkpt_positions(),
+                                  full.trkpt_positions())
+    np.testing.assert_allclose(edited.xs, full.xs)
+    np.testing.assert_allclose(edited.ys, full.ys)
+    np.testing.assert_array_equal(edited.speeds, full.speeds)
+    return edited
+
+
+def nth(text, sub, n):
+    k = -1
+    for _ in range(n + 1):
+        k = text.index(sub, k + 1)
+    return k
+
+
+def test_edit_inside_trkpt():
+    text = make_gpx()
+    k = nth(text, '<ele>', 5) + len('<ele>')
+    new = text[:k] + '1234.5' + text[text.index('<', k):]
+    edited = check_edit(text, new)
+    assert edited.coords[5, 3] == 1234.5
+    # An edit which removes a point's time.
+    k = nth(text, '<time>', 13)  # after the metadata time
+    new = text[:k] + text[text.index('</trkpt>', k):]
+    edited = check_edit(text, new)
+    assert np.isnan(edited.coords[12, 0])
+
+
+def test_edit_across_trkpts():
+    text = make_gpx()
+    # Delete from inside one trkpt to inside another.
+    new = text[:nth(text, 'lon=', 3)] + text[nth(text, 'lon=', 9):]
+    edited = check_edit(text, new)
+    assert len(edited.coords) == 34
+    # Add points, and join the two segments.
+    k = nth(text, '<trkpt', 30)
+    new = text[:k] + POINT % (-34, 139, 1, 59, 1) * 3 + text[k:]
+    check_edit(text, new)
+    new = text.replace('</trkseg>\n<trkseg>\n', '', 1)
+    check_edit(text, new)
+    # Split a trkpt in two.
+    k = nth(text, '<time>', 7)
+    new = text[:k] + '</trkpt>\n<trkpt lat="-34.5" lon="138.5">' + text[k:]
+    edited = check_edit(text, new)
+    assert len(edited.coords) == 41
+
+
+def test_edit_header():
+    text = make_gpx()
+    new = text.replace('<name>test</name>', '<name>renamed</name>')
+    check_edit(text, new, spliced=False)
+    new = text.replace('2000-01-01', '2001-02-03')
+    check_edit(text, new, spliced=False)
+    new = text.replace('<trk>', '<trk><trkseg>\n%s</trkseg>' %
+                       (POINT % (-33, 137, 5, 0, 0)), 1)
+    edited = check_edit(text, new, spliced=False)
+    assert len(edited.coords) == 41
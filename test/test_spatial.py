@@ -0,0 +1,75 @@
+import numpy as np
+
+from pyxie import spatial
+
+
+def random_points(n, seed=0):
+    '''Return two clusters of points along random walks, with NaN gaps.'''
+    rng = np.random.RandomState(seed)
+    xs = 138.6 + np.cumsum(rng.normal(0, 1e-4, n))
+    ys = -35. + np.cumsum(rng.normal(0, 1e-4, n))
+    xs[n // 2:] += 0.5
+    xs[rng.rand(n) < 0.02] = np.nan
+    ys[rng.rand(n) < 0.02] = np.nan
+    return xs, ys
+
+
+def brute_nearest(xs, ys, x, y, k, x_scale):
+    distances = np.hypot((xs - x) * x_scale, ys - y)
+    distances[np.isnan(distances)] = np.inf
+    order = np.argsort(distances, kind='mergesort')[:k]
+    return distances[order]
+
+
+def test_bbox_matches_brute_force():
+    xs, ys = random_points(5000)
+    index = spatial.GridIndex(xs, ys, x_scale=np.cos(np.radians(35.)))
+    rng = np.random.RandomState(1)
+    boxes = [(-180, -90, 180, 90), (0, 0, 1, 1), (138.6, -35., 138.6, -35.)]
+    for k in range(100):
+        cx = np.nanmin(xs) + rng.rand() * (np.nanmax(xs) - np.nanmin(xs))
+        cy = np.nanmin(ys) + rng.rand() * (np.nanmax(ys) - np.nanmin(ys))
+        w, h = rng.rand(2) * 0.01
+        boxes.append((cx - w, cy - h, cx + w, cy + h))
+    for x0, y0, x1, y1 in boxes:
+        with np.errstate(invalid='ignore'):
+            expected = np.flatnonzero((xs >= x0) & (xs <= x1) &
+                                      (ys >= y0) & (ys <= y1))
+        assert np.array_equal(index.bbox(x0, y0, x1, y1), expected)
+
+
+def test_nearest_matches_brute_force():
+    xs, ys = random_points(5000, seed=2)
+    x_scale = np.cos(np.radians(35.))
+    index = spatial.GridIndex(xs, ys, x_scale=x_scale)
+    rng = np.random.RandomState(3)
+    queries = [(np.nanmean(xs), np.nanmean(ys)),
+               # Between the clusters, and far outside both, so the nearest
+               # points are well beyond the first search radius.
+               (138.85, -35.), (150., -20.)]
+    queries += [(138.5 + rng.rand(), -35.1 + rng.rand() * 0.2)
+                for k in range(50)]
+    for x, y in queries:
+        for k in (1, 5, 20):
+            indices, distances = index.nearest(x, y, k=k)
+            assert len(indices) == k
+            assert np.allclose(distances,
+                               brute_nearest(xs, ys, x, y, k, x_scale))
+            assert np.allclose(distances,
+                               np.hypot((xs[indices] - x) * x_scale,
+                                        ys[indices] - y))
+    assert index.nearest(138.85, -35., k=1)[1][0] > 10 * index.cell_size
+
+
+def test_within_and_tracks_through():
+    xs, ys = random_points(3000, seed=4)
+    index = spatial.GridIndex(xs, ys)
+    track_ids = np.arange(3000) // 100
+    valid = np.flatnonzero(~(np.isnan(xs) | np.isnan(ys)))
+    x, y = xs[valid[1000]], ys[valid[1000]]
+    radius = 5e-4
+    with np.errstate(invalid='ignore'):
+        expected = np.flatnonzero(np.hypot(xs - x, ys - y) <= radius)
+    assert np.array_equal(index.within(x, y, radius), expected)
+    assert np.array_equal(index.tracks_through(x, y, radius, track_ids),
+                          np.unique(track_ids[expected]))
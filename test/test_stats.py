@@ -0,0 +1,75 @@
+import numpy as np
+
+from pyxie import stats
+
+
+def random_track(n, seed=0):
+    '''Return times, lons, lats and elevs of a random walk with NaN gaps
+    in every column, stops, and times which go backwards.'''
+    rng = np.random.RandomState(seed)
+    times = np.cumsum(rng.choice([0., 1., 1., 2., 5., -3.], n)) + 1e9
+    lons = 138.6 + np.cumsum(rng.normal(0, 1e-5, n))
+    lats = -35. + np.cumsum(rng.normal(0, 1e-5, n))
+    elevs = 50 + np.cumsum(rng.normal(0, 0.5, n))
+    for column in (times, lons, lats, elevs):
+        column[rng.rand(n) < 0.05] = np.nan
+    lons[100:120] = np.nan
+    lats[100:120] = np.nan
+    return times, lons, lats, elevs
+
+
+def assert_stats_equal(a, b):
+    for name in stats.TrackStats.__slots__:
+        x = np.asarray(getattr(a, name), dtype=np.float64)
+        y = np.asarray(getattr(b, name), dtype=np.float64)
+        assert np.allclose(x, y, rtol=1e-9, atol=1e-6, equal_nan=True), \
+            (name, x, y)
+
+
+def test_selection_stats_match_track_stats():
+    times, lons, lats, elevs = random_track(2000)
+    selection = stats.SelectionStats(times, lons, lats, elevs)
+    rng = np.random.RandomState(1)
+    ranges = [(0, 2000), (0, 0), (5, 6), (5, 7), (99, 121), (1990, 2000)]
+    ranges += [tuple(sorted(rng.randint(0, 2001, 2))) for k in range(200)]
+    for i, j in ranges:
+        expected = stats.track_stats(times[i:j], lons[i:j], lats[i:j],
+                                     elevs[i:j])
+        assert_stats_equal(selection.query(i, j), expected)
+
+
+def test_range_max_matches_nanmax():
+    rng = np.random.RandomState(2)
+    values = rng.rand(1000)
+    values[rng.rand(1000) < 0.2] = np.nan
+    table = stats.RangeMax(values, block_size=16)
+    for k in range(300):
+        i, j = sorted(rng.randint(0, 1001, 2))
+        finite = values[i:j][~np.isnan(values[i:j])]
+        expected = finite.max() if len(finite) else np.nan
+        assert np.allclose(table.query(i, j), expected, equal_nan=True)
+
+
+def test_query_runs_matches_sums_of_runs():
+    times, lons, lats, elevs = random_track(2000)
+    selection = stats.SelectionStats(times, lons, lats, elevs)
+    indices = np.r_[5:6, 10:300, 302:303, 400:1500, 1990:2000]
+    starts, stops = stats.index_runs(indices)
+    assert starts.tolist() == [5, 10, 302, 400, 1990]
+    assert stops.tolist() == [6, 300, 303, 1500, 2000]
+    result = selection.query_runs(starts, stops)
+    parts = [stats.track_stats(times[i:j], lons[i:j], lats[i:j], elevs[i:j])
+             for i, j in zip(starts, stops)]
+    assert result.npoints == len(indices)
+    for name in ('distance', 'total_time', 'moving_time', 'elev_gain',
+                 'elev_loss'):
+        expected = np.nansum([getattr(part, name) for part in parts])
+        assert np.isclose(getattr(result, name), expected), name
+    assert np.isclose(result.max_speed,
+                      np.nanmax([part.max_speed for part in parts]))
+    assert np.allclose(result.bounds,
+                       stats.track_stats(times[indices], lons[indices],
+                                         lats[indices]).bounds)
+    assert_stats_equal(selection.query_runs([10], [300]),
+                       selection.query(10, 300))
+    assert selection.query_runs([], []).npoints == 0
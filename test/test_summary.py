@@ -0,0 +1,62 @@
+import os
+
+import numpy as np
+import pytest
+
+from pyxie import io
+from pyxie import summary
+
+
+GPX = '''<gpx xmlns="http://www.topografix.com/GPX/1/1"><trk><trkseg>
+<trkpt lat="-35.0" lon="138.58"><ele>47</ele><time>2013-08-08T06:06:04Z</time></trkpt>
+<trkpt lat="-35.001" lon="138.581"><ele>48</ele><time>2013-08-08T06:06:14Z</time></trkpt>
+</trkseg></trk></gpx>
+'''
+
+
+class CountingReader(object):
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, path):
+        self.calls += 1
+        return io.read_track(path)
+
+
+def test_summary_stored(tmpdir):
+    fn = str(tmpdir.join('a.gpx'))
+    with open(fn, 'w') as f:
+        f.write(GPX)
+    store = summary.SummaryStore(str(tmpdir.join('s.sqlite')))
+    reader = CountingReader()
+    s = store.load(fn, reader=reader)
+    assert s.npoints == 2
+    assert np.isclose(s.tmax - s.tmin, 10)
+    assert store.load(fn, reader=reader).npoints == 2
+    assert reader.calls == 1
+
+
+def test_failure_retried_after_change(tmpdir):
+    fn = str(tmpdir.join('bad.gpx'))
+    with open(fn, 'w') as f:
+        f.write('<gpx><trk>')
+    store = summary.SummaryStore(str(tmpdir.join('s.sqlite')))
+    reader = CountingReader()
+    with pytest.raises(summary.SummaryError):
+        store.load(fn, reader=reader)
+    # A failure is remembered, also by a new store on the same database.
+    with pytest.raises(summary.SummaryError):
+        summary.SummaryStore(store.filename).load(fn, reader=reader)
+    assert reader.calls == 1
+    assert store.get_failure(fn) is not None
+
+    with open(fn, 'w') as f:
+        f.write(GPX)
+    st = os.stat(fn)
+    os.utime(fn, (st.st_atime, st.st_mtime + 10))
+    assert store.load(fn, reader=reader).npoints == 2
+    assert reader.calls == 2
+    assert store.get_failure(fn) is None
+
+    os.remove(fn)
+    assert store.remove_missing() == 1
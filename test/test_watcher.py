@@ -0,0 +1,82 @@
+import os
+
+import pytest
+
+from pyxie import archive
+from pyxie import cache
+from pyxie import watcher
+
+
+POINT = ('<trkpt lat="%.4f" lon="%.4f">'
+         '<time>2013-08-08T06:06:%02dZ</time></trkpt>\n')
+
+
+def write_gpx(path, n):
+    points = ''.join(POINT % (-35 + 0.001 * k, 138.6 + 0.001 * k, k)
+                     for k in range(n))
+    path.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+               '<gpx xmlns="http://www.topografix.com/GPX/1/1" version="1.1">\n'
+               '<trk><trkseg>\n%s</trkseg></trk>\n</gpx>\n' % points)
+    return str(path)
+
+
+@pytest.fixture
+def parse_cache(tmpdir, monkeypatch):
+    pc = cache.ParseCache(str(tmpdir.join('cache')), max_size=10**6)
+    monkeypatch.setattr(cache, '_default_cache', pc)
+    return pc
+
+
+def npoints(archive_path):
+    a = archive.Archive(archive_path)
+    return dict((source, a.tracks[a.track_id(source)]['npoints'])
+                for source in a.sources)
+
+
+def test_find_changes_and_sync(tmpdir, parse_cache):
+    root = tmpdir.mkdir('tracks')
+    archive_path = str(tmpdir.join('archive'))
+    a = write_gpx(root.join('a.gpx'), 3)
+    b = write_gpx(root.mkdir('sub').join('b.gpx'), 4)
+    root.join('notes.txt').write('not a track')
+    w = watcher.Watcher(str(root), archive_path, processes=1)
+    assert w.sync() == watcher.Changes([a, b], [], [])
+    assert npoints(archive_path) == {a: 3, b: 4}
+    assert w.sync() == watcher.Changes([], [], [])
+
+    # Touching a file only updates its manifest entry.
+    st = os.stat(a)
+    os.utime(a, (st.st_atime, st.st_mtime + 10))
+    changes, entries = w.find_changes()
+    assert changes == watcher.Changes([], [], [])
+    assert list(entries) == [a]
+    assert w.sync() == watcher.Changes([], [], [])
+    assert w.manifest[a][1] == os.path.getmtime(a)
+    assert w.find_changes() == (watcher.Changes([], [], []), {})
+
+    # Modify, add and delete.
+    write_gpx(root.join('sub', 'b.gpx'), 6)
+    c = write_gpx(root.join('c.gpx'), 2)
+    os.remove(a)
+    assert w.sync() == watcher.Changes([c], [b], [a])
+    assert npoints(archive_path) == {b: 6, c: 2}
+
+    # A new watcher picks up from the saved manifest.
+    w = watcher.Watcher(str(root), archive_path, processes=1)
+    assert w.sync() == watcher.Changes([], [], [])
+
+
+def test_sync_paths(tmpdir, parse_cache):
+    root = tmpdir.mkdir('tracks')
+    archive_path = str(tmpdir.join('archive'))
+    a = write_gpx(root.join('a.gpx'), 3)
+    b = write_gpx(root.join('b.gpx'), 4)
+    w = watcher.Watcher(str(root), archive_path, processes=1)
+    w.sync()
+    # Only the named files are looked at.
+    write_gpx(root.join('a.gpx'), 5)
+    os.remove(b)
+    other = str(root.join('other.txt'))
+    assert w.sync(paths=[a, other]) == watcher.Changes([], [a], [])
+    assert w.sync(paths=[b]) == watcher.Changes([], [], [b])
+    assert npoints(archive_path) == {a: 5}
@@ -0,0 +1,45 @@
+import calendar
+
+import numpy as np
+
+from pyxie import xmlmisc
+
+
+MIDNIGHT = calendar.timegm((2020, 1, 1, 0, 0, 0))
+
+
+def test_iso8601_to_epoch_suffixes():
+    texts = ['2020-01-01T00:00:00Z',
+             '2020-01-01T00:00:00',
+             '2020-01-01T01:00:00.5+01:00',
+             '2020-01-01T01:00:00,25+01',
+             '2020-01-01T01:30:00+0130',
+             '2019-12-31T22:30:00.125-0130',
+             '2019-12-31T22:30:00-01:30',
+             '2020-01-01T00:00:00.123456789Z',
+             '',
+             None]
+    expected = [0, 0, 0.5, 0.25, 0, 0.125, 0, 0.123456789, np.nan, np.nan]
+    epochs = xmlmisc.iso8601_to_epoch(texts) - MIDNIGHT
+    # Float64 epochs of this era resolve about 0.2 microseconds.
+    assert np.allclose(epochs, expected, rtol=0, atol=1e-6, equal_nan=True)
+
+
+def test_iso8601_to_epoch_inputs():
+    texts = ['2020-01-01T01:00:00.5+01:00', '2020-01-01T00:00:07Z']
+    expected = np.array([MIDNIGHT + 0.5, MIDNIGHT + 7])
+    assert np.array_equal(xmlmisc.iso8601_to_epoch(texts), expected)
+    # One buffer of whitespace-separated timestamps, and a byte string array.
+    assert np.array_equal(xmlmisc.iso8601_to_epoch(' \n'.join(texts)),
+                          expected)
+    assert np.array_equal(xmlmisc.iso8601_to_epoch(np.array(texts)), expected)
+    assert len(xmlmisc.iso8601_to_epoch([])) == 0
+
+
+def test_epoch_to_iso8601_inverse():
+    epochs = np.array([MIDNIGHT, MIDNIGHT + 1.25, np.nan])
+    texts = xmlmisc.epoch_to_iso8601(epochs)
+    assert texts.tolist() == ['2020-01-01T00:00:00.000Z',
+                              '2020-01-01T00:00:01.250Z', '']
+    assert np.allclose(xmlmisc.iso8601_to_epoch(texts), epochs,
+                       equal_nan=True)